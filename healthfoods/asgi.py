@@ -2,4 +2,8 @@
 import os
 from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'healthfoods.settings')
+os.environ.setdefault('ASYNC_VIEWS', '1')
+# Each ASGI request runs its ORM calls on a thread of its own, so persistent
+# connections would pile up instead of being reused.
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 application = get_asgi_application()
@@ -2,6 +2,7 @@
 from pathlib import Path
 import os
 from dotenv import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
 load_dotenv()
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -23,7 +24,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'store.instrumentation.InstrumentationMiddleware',
+    'store.catalog_cache.CacheVersionMiddleware',
+    'store.sessions.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -35,7 +38,8 @@ ROOT_URLCONF = 'healthfoods.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for store.instrumentation
+        'BACKEND': 'store.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'store' / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -50,13 +54,115 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'healthfoods.wsgi.application'
-
-DATABASES = {
+# Route the catalogue, cart, checkout and webhook URLs to store.async_views.
+# healthfoods/asgi.py turns this on; under WSGI the sync views are used.
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "0") == "1"
+
+# Database profile, chosen with DB_PROFILE:
+#   sqlite        SQLite tuned for concurrent requests (default)
+#   sqlite-basic  SQLite with Django's defaults, kept for comparison
+#   postgres      PostgreSQL with a psycopg connection pool (pip install "psycopg[binary,pool]")
+DB_PROFILE = os.getenv("DB_PROFILE", "sqlite")
+DB_CONN_MAX_AGE = int(os.getenv("DB_CONN_MAX_AGE", "600"))
+
+if DB_PROFILE == "postgres":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv("POSTGRES_DB", "healthfoods"),
+            'USER': os.getenv("POSTGRES_USER", "healthfoods"),
+            'PASSWORD': os.getenv("POSTGRES_PASSWORD", ""),
+            'HOST': os.getenv("POSTGRES_HOST", "localhost"),
+            'PORT': os.getenv("POSTGRES_PORT", "5432"),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    if DB_POOL_SIZE:
+        # The pool keeps connections open itself; Django requires CONN_MAX_AGE = 0 with it.
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {'min_size': 2, 'max_size': DB_POOL_SIZE, 'timeout': 10},
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+elif DB_PROFILE == "sqlite-basic":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+elif DB_PROFILE == "sqlite":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                # Take the write lock at BEGIN, so a transaction never fails
+                # upgrading a read lock; waiters queue on busy_timeout instead.
+                'transaction_mode': 'IMMEDIATE',
+            },
+            # On disk rather than in memory, so concurrent tests queue on the lock as production does.
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+    # Applied to every new connection by store.signals.tune_sqlite.
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+        'busy_timeout': int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "20000")),
+    }
+else:
+    raise ImproperlyConfigured(f"Unknown DB_PROFILE {DB_PROFILE!r}")
+
+# Cache backend, chosen with CACHE_BACKEND: locmem (default, per process),
+# file (shared by processes on one host) or redis (any Redis-protocol server
+# at CACHE_LOCATION, e.g. Redis, Valkey or KeyDB; needs the redis package).
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "locmem")
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'healthfoods'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / '.cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),
+}
+if CACHE_BACKEND not in CACHE_BACKENDS:
+    raise ImproperlyConfigured(f"Unknown CACHE_BACKEND {CACHE_BACKEND!r}")
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': os.getenv("CACHE_LOCATION", CACHE_BACKENDS[CACHE_BACKEND][1]),
+        'OPTIONS': {'MAX_ENTRIES': 10000} if CACHE_BACKEND != 'redis' else {},
     }
 }
+# With a shared cache (file or redis), sessions live in the cache and reach
+# the database lazily (store.sessions): changed data at most every
+# SESSION_DB_WRITE_INTERVAL seconds, the sliding expiry at most every
+# SESSION_REFRESH_INTERVAL. The per-process locmem cache would lose session
+# changes between workers, so with it sessions stay in the database.
+SESSION_ENGINE = os.getenv(
+    "SESSION_ENGINE", "django.contrib.sessions.backends.db" if CACHE_BACKEND == "locmem" else "store.sessions"
+)
+SESSION_DB_WRITE_INTERVAL = int(os.getenv("SESSION_DB_WRITE_INTERVAL", "60"))
+SESSION_REFRESH_INTERVAL = int(os.getenv("SESSION_REFRESH_INTERVAL", "3600"))
+
+# Stock is held from starting a Stripe checkout until payment or expiry (store.stock);
+# run release_stock_holds every minute to return abandoned holds.
+STOCK_HOLD_SECONDS = int(os.getenv("STOCK_HOLD_SECONDS", str(35 * 60)))
+
+# How often each process checks for facet index writes made by other processes (store.facets).
+FACETS_CHECK_SECONDS = int(os.getenv("FACETS_CHECK_SECONDS", "5"))
+
+# Seconds an anonymous catalogue page stays cached, and how often each process
+# checks for catalogue changes made by other processes (store.catalog_cache).
+CATALOG_PAGE_TIMEOUT = int(os.getenv("CATALOG_PAGE_TIMEOUT", "600"))
+CATALOG_CHECK_SECONDS = int(os.getenv("CATALOG_CHECK_SECONDS", "5"))
+
+# Request metrics (store.instrumentation). /metrics/ is open to staff users and
+# to scrapers sending "Authorization: Bearer $METRICS_TOKEN". Requests slower
+# than INSTRUMENTATION_SLOW_REQUEST_MS are logged with their queries; 0 disables.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+INSTRUMENTATION_SLOW_REQUEST_MS = int(os.getenv("INSTRUMENTATION_SLOW_REQUEST_MS", "500")) or None
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',},
@@ -87,4 +193,12 @@ import os
 
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY", "")
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
-STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET","")
\ No newline at end of file
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET","")
+# Product search: "auto" uses SQLite FTS5 when available, else the token index.
+STORE_SEARCH_BACKEND = os.getenv("STORE_SEARCH_BACKEND", "auto")
+
+# Stripe gateway (store.payments). STRIPE_API_BASE points the client at a
+# local fake server in tests and benchmarks; leave empty for the real API.
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "")
+STRIPE_TIMEOUT = float(os.getenv("STRIPE_TIMEOUT", "10"))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", "2"))
@@ -1,13 +1,17 @@
 
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from store import images
+from store.views import image_rendition
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('vouchers/', include('vouchers.urls')),
     path('', include('store.urls')),
+    re_path(rf"^{settings.MEDIA_URL.lstrip('/')}{images.RENDITIONS_DIR}/(?P<path>[^/]+)$", image_rendition,
+            name='image_rendition'),
 ]
 
 if settings.DEBUG:
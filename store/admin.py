@@ -1,10 +1,223 @@
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Round
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-from django.contrib import admin
-from .models import Category, Product, Order, OrderItem, Wishlist, Review
+from . import cart, catalog_cache, event_queue, facets, search, stock
+from .models import (Category, Product, Order, OrderItem, Wishlist, Review, StripeEvent, Oversell, StockHold,
+                     snapshot_subtotal)
 
-admin.site.register(Category)
-admin.site.register(Product)
-admin.site.register(Order)
-admin.site.register(OrderItem)
-admin.site.register(Wishlist)
-admin.site.register(Review)
+def estimated_rows(model):
+    """
+    Rows in ``model``'s table from planner statistics (pg_class, or SQLite's
+    sqlite_stat1 once ANALYZE has run), or None if there are none.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [table])
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            # Each index's row starts with the number of rows in the table.
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts an unfiltered, unsearched changelist from table statistics, so
+    paging through a large table never runs COUNT(*) over it. Filtered and
+    searched lists, and tables without statistics, are counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where and not queryset.query.distinct:
+            estimate = estimated_rows(queryset.model)
+            if estimate is not None:
+                return estimate
+        return queryset.count()
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class CategoryAdmin(admin.ModelAdmin):
+    search_fields = ['name']
+
+
+class StockActionForm(ActionForm):
+    stock = forms.IntegerField(required=False, label="Stock change")
+
+
+class ProductAdmin(ScalableAdmin):
+    list_display = ['name', 'sku', 'category', 'price', 'stock', 'rating_avg']
+    list_select_related = ['category']
+    list_filter = ['category']
+    search_fields = ['=sku']
+    ordering = ['-pk']
+    autocomplete_fields = ['category']
+    action_form = StockActionForm
+    actions = ['adjust_stock']
+
+    def get_search_results(self, request, queryset, search_term):
+        # The storefront search index (and exact SKUs), not a LIKE over every name.
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        pks = [pk for pk, _ in search.search(term)]
+        return queryset.filter(Q(pk__in=pks) | Q(sku=term)), False
+
+    @admin.action(description="Add the stock change to the selected products")
+    def adjust_stock(self, request, queryset):
+        try:
+            change = int(request.POST.get('stock') or 0)
+        except ValueError:
+            change = 0
+        if not change:
+            self.message_user(request, "Enter a stock change, e.g. 10 or -5.", messages.WARNING)
+            return
+        pks = list(queryset.values_list('pk', flat=True))
+        with transaction.atomic():
+            updated = Product.objects.filter(pk__in=pks).update(stock=Greatest(F('stock') + change, 0))
+            # update() sends no signals: refile the facets and expire the pages here.
+            facets.update(pks)
+        catalog_cache.bump_products(pks)
+        self.message_user(request, f"Changed stock by {change:+d} on {updated} products.")
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 0
+    fields = ['product', 'quantity', 'product_name', 'unit_price']
+    autocomplete_fields = ['product']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+
+def _per_order(aggregate):
+    rows = OrderItem.objects.filter(order=OuterRef('pk')).values('order').annotate(value=aggregate).values('value')
+    return Subquery(rows)
+
+
+class OrderAdmin(ScalableAdmin):
+    list_display = ['id', 'user', 'created_at', 'is_paid', 'paid_at', 'line_count', 'total']
+    list_select_related = ['user']
+    list_filter = ['is_paid']
+    search_fields = ['=id', '=user__username', '=stripe_checkout_session_id']
+    date_hierarchy = 'paid_at'
+    raw_id_fields = ['user']
+    autocomplete_fields = ['voucher']
+    inlines = [OrderItemInline]
+    actions = ['mark_paid']
+
+    @admin.action(description="Mark the selected orders as paid (held stock becomes the sale; no other stock is taken)")
+    def mark_paid(self, request, queryset):
+        money = DecimalField(max_digits=12, decimal_places=2)
+        subtotal = Coalesce(_per_order(Sum(snapshot_subtotal())), Value(0), output_field=money)
+        discount = Round(subtotal * F('discount') / 100, 2, output_field=money)
+        pks = list(queryset.filter(is_paid=False).values_list('pk', flat=True))
+        with transaction.atomic():
+            # Settle any checkout holds, or release_stock_holds would hand the sold units back.
+            held = set(StockHold.objects.filter(order__in=pks).values_list('order_id', flat=True))
+            lines = {}
+            for order_id, product_id, quantity in OrderItem.objects.filter(order__in=held).values_list(
+                    'order_id', 'product_id', 'quantity'):
+                lines.setdefault(order_id, {})[product_id] = quantity
+            for order_id in held:
+                stock.convert(Order(pk=order_id), lines.get(order_id, {}))
+            cart.snapshot_prices(OrderItem.objects.filter(order__in=pks, unit_price__isnull=True))
+            paid_at = timezone.now()
+            updated = Order.objects.filter(pk__in=pks, is_paid=False).update(
+                is_paid=True, paid_at=paid_at,
+                line_count=Coalesce(_per_order(Count('id')), 0),
+                subtotal=subtotal, discount_amount=discount, total=subtotal - discount,
+            )
+            if updated:
+                event_queue.schedule_recommendations(paid_at)
+        for user_id in set(Order.objects.filter(pk__in=pks).values_list('user_id', flat=True)):
+            cart.invalidate(user_id)
+        # As fulfilment does through stock.stock_changed, expire the pages of the products sold.
+        catalog_cache.bump_products(set(OrderItem.objects.filter(order__in=pks).values_list('product_id', flat=True)))
+        self.message_user(request, f"Marked {updated} orders as paid.")
+
+    # Deleting an order's holds would lose their units: give them back to stock first.
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            stock.release_orders([obj.pk])
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            stock.release_orders(queryset.values_list('pk', flat=True))
+            super().delete_queryset(request, queryset)
+
+
+class OrderItemAdmin(ScalableAdmin):
+    list_display = ['order', 'product', 'quantity', 'unit_price']
+    list_select_related = ['order__user', 'product']
+    search_fields = ['=order__id']
+    raw_id_fields = ['order']
+    autocomplete_fields = ['product']
+
+
+class WishlistAdmin(ScalableAdmin):
+    list_select_related = ['user']
+    search_fields = ['=user__username']
+    raw_id_fields = ['user']
+    autocomplete_fields = ['products']
+
+
+class ReviewAdmin(ScalableAdmin):
+    list_display = ['product', 'user', 'rating', 'created_at']
+    list_select_related = ['product', 'user']
+    list_filter = ['rating']
+    search_fields = ['=user__username']
+    raw_id_fields = ['user']
+    autocomplete_fields = ['product']
+
+
+class StripeEventAdmin(ScalableAdmin):
+    list_display = ['event_id', 'type', 'status', 'attempts', 'created_at']
+    list_filter = ['status']
+    search_fields = ['=event_id']
+
+
+class OversellAdmin(ScalableAdmin):
+    list_display = ['order', 'product', 'requested', 'available', 'created_at']
+    list_select_related = ['order__user', 'product']
+    raw_id_fields = ['order']
+    autocomplete_fields = ['product']
+
+
+class StockHoldAdmin(ScalableAdmin):
+    list_display = ['order', 'product', 'quantity', 'expires_at']
+    list_select_related = ['order__user', 'product']
+    raw_id_fields = ['order']
+    autocomplete_fields = ['product']
+
+
+admin.site.register(Category, CategoryAdmin)
+admin.site.register(Product, ProductAdmin)
+admin.site.register(Order, OrderAdmin)
+admin.site.register(OrderItem, OrderItemAdmin)
+admin.site.register(Wishlist, WishlistAdmin)
+admin.site.register(Review, ReviewAdmin)
+admin.site.register(StripeEvent, StripeEventAdmin)
+admin.site.register(Oversell, OversellAdmin)
+admin.site.register(StockHold, StockHoldAdmin)
@@ -0,0 +1,204 @@
+"""
+Async versions of the read-heavy and I/O-bound storefront views, routed in
+place of the sync ones when ``settings.ASYNC_VIEWS`` is on (the ASGI
+deployment). They use the async ORM and the async Stripe client, so a
+request waiting on the database or on Stripe does not hold a worker thread.
+"""
+from decimal import Decimal
+from functools import wraps
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.shortcuts import aget_object_or_404, redirect, render
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+
+from vouchers import resolver
+from vouchers.forms import VoucherApplyForm
+
+from . import cart, catalog_cache, event_queue, facets, payments, recommendations, search, stock
+from .forms import ShippingForm
+from .models import OrderItem, Product, Review
+from .pagination import CursorPaginator, RankedCursorPaginator
+from .views import PRODUCT_SORTS
+
+
+def load_user(view):
+    """Resolve ``request.user`` without blocking, before anything else reads it."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        request.user = await request.auser()
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@load_user
+@condition(etag_func=catalog_cache.list_etag, last_modified_func=catalog_cache.list_last_modified)
+async def product_list(request):
+    page_key = catalog_cache.list_page_key(request) if catalog_cache.cacheable(request) else None
+    if page_key:
+        content = await cache.aget(page_key)
+        if content is not None:
+            return HttpResponse(content)
+
+    q = request.GET.get('q', '')
+    sort = request.GET.get('sort', '')
+    if sort not in PRODUCT_SORTS:
+        sort = ''
+    cursor = request.GET.get('cursor')
+    selection = facets.Selection(request.GET)
+    index = await facets.acurrent()
+    if q:
+        ranked, hits = index.filter_ranked(selection, await sync_to_async(search.search)(q))
+        products_page = RankedCursorPaginator(ranked, per_page=8).get_page(cursor)
+        page_ids = [pk for pk, _ in products_page]
+        found = {p.pk: p async for p in Product.objects.select_related('category').filter(pk__in=page_ids)}
+        products_page.object_list = [found[pk] for pk in page_ids if pk in found]
+    else:
+        hits = None
+        products = selection.filter(Product.objects.all().select_related('category'))
+        total = index.matching(selection).bit_count()
+        products_page = await CursorPaginator(products, PRODUCT_SORTS[sort], per_page=8, count=total).aget_page(cursor)
+    catalog_cache.annotate_card_versions(products_page.object_list)
+    response = render(request, "store/product_list.html", {
+        "products": products_page, "q": q, "sort": sort,
+        "facets": index.groups(selection, within=hits), "selection": selection,
+    })
+    if page_key and not response.cookies:
+        await cache.aset(page_key, response.content, catalog_cache.PAGE_TIMEOUT)
+    return response
+
+
+@load_user
+@condition(etag_func=catalog_cache.detail_etag, last_modified_func=catalog_cache.detail_last_modified)
+async def product_detail(request, pk):
+    product = await aget_object_or_404(Product.objects.select_related('category'), pk=pk)
+    can_review = False
+    if request.user.is_authenticated:
+        can_review = await OrderItem.objects.filter(
+            order__user=request.user, order__is_paid=True, product=product,
+        ).aexists()
+
+    if request.method == "POST":
+        if not request.user.is_authenticated:
+            messages.error(request, "Please log in to review.")
+            return redirect('login')
+        if not can_review:
+            messages.error(request, "You can only review items you've purchased.")
+            return redirect('product_detail', pk=pk)
+        rating = int(request.POST.get('rating', 0))
+        comment = (request.POST.get('comment') or '').strip()
+        if 1 <= rating <= 5:
+            await Review.objects.aupdate_or_create(
+                product=product, user=request.user,
+                defaults={'rating': rating, 'comment': comment}
+            )
+            messages.success(request, "Thanks for your review!")
+        else:
+            messages.error(request, "Please choose a rating between 1 and 5.")
+        return redirect('product_detail', pk=pk)
+
+    reviews = [r async for r in product.reviews.select_related('user').order_by('-created_at')]
+    return render(request, "store/product_detail.html", {
+        "product": product,
+        "reviews": reviews,
+        "avg_rating": product.rating_avg,
+        "can_review": can_review,
+        "recommended": await recommendations.asimilar_products(product.pk),
+    })
+
+
+@load_user
+@login_required
+async def cart_view(request):
+    order = await cart.aget_open_order(request)
+    lines = await cart.acart_lines(order) if order else []
+    summary = await cart.aget_summary(order) if order else cart.EMPTY_SUMMARY
+
+    total = summary["total"]
+    discount = Decimal("0")
+    new_total = total
+    voucher = await resolver.aget_voucher(request.session.get("voucher_id"))
+    if voucher:
+        discount = (total * Decimal(voucher.discount) / Decimal("100"))
+        new_total = total - discount
+
+    return render(request, "store/cart.html", {
+        "order": order,
+        "lines": lines,
+        "summary": summary,
+        "total": total,
+        "voucher": voucher,
+        "discount": discount,
+        "new_total": new_total,
+        "voucher_apply_form": VoucherApplyForm(),
+    })
+
+
+@load_user
+@login_required
+async def create_checkout_session(request):
+    if request.method != "POST":
+        messages.error(request, "Invalid method.")
+        return redirect("checkout")
+
+    order = await cart.aopen_order_or_404(request)
+    if not await order.items.aexists():
+        messages.error(request, "Your cart is empty.")
+        return redirect("cart")
+
+    form = ShippingForm(request.POST, instance=order)
+    if not await sync_to_async(form.is_valid)():
+        messages.error(request, "Please fix the shipping details below.")
+        return redirect("checkout")
+    form.save(commit=False)
+
+    voucher = await resolver.aget_voucher(request.session.get("voucher_id"))
+    if voucher:
+        order.voucher = voucher
+        order.discount = int(voucher.discount)
+
+    success_url = request.build_absolute_uri(reverse("payment_success")) + "?session_id={CHECKOUT_SESSION_ID}"
+    cancel_url = request.build_absolute_uri(reverse("payment_cancel"))
+
+    try:
+        expires_at = await sync_to_async(stock.reserve)(order)
+    except stock.OutOfStock as exc:
+        messages.error(request, str(exc))
+        return redirect("cart")
+
+    await cart.asnapshot_prices(order.items.all())
+    lines = [item async for item in order.items.order_by('pk')]
+    try:
+        session = await payments.acreate_checkout_session(
+            order, lines, voucher, success_url, cancel_url,
+            customer_email=request.user.email or None, expires_at=stock.checkout_expires_at(expires_at),
+        )
+    except Exception:
+        await sync_to_async(stock.release_orders)([order.pk])
+        raise
+
+    order.stripe_checkout_session_id = session.id
+    await order.asave()
+    return redirect(session.url, code=303)
+
+
+@csrf_exempt
+async def stripe_webhook(request):
+    payload = request.body
+    sig_header = request.META.get("HTTP_STRIPE_SIGNATURE", "")
+    try:
+        event = stripe.Webhook.construct_event(
+            payload=payload, sig_header=sig_header, secret=settings.STRIPE_WEBHOOK_SECRET
+        )
+    except (ValueError, stripe.error.SignatureVerificationError):
+        return HttpResponse(status=400)
+
+    await event_queue.aenqueue(event.to_dict())
+    return HttpResponse(status=200)
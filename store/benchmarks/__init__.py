@@ -0,0 +1,6 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks never touch the configured database: they run inside a throwaway
+test database that is created and destroyed around each run.
+"""
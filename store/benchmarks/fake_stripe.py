@@ -0,0 +1,134 @@
+"""
+A local stand-in for Stripe's side of the integration.
+
+Builds webhook events and signs them exactly as Stripe does (HMAC-SHA256
+over ``"{timestamp}.{payload}"``), so ``stripe.Webhook.construct_event``
+accepts them without any network access, and serves the few API endpoints
+checkout uses from a local HTTP server.
+"""
+import hashlib
+import hmac
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+WEBHOOK_SECRET = "whsec_local_bench"
+
+_ids = itertools.count(1)
+
+
+def new_id(prefix):
+    return f"{prefix}_local{next(_ids):010d}"
+
+
+def sign(payload, secret=WEBHOOK_SECRET, timestamp=None):
+    """Return the ``Stripe-Signature`` header value for ``payload`` (str)."""
+    timestamp = int(timestamp or time.time())
+    mac = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256)
+    return f"t={timestamp},v1={mac.hexdigest()}"
+
+
+def event(event_type, obj, event_id=None):
+    return {
+        "id": event_id or new_id("evt"),
+        "object": "event",
+        "type": event_type,
+        "created": int(time.time()),
+        "data": {"object": obj},
+    }
+
+
+def checkout_completed(session_id, order_id=None, event_id=None):
+    return event("checkout.session.completed", {
+        "id": session_id,
+        "object": "checkout.session",
+        "payment_status": "paid",
+        "metadata": {"order_id": str(order_id)} if order_id else {},
+    }, event_id=event_id)
+
+
+def signed_request(evt, secret=WEBHOOK_SECRET):
+    """``(body, headers)`` ready for ``Client.post(..., **headers)``."""
+    body = json.dumps(evt)
+    return body, {"HTTP_STRIPE_SIGNATURE": sign(body, secret)}
+
+
+class FakeStripeServer:
+    """
+    Minimal local Stripe API (coupons and checkout sessions) on a random
+    port, with optional artificial latency. Use as a context manager and
+    point ``STRIPE_API_BASE`` at ``server.url``.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.coupons = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._httpd = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                form = {k: v[-1] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                status, body = server.handle(self.path, form)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("Request-Id", new_id("req"))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def handle(self, path, form):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[path] += 1
+            if path == "/v1/coupons":
+                coupon_id = form.get("id") or new_id("coupon")
+                if coupon_id in self.coupons:
+                    return 400, {"error": {
+                        "type": "invalid_request_error",
+                        "code": "resource_already_exists",
+                        "message": "Coupon already exists.",
+                    }}
+                self.coupons[coupon_id] = {"id": coupon_id, "object": "coupon",
+                                           "percent_off": float(form.get("percent_off", 0))}
+                return 200, self.coupons[coupon_id]
+            if path == "/v1/checkout/sessions":
+                session_id = new_id("cs")
+                return 200, {"id": session_id, "object": "checkout.session", "status": "open",
+                             "url": f"{self.url}/pay/{session_id}", "payment_status": "unpaid"}
+            if path.startswith("/v1/checkout/sessions/") and path.endswith("/expire"):
+                session_id = path.split("/")[-2]
+                return 200, {"id": session_id, "object": "checkout.session", "status": "expired",
+                             "payment_status": "unpaid"}
+        return 404, {"error": {"type": "invalid_request_error", "message": f"Unknown path {path}"}}
@@ -0,0 +1,67 @@
+import json
+from decimal import Decimal
+
+from django.conf import settings
+
+from store.models import Category, Product
+
+SAMPLE_DATA = settings.BASE_DIR / "large_sample_data.json"
+
+VARIANTS = [
+    "Classic", "Organic", "Family Pack", "Mini", "Premium",
+    "Value", "Wholefood", "Fresh", "Raw", "Sprouted",
+]
+
+
+def load_sample(path=SAMPLE_DATA):
+    """Return ``(categories, products)`` field dicts from a dumpdata fixture."""
+    with open(path, encoding="utf-8") as fh:
+        rows = json.load(fh)
+    categories = {r["pk"]: r["fields"] for r in rows if r["model"] == "store.category"}
+    products = [r["fields"] for r in rows if r["model"] == "store.product"]
+    return categories, products
+
+
+def synthetic_rows(total, start=0, path=SAMPLE_DATA):
+    """
+    Yield catalogue rows (the ``store.catalog_io.FIELDS`` dicts) for products
+    ``start`` to ``total - 1``, cycling through the sample fixture with
+    varied names, prices and SKUs.
+    """
+    sample_categories, sample_products = load_sample(path)
+    for i in range(start, total):
+        base = sample_products[i % len(sample_products)]
+        variant = VARIANTS[(i // len(sample_products)) % len(VARIANTS)]
+        yield {
+            "sku": f"SYN-{i:07d}",
+            "name": f"{variant} {base['name']} {i}",
+            "description": base["description"],
+            "price": str(Decimal(base["price"]) + Decimal(i % 100) / 100),
+            "stock": base["stock"],
+            "category": sample_categories[base["category"]]["name"],
+            "image": base.get("image") or "",
+        }
+
+
+def seed_catalogue(total, batch_size=5000, path=SAMPLE_DATA):
+    """
+    Grow the catalogue to ``total`` products from ``synthetic_rows``.
+    Returns the newly created products, each with its category attached so
+    they can be indexed without extra queries.
+    """
+    sample_categories, _ = load_sample(path)
+    categories = {}
+    for fields in sample_categories.values():
+        categories[fields["name"]], _ = Category.objects.get_or_create(name=fields["name"])
+
+    created = []
+    batch = []
+    for row in synthetic_rows(total, Product.objects.count(), path):
+        batch.append(Product(**{**row, "price": Decimal(row["price"]), "image": row["image"] or None,
+                                "category": categories[row["category"]]}))
+        if len(batch) >= batch_size:
+            created.extend(Product.objects.bulk_create(batch))
+            batch = []
+    if batch:
+        created.extend(Product.objects.bulk_create(batch))
+    return created
@@ -0,0 +1,87 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.servers.basehttp import WSGIRequestHandler, WSGIServer, get_internal_wsgi_application
+from django.db import connections
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """
+    WSGI server that hands connections to a fixed pool of threads, like
+    gunicorn's gthread workers, so per-thread database connections live as
+    long as CONN_MAX_AGE allows instead of dying with a thread per request.
+    """
+
+    request_queue_size = 128
+
+    def __init__(self, *args, threads=8, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = queue.Queue()
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(threads)]
+        for worker in self.workers:
+            worker.start()
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def _work(self):
+        try:
+            while (item := self.requests.get()) is not None:
+                request, client_address = item
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+        finally:
+            connections.close_all()
+
+    def server_close(self):
+        for _ in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join()
+        super().server_close()
+
+
+@contextmanager
+def serve(threads=8):
+    """Serve the project's WSGI application on a free local port; yields its base URL."""
+    httpd = PooledWSGIServer(("127.0.0.1", 0), QuietHandler, threads=threads)
+    httpd.set_app(get_internal_wsgi_application())
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{httpd.server_port}"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        thread.join()
+
+
+@contextmanager
+def serve_asgi():
+    """Serve the project's ASGI application with uvicorn on a free local port; yields its base URL."""
+    import uvicorn
+    from django.core.asgi import get_asgi_application
+
+    server = uvicorn.Server(uvicorn.Config(get_asgi_application(), host="127.0.0.1", port=0,
+                                           lifespan="off", log_level="warning", backlog=2048))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
@@ -0,0 +1,187 @@
+"""
+Storefront request scenarios for ``bench_storefront``.
+
+Each scenario builds one request (method, path, body, headers) so the same
+workload can be replayed through the Django test client, which also counts
+queries, or over HTTP against a real WSGI server with concurrent clients.
+"""
+import random
+import threading
+import time
+from collections import Counter
+
+import requests
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from store import cart, fulfilment, ratings, search
+from store.models import Order, OrderItem, Product, Review
+
+from . import fake_stripe
+from .seed import seed_catalogue
+from .utils import summarize
+
+SEARCH_TERMS = ["oat", "almond", "protein", "organic", "tea", "seed", "bar", "rice", "honey", "nut"]
+# add_to_cart only picks from these, so carts stay a realistic size however long the run.
+CART_PRODUCTS = 20
+
+
+def seed_storefront(users, products, orders, reviews, lines_per_order=3, rng=None):
+    """Populate the (throwaway) database and return what the scenarios need."""
+    rng = rng or random.Random(0)
+    search.index_products(seed_catalogue(products))
+    product_ids = list(Product.objects.order_by("pk").values_list("pk", flat=True))
+    password = make_password("bench")
+    accounts = User.objects.bulk_create(
+        User(username=f"bench-{n}", email=f"bench-{n}@example.com", password=password) for n in range(users)
+    )
+    paid = Order.objects.bulk_create(
+        Order(user=rng.choice(accounts), is_paid=True, full_name="Bench User") for _ in range(orders)
+    )
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, product_id=pk, quantity=rng.randint(1, 3))
+        for order in paid for pk in rng.sample(product_ids, lines_per_order)
+    )
+    cart.snapshot_prices(OrderItem.objects.filter(order__in=paid))
+    Order.objects.bulk_update(fulfilment.set_totals(paid), Order.TOTAL_FIELDS, batch_size=500)
+    open_orders = Order.objects.bulk_create(Order(user=user) for user in accounts)
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, product_id=pk, quantity=1)
+        for order in open_orders for pk in product_ids[:3]
+    )
+    pairs = {(rng.choice(accounts).pk, rng.choice(product_ids)) for _ in range(reviews)}
+    Review.objects.bulk_create(
+        Review(user_id=user_id, product_id=pk, rating=rng.randint(1, 5), comment="Bench review")
+        for user_id, pk in pairs
+    )
+    ratings.reconcile()
+    return {"users": accounts, "products": product_ids, "cart_products": product_ids[:CART_PRODUCTS]}
+
+
+def _get(path):
+    return "GET", path, None, {}, 200
+
+
+def product_list(ctx, rng):
+    return _get(reverse("product_list"))
+
+
+def product_search(ctx, rng):
+    return _get(f"{reverse('product_list')}?q={rng.choice(SEARCH_TERMS)}")
+
+
+def product_detail(ctx, rng):
+    return _get(reverse("product_detail", args=[rng.choice(ctx["products"])]))
+
+
+def cart_view(ctx, rng):
+    return _get(reverse("cart"))
+
+
+def add_to_cart(ctx, rng):
+    return "POST", reverse("add_to_cart", args=[rng.choice(ctx["cart_products"])]), "", {}, 302
+
+
+def checkout(ctx, rng):
+    return _get(reverse("checkout"))
+
+
+def stripe_webhook(ctx, rng):
+    body, headers = fake_stripe.signed_request(fake_stripe.checkout_completed(fake_stripe.new_id("cs")))
+    return ("POST", reverse("stripe_webhook"), body,
+            {"Stripe-Signature": headers["HTTP_STRIPE_SIGNATURE"], "Content-Type": "application/json"}, 200)
+
+
+def order_history(ctx, rng):
+    return _get(reverse("order_history"))
+
+
+# name: (request builder, needs a logged-in user)
+SCENARIOS = {
+    "product_list": (product_list, False),
+    "product_search": (product_search, False),
+    "product_detail": (product_detail, False),
+    "cart_view": (cart_view, True),
+    "add_to_cart": (add_to_cart, True),
+    "checkout": (checkout, True),
+    "stripe_webhook": (stripe_webhook, False),
+    "order_history": (order_history, True),
+}
+
+
+def run_test_client(name, ctx, iterations, rng):
+    """Replay one scenario through the test client; adds query counts to the summary."""
+    build, login = SCENARIOS[name]
+    client = Client()
+    if login:
+        client.force_login(ctx["users"][0])
+    samples, queries, errors = [], [], 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        method, path, body, headers, expect = build(ctx, rng)
+        content_type = headers.pop("Content-Type", "application/octet-stream")
+        with CaptureQueriesContext(connection) as captured:
+            t0 = time.perf_counter()
+            response = client.generic(method, path, body or "", content_type=content_type, headers=headers)
+            samples.append(time.perf_counter() - t0)
+        queries.append(len(captured))
+        errors += response.status_code != expect
+    elapsed = time.perf_counter() - started
+    return {**summarize(samples), "per_second": iterations / elapsed, "errors": errors,
+            "queries_mean": sum(queries) / len(queries), "queries_max": max(queries)}
+
+
+def session_cookies(users):
+    """Session and CSRF cookies logging a requests.Session in as each user."""
+    jars = []
+    for user in users:
+        client = Client()
+        client.force_login(user)
+        jars.append({
+            settings.SESSION_COOKIE_NAME: client.cookies[settings.SESSION_COOKIE_NAME].value,
+            settings.CSRF_COOKIE_NAME: get_random_string(32),
+        })
+    return jars
+
+
+def run_http(name, ctx, base, jars, duration, seed):
+    """Drive one scenario over HTTP with one thread per cookie jar for ``duration`` seconds."""
+    build, login = SCENARIOS[name]
+    samples, statuses, lock = [], Counter(), threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(n, jar):
+        rng = random.Random(seed + n)
+        http = requests.Session()
+        if login:
+            http.cookies.update(jar)
+            http.headers["X-CSRFToken"] = jar[settings.CSRF_COOKIE_NAME]
+        local_samples, local_statuses = [], Counter()
+        while time.perf_counter() < deadline:
+            method, path, body, headers, expect = build(ctx, rng)
+            t0 = time.perf_counter()
+            try:
+                status = http.request(method, base + path, data=body, headers=headers,
+                                      allow_redirects=False).status_code
+            except requests.RequestException:  # refused or reset under load
+                status = None
+            local_samples.append(time.perf_counter() - t0)
+            local_statuses[status == expect] += 1
+        with lock:
+            samples.extend(local_samples)
+            statuses.update(local_statuses)
+
+    threads = [threading.Thread(target=worker, args=(n, jar)) for n, jar in enumerate(jars)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return {**summarize(samples), "per_second": statuses[True] / elapsed, "errors": statuses[False]}
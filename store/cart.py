@@ -0,0 +1,227 @@
+"""
+Cart summaries.
+
+The line subtotals, item count and total of an open order are computed in
+the database in one aggregate query and cached per user. All cart changes go
+through ``add_items``/``remove_items``, which apply any number of lines in a
+constant number of queries and touch the order's updated_at. A cached
+summary is only used while the order's updated_at still matches it, so a
+change made in any process is seen at once; product saves bump a catalogue
+version (shared through store.catalog_cache) so cached totals never outlive
+a price change. Lines follow live prices until ``snapshot_prices`` captures
+them at checkout.
+
+A user has at most one open order (a partial unique constraint on user
+where is_paid is false). ``get_open_order`` finds it by the primary key
+remembered in the session and creates it only when something is added,
+so browsing never writes an empty order; ``purge_carts`` removes the
+abandoned ones.
+"""
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.http import Http404
+from django.utils import timezone
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Greatest
+
+from . import catalog_cache
+from .models import Order, OrderItem, Product, line_subtotal
+
+SUMMARY_TIMEOUT = 300
+SESSION_KEY = "cart_order_id"
+EMPTY_SUMMARY = {'order_id': None, 'updated_at': None, 'lines': 0, 'item_count': 0, 'total': Decimal('0')}
+
+
+def _remember(request, order):
+    pk = order.pk if order else None
+    if request.session.get(SESSION_KEY) != pk:
+        if pk is None:
+            request.session.pop(SESSION_KEY, None)
+        else:
+            request.session[SESSION_KEY] = pk
+
+
+def _create(user):
+    # A concurrent request may have created the cart first; the constraint makes that one win.
+    try:
+        with transaction.atomic():
+            return Order.objects.create(user=user)
+    except IntegrityError:
+        return Order.objects.get(user=user, is_paid=False)
+
+
+def get_open_order(request, create=False):
+    """
+    The user's open order, or None if they have none and ``create`` is false.
+    The id cached in the session makes this a primary-key lookup; it is
+    re-checked against the user and is_paid, so a paid or purged cart is
+    never returned.
+    """
+    open_orders = Order.objects.filter(user=request.user, is_paid=False)
+    pk = request.session.get(SESSION_KEY)
+    order = open_orders.filter(pk=pk).first() if pk else None
+    if order is None:
+        order = open_orders.first()
+    if order is None and create:
+        order = _create(request.user)
+    _remember(request, order)
+    return order
+
+
+async def aget_open_order(request, create=False):
+    # request.user is a lazy object that would query synchronously; resolve it here.
+    user = await request.auser()
+    open_orders = Order.objects.filter(user=user, is_paid=False)
+    pk = request.session.get(SESSION_KEY)
+    order = await open_orders.filter(pk=pk).afirst() if pk else None
+    if order is None:
+        order = await open_orders.afirst()
+    if order is None and create:
+        order = await sync_to_async(_create)(user)
+    _remember(request, order)
+    return order
+
+
+def open_order_or_404(request):
+    order = get_open_order(request)
+    if order is None:
+        raise Http404("No open order.")
+    return order
+
+
+async def aopen_order_or_404(request):
+    order = await aget_open_order(request)
+    if order is None:
+        raise Http404("No open order.")
+    return order
+
+
+def bump_prices_version():
+    catalog_cache.bump_prices()
+
+
+def _key(user_id):
+    return f"cart-summary:{catalog_cache.prices_version():.6f}:{user_id}"
+
+
+def _current(summary, order):
+    return summary is not None and summary['order_id'] == order.pk and summary['updated_at'] == order.updated_at
+
+
+def _lines(order):
+    return order.items.select_related('product__category').annotate(line_subtotal=line_subtotal()).order_by('pk')
+
+
+def cart_lines(order):
+    """The order's items with product and category loaded and ``line_subtotal`` annotated."""
+    return list(_lines(order))
+
+
+async def acart_lines(order):
+    return [item async for item in _lines(order)]
+
+
+SUMMARY_AGGREGATES = {'lines': Count('id'), 'item_count': Sum('quantity'), 'total': Sum(line_subtotal())}
+
+
+def _summary(order, totals):
+    return {
+        'order_id': order.pk,
+        'updated_at': order.updated_at,
+        'lines': totals['lines'],
+        'item_count': totals['item_count'] or 0,
+        'total': totals['total'] or Decimal('0'),
+    }
+
+
+def compute_summary(order):
+    return _summary(order, order.items.aggregate(**SUMMARY_AGGREGATES))
+
+
+def get_summary(order):
+    """Cached ``{'lines', 'item_count', 'total'}`` for the user's open order."""
+    key = _key(order.user_id)
+    summary = cache.get(key)
+    if not _current(summary, order):
+        summary = compute_summary(order)
+        cache.set(key, summary, SUMMARY_TIMEOUT)
+    return summary
+
+
+async def aget_summary(order):
+    """Async ``get_summary``."""
+    key = _key(order.user_id)
+    summary = await cache.aget(key)
+    if not _current(summary, order):
+        summary = _summary(order, await order.items.aaggregate(**SUMMARY_AGGREGATES))
+        await cache.aset(key, summary, SUMMARY_TIMEOUT)
+    return summary
+
+
+def invalidate(user_id):
+    cache.delete(_key(user_id))
+
+
+def add_items(order, quantities):
+    """
+    Merge ``{product_id: quantity}`` into ``order`` in one transaction.
+
+    Missing lines are inserted at zero (ignoring any a concurrent request
+    already created) and then every line is incremented with a single
+    F()-based bulk update, so no quantity is lost to a race. Negative
+    quantities decrement; lines that reach zero are removed.
+    """
+    quantities = {pid: n for pid, n in quantities.items() if n}
+    if not quantities:
+        return
+    with transaction.atomic():
+        # Touching updated_at marks the cart active for purge_carts, expires its
+        # cached summary and, being a write, serializes concurrent changes to the same cart.
+        order.updated_at = timezone.now()
+        Order.objects.filter(pk=order.pk).update(updated_at=order.updated_at)
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, product_id=pid, quantity=0) for pid, n in quantities.items() if n > 0],
+            ignore_conflicts=True,
+        )
+        items = list(OrderItem.objects.filter(order=order, product_id__in=quantities).only('pk', 'product_id'))
+        for item in items:
+            n = quantities[item.product_id]
+            item.quantity = F('quantity') + n if n > 0 else Greatest(F('quantity') + n, 0)
+        OrderItem.objects.bulk_update(items, ['quantity'])
+        if any(n < 0 for n in quantities.values()):
+            OrderItem.objects.filter(order=order, quantity__lte=0).delete()
+    invalidate(order.user_id)
+
+
+def remove_items(order, product_ids):
+    OrderItem.objects.filter(order=order, product_id__in=list(product_ids)).delete()
+    order.updated_at = timezone.now()
+    Order.objects.filter(pk=order.pk).update(updated_at=order.updated_at)
+    invalidate(order.user_id)
+
+
+def _snapshot_values():
+    product = Product.objects.filter(pk=OuterRef('product_id'))
+    return {
+        'product_name': Subquery(product.values('name')[:1]),
+        'unit_price': Subquery(product.values('price')[:1]),
+        'category_name': Subquery(product.values('category__name')[:1]),
+        'image': Subquery(product.values('image')[:1]),
+        'image_renditions': Subquery(product.values('image_renditions')[:1]),
+    }
+
+
+def snapshot_prices(items):
+    """
+    Copy each product's current name, price, category name and image onto
+    the OrderItem queryset ``items`` in one UPDATE, so order history never
+    reads the product.
+    """
+    return items.update(**_snapshot_values())
+
+
+async def asnapshot_prices(items):
+    return await items.aupdate(**_snapshot_values())
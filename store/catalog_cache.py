@@ -0,0 +1,232 @@
+"""
+Catalogue caching.
+
+Each product has a version in the cache (the time it last changed), and so
+do the categories and the catalogue as a whole; model signals bump them.
+Cache keys embed the versions they depend on, so nothing is ever deleted:
+stale entries simply stop being read and age out. The same versions give
+anonymous catalogue pages their ETag and Last-Modified headers without
+rendering anything.
+
+A bump is also written to the CacheVersion table once its transaction
+commits. ``CacheVersionMiddleware`` reads the rows written since its last
+look at most every CATALOG_CHECK_SECONDS, so a process whose cache is not
+shared (the default locmem cache) still sees changes made by the webhook
+worker, imports and other web servers within seconds.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import CacheVersion
+
+PAGE_TIMEOUT = getattr(settings, "CATALOG_PAGE_TIMEOUT", 600)
+CHECK_SECONDS = getattr(settings, "CATALOG_CHECK_SECONDS", 5)
+# A bump is stamped before its row is written, which can wait this long for the database lock.
+WRITE_LAG_SECONDS = 60
+CATALOG_KEY = "catalog:version"
+CATEGORIES_KEY = "catalog:categories"
+RECOMMENDATIONS_KEY = "catalog:recommendations"
+PRICES_KEY = "catalog:prices"
+FACETS_KEY = "catalog:facets"
+# Query parameters that select a catalogue page (see store.facets for the filters).
+LIST_PARAMS = ("q", "sort", "cursor", "category", "price", "in_stock", "rating")
+
+
+def _product_key(pk):
+    return f"catalog:product:{pk}"
+
+
+def _versions(keys):
+    """Current version of each key; keys the cache has lost start again at now."""
+    found = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def _publish(keys):
+    now = time.time()
+    CacheVersion.objects.bulk_create(
+        [CacheVersion(key=key, version=now) for key in keys],
+        update_conflicts=True, unique_fields=["key"], update_fields=["version"],
+    )
+
+
+def _bump(keys):
+    keys = list(keys)
+    cache.set_many(dict.fromkeys(keys, time.time()), None)
+    transaction.on_commit(lambda: _publish(keys))
+
+
+def bump_products(pks):
+    _bump([CATALOG_KEY, *map(_product_key, pks)])
+
+
+def bump_categories():
+    _bump([CATALOG_KEY, CATEGORIES_KEY])
+
+
+def bump_facets(publish=True):
+    """``publish=False`` expires this process's pages for a facet write it found in the table."""
+    if publish:
+        _bump([FACETS_KEY])
+    else:
+        cache.set(FACETS_KEY, time.time(), None)
+
+
+def facets_version():
+    return _versions([FACETS_KEY])[0]
+
+
+def bump_recommendations():
+    _bump([RECOMMENDATIONS_KEY])
+
+
+def recommendations_version():
+    return _versions([RECOMMENDATIONS_KEY])[0]
+
+
+def bump_prices():
+    _bump([PRICES_KEY])
+
+
+def prices_version():
+    """Version of the product prices, for cached cart totals (store.cart)."""
+    return _versions([PRICES_KEY])[0]
+
+
+def catalog_version():
+    """Version of the listing pages: any product change, or a facet count change (stock selling out)."""
+    return max(_versions([CATALOG_KEY, FACETS_KEY]))
+
+
+def detail_version(pk):
+    """Version of a product page: the product, its recommendations and the products they show."""
+    from .recommendations import cached_neighbour_ids
+    # Cache only: this also runs for async views, where the database can't be touched.
+    keys = [_product_key(pk), *map(_product_key, cached_neighbour_ids(pk)), CATEGORIES_KEY, RECOMMENDATIONS_KEY]
+    return max(_versions(keys))
+
+
+def annotate_card_versions(products):
+    """Set ``card_version`` on each product, for the product card fragment cache."""
+    keys = [_product_key(p.pk) for p in products]
+    versions = _versions([*keys, CATEGORIES_KEY])
+    categories = versions.pop()
+    for product, version in zip(products, versions):
+        product.card_version = f"{version:.6f}-{categories:.6f}"
+    return products
+
+
+def cacheable(request):
+    """Anonymous GET/HEAD requests with no flash messages waiting to be shown."""
+    return (
+        request.method in ("GET", "HEAD")
+        and not request.user.is_authenticated
+        and not len(get_messages(request))
+    )
+
+
+def _digest(*parts):
+    return hashlib.md5("\x1f".join(str(p) for p in parts).encode()).hexdigest()
+
+
+def _list_params(request):
+    return [",".join(sorted(request.GET.getlist(name))) for name in LIST_PARAMS]
+
+
+def list_page_key(request):
+    return f"catalog-page:{_digest(catalog_version(), *_list_params(request))}"
+
+
+def list_etag(request, *args, **kwargs):
+    if not cacheable(request):
+        return None
+    return _digest("list", catalog_version(), *_list_params(request))
+
+
+def list_last_modified(request, *args, **kwargs):
+    if not cacheable(request):
+        return None
+    return datetime.fromtimestamp(catalog_version(), tz=timezone.utc)
+
+
+def detail_etag(request, pk):
+    if not cacheable(request):
+        return None
+    return _digest("detail", pk, detail_version(pk))
+
+
+def detail_last_modified(request, pk):
+    if not cacheable(request):
+        return None
+    return datetime.fromtimestamp(detail_version(pk), tz=timezone.utc)
+
+
+_polled = {"at": time.monotonic(), "since": time.time()}
+
+
+def _poll_due():
+    """The time of the previous poll if another is due, marking it done; else None."""
+    now = time.monotonic()
+    if now - _polled["at"] < CHECK_SECONDS:
+        return None
+    since = _polled["since"]
+    _polled.update(at=now, since=time.time())
+    return since
+
+
+def _published_since(since):
+    return CacheVersion.objects.filter(version__gte=since - WRITE_LAG_SECONDS).values_list("key", "version")
+
+
+def _apply(rows):
+    # Keys this cache does not hold start at now when next read, which is already newer.
+    published = dict(rows)
+    found = cache.get_many(published)
+    newer = {key: version for key, version in published.items() if key in found and version > found[key]}
+    if newer:
+        cache.set_many(newer, None)
+
+
+def poll():
+    """Take the versions other processes have published since the last poll, if one is due."""
+    since = _poll_due()
+    if since is not None:
+        _apply(_published_since(since))
+
+
+async def apoll():
+    since = _poll_due()
+    if since is not None:
+        _apply([row async for row in _published_since(since)])
+
+
+class CacheVersionMiddleware:
+    """Polls the published versions before the view (and its ETag) reads them."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        poll()
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        await apoll()
+        return await self.get_response(request)
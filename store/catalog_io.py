@@ -0,0 +1,254 @@
+"""
+Streaming catalogue import and export.
+
+Rows are flat dicts of ``FIELDS``, read one at a time from JSON Lines, CSV
+or a ``dumpdata``-style JSON array (parsed incrementally), so memory use
+does not depend on the file size. Imports upsert products by SKU in
+``bulk_create(update_conflicts=True)`` batches, several batches per
+transaction, resolving categories by name through an in-memory map and
+keeping the search index and caches in step.
+
+A row's stock is the quantity on hand. Product.stock is what is left to
+sell, so units held by open checkouts (store.stock) are subtracted on import
+and added back on export. A changed image drops the product's renditions,
+which showed the old picture, until generate_renditions makes new ones.
+"""
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import reset_queries, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from . import cart, catalog_cache, facets, search
+from .models import Category, Product, StockHold
+
+FIELDS = ["sku", "name", "description", "price", "stock", "category", "image"]
+UPDATE_FIELDS = ["name", "description", "price", "stock", "category", "image"]
+FORMATS = ("jsonl", "csv", "json")
+READ_SIZE = 64 * 1024
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(path):
+    name = str(path).lower()
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith(".json"):
+        return "json"
+    raise ValueError(f"Cannot tell the format of {path}; pass one of {', '.join(FORMATS)}.")
+
+
+def iter_json_array(fh):
+    """Yield the items of a top-level JSON array without loading the whole document."""
+    decoder = json.JSONDecoder()
+    buffer, pos, started = "", 0, False
+    while True:
+        chunk = fh.read(READ_SIZE)
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ","):
+                pos += 1
+            if not started and pos < len(buffer):
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array.")
+                started, pos = True, pos + 1
+                continue
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                break  # the item continues in the next chunk
+            if end == len(buffer) and chunk:
+                break  # a number may continue in the next chunk
+            pos = end
+            yield item
+        if not chunk:
+            return
+
+
+def _fixture_rows(items):
+    # dumpdata output: categories are referenced by pk, so remember their names.
+    categories = {}
+    for item in items:
+        if item.get("model") == "store.category":
+            categories[item["pk"]] = item["fields"]["name"]
+        elif item.get("model") == "store.product":
+            fields = item["fields"]
+            yield {**fields, "sku": fields.get("sku") or f"HF-{item['pk']}",
+                   "category": categories.get(fields["category"], fields["category"])}
+
+
+def read_rows(fh, fmt):
+    """Yield row dicts from an open text file."""
+    if fmt == "jsonl":
+        for line in fh:
+            if line.strip():
+                yield json.loads(line)
+    elif fmt == "csv":
+        yield from csv.DictReader(fh)
+    elif fmt == "json":
+        yield from _fixture_rows(iter_json_array(fh))
+    else:
+        raise ValueError(f"Unknown format {fmt!r}")
+
+
+def clean_row(row):
+    """Validate one row and convert its values; raises RowError."""
+    sku = str(row.get("sku") or "").strip()
+    name = str(row.get("name") or "").strip()
+    category = str(row.get("category") or "").strip()
+    if not sku or not name or not category:
+        raise RowError("sku, name and category are required")
+    try:
+        price = Decimal(str(row.get("price"))).quantize(Decimal("0.01"))
+        stock = int(row.get("stock") or 0)
+    except (InvalidOperation, TypeError, ValueError):
+        raise RowError("price and stock must be numbers")
+    if price < 0 or stock < 0:
+        raise RowError("price and stock cannot be negative")
+    return {
+        "sku": sku[:64],
+        "name": name[:200],
+        "description": str(row.get("description") or ""),
+        "price": price,
+        "stock": stock,
+        "category": category[:100],
+        "image": str(row.get("image") or "") or None,
+    }
+
+
+class CategoryMap:
+    """Category name -> Category, creating missing categories a batch at a time."""
+
+    def __init__(self):
+        self.by_name = {c.name: c for c in Category.objects.only("pk", "name")}
+
+    def resolve(self, names):
+        missing = set(names) - self.by_name.keys()
+        if missing:
+            Category.objects.bulk_create([Category(name=n) for n in missing], ignore_conflicts=True)
+            for category in Category.objects.filter(name__in=missing).only("pk", "name"):
+                self.by_name[category.name] = category
+        return self.by_name
+
+
+class ImportStats:
+    def __init__(self):
+        self.rows = self.imported = self.skipped = self.new_images = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def _upsert(batch, categories, stats):
+    by_name = categories.resolve(row["category"] for row in batch)
+    # A feed may repeat a SKU; the last row wins, as it would row by row.
+    products = list({row["sku"]: Product(**{**row, "category": by_name[row["category"]]}) for row in batch}.values())
+    skus = [p.sku for p in products]
+    old_images = dict(Product.objects.filter(sku__in=skus).values_list("sku", "image"))
+    held = dict(StockHold.objects.filter(product__sku__in=skus).values("product__sku")
+                .annotate(n=Sum("quantity")).values_list("product__sku", "n"))
+    for product in products:
+        product.stock = max(0, product.stock - held.get(product.sku, 0))
+    Product.objects.bulk_create(products, update_conflicts=True, unique_fields=["sku"], update_fields=UPDATE_FIELDS)
+    pks = dict(Product.objects.filter(sku__in=skus).values_list("sku", "pk"))
+    for product in products:
+        product.pk = pks[product.sku]
+    # bulk_create sends no post_save, so renditions of a replaced image are dropped here.
+    new_images = [pks[p.sku] for p in products if (old_images.get(p.sku) or None) != (p.image.name or None)]
+    if new_images:
+        Product.objects.filter(pk__in=new_images).update(image_renditions={})
+        stats.new_images += len(new_images)
+    search.index_products(products)
+    search.add_documents(len(products) - len(old_images))
+    facets.update(pks.values())
+    catalog_cache.bump_products(pks.values())
+    return len(products)
+
+
+def import_rows(rows, batch_size=1000, batches_per_transaction=10, max_errors=100, progress=None):
+    """
+    Upsert ``rows`` (an iterable of dicts) and return an ``ImportStats``.
+    Invalid rows are skipped and recorded; ``progress(stats)`` is called
+    after every committed transaction.
+    """
+    stats, categories, batches = ImportStats(), CategoryMap(), []
+    batch = []
+
+    def flush():
+        with transaction.atomic():
+            for b in batches:
+                stats.imported += _upsert(b, categories, stats)
+        batches.clear()
+        reset_queries()  # DEBUG would otherwise keep thousands of bulk statements
+        if progress:
+            progress(stats)
+
+    for line, row in enumerate(rows, start=1):
+        stats.rows += 1
+        try:
+            batch.append(clean_row(row))
+        except RowError as exc:
+            stats.skipped += 1
+            if len(stats.errors) < max_errors:
+                stats.errors.append(f"row {line}: {exc}")
+            continue
+        if len(batch) >= batch_size:
+            batches.append(batch)
+            batch = []
+            if len(batches) >= batches_per_transaction:
+                flush()
+    if batch:
+        batches.append(batch)
+    if batches:
+        flush()
+    if stats.imported:
+        cart.bump_prices_version()
+    return stats
+
+
+def export_rows(batch_size=2000):
+    """Yield every product as a row dict, in pk order, a batch at a time, with held units in its stock."""
+    held = StockHold.objects.filter(product=OuterRef("pk")).values("product").annotate(n=Sum("quantity")).values("n")
+    products = Product.objects.order_by("pk").annotate(on_hand=Coalesce(Subquery(held), 0) + F("stock")).values_list(
+        "pk", "sku", "name", "description", "price", "on_hand", "category__name", "image")
+    for pk, sku, name, description, price, stock, category, image in products.iterator(chunk_size=batch_size):
+        yield {"sku": sku or f"HF-{pk}", "name": name, "description": description, "price": str(price),
+               "stock": stock, "category": category, "image": image or ""}
+
+
+def write_rows(rows, fh, fmt):
+    """Write rows to an open text file; returns the number written."""
+    count = 0
+    if fmt == "jsonl":
+        for row in rows:
+            fh.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    elif fmt == "csv":
+        writer = csv.DictWriter(fh, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        raise ValueError(f"Cannot write format {fmt!r}; use jsonl or csv.")
+    return count
@@ -0,0 +1,231 @@
+"""
+Offline "customers also bought" builder.
+
+Paid orders and wishlists are baskets. They become sparse basket x product
+matrices B, and the item-item co-occurrence counts are Bᵀ·B (wishlists
+weighted below orders), summed over slices of the baskets in a process
+pool. Pairs are scored by cosine similarity or lift, and each product's top
+neighbours are stored in ProductRecommendation. The raw counts are kept in a
+state file, so orders paid since the last build can be folded in without
+recounting everything; wishlist changes wait for the next full build.
+Payments queue that update as a job for the event queue worker
+(``store.event_queue.schedule_recommendations``).
+"""
+import os
+import tempfile
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import django
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from . import catalog_cache
+from .models import OrderItem, Product, ProductRecommendation, Wishlist
+
+TOP_K = 20
+WISHLIST_WEIGHT = 0.5
+MIN_SUPPORT = 2.0
+SCORINGS = ("cosine", "lift")
+STATE_PATH = getattr(settings, "RECOMMENDATIONS_STATE", settings.BASE_DIR / ".recommendations" / "state.npz")
+# Orders paid this recently may still be committing; the next build picks them up.
+SETTLE_SECONDS = 60
+# Below this many baskets a process pool costs more than it saves.
+POOL_MIN_BASKETS = 20000
+
+
+def _pairs(rows):
+    """Two int64 arrays from an iterable of (basket id, product id)."""
+    baskets, products = array("q"), array("q")
+    for basket, product in rows:
+        baskets.append(basket)
+        products.append(product)
+    return np.frombuffer(baskets, dtype=np.int64), np.frombuffer(products, dtype=np.int64)
+
+
+def basket_matrix(baskets, products, n_products, weight=1.0):
+    """Sparse baskets x products matrix with ``weight`` where a basket holds a product."""
+    _, rows = np.unique(baskets, return_inverse=True)
+    data = np.full(len(rows), np.sqrt(weight), dtype=np.float32)
+    return sparse.csr_matrix((data, (rows, products)), shape=(int(rows.max(initial=-1)) + 1, n_products))
+
+
+def _count(block):
+    return (block.T @ block).tocsr()
+
+
+def count_pairs(matrix, workers=1):
+    """Co-occurrence counts ``matrix``ᵀ·``matrix``, split by baskets across ``workers`` processes."""
+    if workers <= 1 or matrix.shape[0] < POOL_MIN_BASKETS:
+        return _count(matrix)
+    bounds = np.linspace(0, matrix.shape[0], workers * 4 + 1).astype(int)
+    blocks = [matrix[start:end] for start, end in zip(bounds, bounds[1:]) if end > start]
+    total = sparse.csr_matrix((matrix.shape[1], matrix.shape[1]), dtype=np.float32)
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        for part in pool.map(_count, blocks):
+            total = total + part
+    return total
+
+
+def n_baskets(baskets, weight=1.0):
+    """Weighted number of distinct baskets in an array of basket ids, as they count on the diagonal."""
+    return weight * len(np.unique(baskets))
+
+
+def top_neighbours(counts, rows, baskets, top_k=TOP_K, min_support=MIN_SUPPORT, scoring="cosine"):
+    """
+    ``{product_id: [[neighbour_id, score], ...]}`` for the product ids in
+    ``rows``, best first. ``baskets`` is the weighted number of baskets
+    counted, which lift scores against.
+    """
+    occurrences = counts.diagonal()
+    result = {}
+    for pk in rows:
+        start, end = counts.indptr[pk], counts.indptr[pk + 1]
+        others, together = counts.indices[start:end], counts.data[start:end]
+        keep = (others != pk) & (together >= min_support)
+        others, together = others[keep], together[keep]
+        if not len(others):
+            result[int(pk)] = []
+            continue
+        if scoring == "lift":
+            scores = together * baskets / (occurrences[pk] * occurrences[others])
+        else:
+            scores = together / np.sqrt(occurrences[pk] * occurrences[others])
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k)[:top_k]
+            others, scores = others[best], scores[best]
+        order = np.lexsort((others, -scores))
+        result[int(pk)] = [[int(others[i]), round(float(scores[i]), 4)] for i in order]
+    return result
+
+
+def save_state(counts, baskets, watermark, scoring, path=STATE_PATH):
+    """Save the counts with the scoring options (``top_k``, ``min_support``, ``scoring``) they were built with."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npz")
+    with os.fdopen(fd, "wb") as fh:
+        np.savez(fh, data=counts.data, indices=counts.indices, indptr=counts.indptr,
+                 shape=np.array(counts.shape), baskets=np.array(baskets),
+                 watermark=np.array(watermark.timestamp()), **{k: np.array(v) for k, v in scoring.items()})
+    os.replace(tmp, path)
+
+
+def load_state(path=STATE_PATH):
+    """``(counts, baskets, watermark, scoring)`` from the last build, or None."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as state:
+        if "baskets" not in state.files:
+            # Saved before basket counts were kept; lift needs a full build.
+            return None
+        counts = sparse.csr_matrix((state["data"], state["indices"], state["indptr"]), shape=tuple(state["shape"]))
+        watermark = datetime.fromtimestamp(float(state["watermark"]), tz=dt_timezone.utc)
+        scoring = {"top_k": int(state["top_k"]), "min_support": float(state["min_support"]),
+                   "scoring": str(state["scoring"])}
+        return counts, float(state["baskets"]), watermark, scoring
+
+
+def store(neighbours, replace=False):
+    """Write ``{product_id: neighbours}``; ``replace`` drops rows for every other product."""
+    rows = [ProductRecommendation(product_id=pk, neighbours=n) for pk, n in neighbours.items()]
+    with transaction.atomic():
+        if replace:
+            ProductRecommendation.objects.all().delete()
+            ProductRecommendation.objects.bulk_create(rows, batch_size=2000)
+        else:
+            ProductRecommendation.objects.bulk_create(
+                rows, batch_size=2000, update_conflicts=True,
+                unique_fields=["product"], update_fields=["neighbours", "updated_at"],
+            )
+    catalog_cache.bump_recommendations()
+
+
+class BuildStats:
+    def __init__(self):
+        self.lines = self.products = 0
+        self.timings = {}
+        self._started = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.timings[name] = now - self._started
+        self._started = now
+
+
+def _paid_lines(paid):
+    return OrderItem.objects.filter(paid).values_list("order_id", "product_id").iterator(chunk_size=20000)
+
+
+def build(workers=1, top_k=TOP_K, min_support=MIN_SUPPORT, scoring="cosine", state_path=STATE_PATH):
+    """Recount everything from paid orders and wishlists and replace every product's neighbours."""
+    stats = BuildStats()
+    cutoff = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+    n_products = (Product.objects.aggregate(m=Max("pk"))["m"] or 0) + 1
+    paid = Q(order__is_paid=True) & (Q(order__paid_at__isnull=True) | Q(order__paid_at__lte=cutoff))
+    orders = _pairs(_paid_lines(paid))
+    wishlists = _pairs(Wishlist.products.through.objects.values_list("wishlist_id", "product_id")
+                       .iterator(chunk_size=20000))
+    stats.lines = len(orders[0])
+    stats.lap("load")
+
+    counts = count_pairs(basket_matrix(*orders, n_products), workers)
+    if len(wishlists[0]):
+        counts = counts + count_pairs(basket_matrix(*wishlists, n_products, WISHLIST_WEIGHT), workers)
+    counts.sum_duplicates()
+    baskets = n_baskets(orders[0]) + n_baskets(wishlists[0], WISHLIST_WEIGHT)
+    stats.lap("count")
+
+    rows = np.flatnonzero(np.diff(counts.indptr))
+    neighbours = top_neighbours(counts, rows, baskets, top_k, min_support, scoring)
+    stats.products = len(neighbours)
+    stats.lap("score")
+
+    store(neighbours, replace=True)
+    save_state(counts, baskets, cutoff, {"top_k": top_k, "min_support": min_support, "scoring": scoring}, state_path)
+    stats.lap("store")
+    return stats
+
+
+def update(top_k=None, min_support=None, scoring=None, state_path=STATE_PATH):
+    """
+    Fold orders paid since the last build into the saved counts and rescore
+    only the products whose scores can have changed, with the last build's
+    scoring options unless others are given. Returns None when there is no
+    saved state, so a full ``build`` is needed.
+    """
+    state = load_state(state_path)
+    if state is None:
+        return None
+    counts, baskets, watermark, options = state
+    given = {"top_k": top_k, "min_support": min_support, "scoring": scoring}
+    options.update((name, value) for name, value in given.items() if value is not None)
+    stats = BuildStats()
+    cutoff = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+    n_products = max(counts.shape[0], (Product.objects.aggregate(m=Max("pk"))["m"] or 0) + 1)
+    if n_products > counts.shape[0]:
+        counts.resize((n_products, n_products))
+    orders = _pairs(_paid_lines(Q(order__is_paid=True, order__paid_at__gt=watermark, order__paid_at__lte=cutoff)))
+    stats.lines = len(orders[0])
+    stats.lap("load")
+    if stats.lines:
+        counts = (counts + count_pairs(basket_matrix(*orders, n_products))).tocsr()
+        baskets += n_baskets(orders[0])
+        stats.lap("count")
+        # Every score involving a bought product changed, so rescore those
+        # products and everything that co-occurs with them.
+        bought = np.unique(orders[1])
+        rows = np.union1d(bought, counts[bought].indices)
+        neighbours = top_neighbours(counts, rows, baskets, **options)
+        stats.products = len(neighbours)
+        stats.lap("score")
+        store(neighbours)
+    save_state(counts, baskets, cutoff, options, state_path)
+    stats.lap("store")
+    return stats
@@ -0,0 +1,230 @@
+"""
+Durable queue for Stripe webhook events.
+
+The webhook only verifies the signature and inserts a StripeEvent row, so
+Stripe sees a fast 200 however busy the database is. Workers
+(``manage.py process_stripe_events``) claim due events in batches with a
+single UPDATE, which is safe with any number of workers on any backend,
+process each one in its own transaction, and retry failures with
+exponential backoff until they are dead-lettered.
+
+The same queue runs the incremental recommendations update: paying an order
+queues one job per RECOMMENDATIONS_UPDATE_SECONDS, due once the orders paid
+in it have settled.
+"""
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from . import cooccurrence, fulfilment
+from .models import StripeEvent
+
+logger = logging.getLogger(__name__)
+
+HANDLED_TYPES = {"checkout.session.completed"}
+# Queued by the store itself, never accepted from the webhook.
+RECOMMENDATIONS_TYPE = "store.recommendations.update"
+
+MAX_ATTEMPTS = getattr(settings, "STRIPE_EVENT_MAX_ATTEMPTS", 8)
+BACKOFF_SECONDS = getattr(settings, "STRIPE_EVENT_BACKOFF_SECONDS", 2)
+MAX_BACKOFF_SECONDS = 3600
+# A claimed event whose worker has not finished within the lease is retried.
+LEASE_SECONDS = getattr(settings, "STRIPE_EVENT_LEASE_SECONDS", 300)
+RECOMMENDATIONS_UPDATE_SECONDS = getattr(settings, "RECOMMENDATIONS_UPDATE_SECONDS", 60)
+
+
+def enqueue(event):
+    """Store a verified event dict; returns False if it was already queued or is not handled."""
+    if event["type"] not in HANDLED_TYPES:
+        return False
+    try:
+        with transaction.atomic():
+            StripeEvent.objects.create(event_id=event["id"], type=event["type"], payload=event)
+    except IntegrityError:
+        return False
+    return True
+
+
+async def aenqueue(event):
+    """Async ``enqueue``; the single INSERT runs in autocommit, outside any transaction."""
+    if event["type"] not in HANDLED_TYPES:
+        return False
+    try:
+        await StripeEvent.objects.acreate(event_id=event["id"], type=event["type"], payload=event)
+    except IntegrityError:
+        return False
+    return True
+
+
+def schedule_recommendations(paid_at):
+    """
+    Queue the recommendations update that will count orders paid at
+    ``paid_at``. Orders paid in the same RECOMMENDATIONS_UPDATE_SECONDS share
+    one job, so the counts are rewritten at most that often.
+    """
+    due = paid_at.timestamp() + cooccurrence.SETTLE_SECONDS
+    at = math.ceil(due / RECOMMENDATIONS_UPDATE_SECONDS) * RECOMMENDATIONS_UPDATE_SECONDS
+    try:
+        with transaction.atomic():
+            StripeEvent.objects.create(event_id=f"{RECOMMENDATIONS_TYPE}:{at}", type=RECOMMENDATIONS_TYPE,
+                                       available_at=datetime.fromtimestamp(at, tz=dt_timezone.utc))
+    except IntegrityError:
+        pass
+
+
+def _update_recommendations(event):
+    # Wait for earlier update jobs still running, so two never fold the same orders.
+    list(StripeEvent.objects.select_for_update()
+         .filter(type=RECOMMENDATIONS_TYPE, status=StripeEvent.PROCESSING, pk__lt=event.pk).values_list('pk'))
+    stats = cooccurrence.update()
+    if stats is None:
+        logger.info("No recommendations build to update yet; run build_recommendations.")
+    else:
+        logger.info("Updated recommendations for %s products from %s order lines", stats.products, stats.lines)
+
+
+def _handle(event):
+    if event.type == "checkout.session.completed":
+        order = fulfilment.fulfil_checkout_session(event.payload["data"]["object"]["id"])
+        if order is not None:
+            schedule_recommendations(order.paid_at)
+    elif event.type == RECOMMENDATIONS_TYPE:
+        _update_recommendations(event)
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** (attempts - 1)))
+
+
+def claim(worker_id, batch_size):
+    """Atomically claim up to ``batch_size`` due events for ``worker_id``."""
+    now = timezone.now()
+    due = (Q(status=StripeEvent.PENDING, available_at__lte=now)
+           | Q(status=StripeEvent.PROCESSING, claimed_at__lt=now - timedelta(seconds=LEASE_SECONDS)))
+    ids = list(StripeEvent.objects.filter(due).order_by('available_at', 'pk')
+               .values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return []
+    token = f"{worker_id}:{uuid.uuid4().hex[:12]}"
+    # Repeating ``due`` in the UPDATE makes the claim atomic: rows another
+    # worker claimed since the SELECT no longer match and are skipped.
+    StripeEvent.objects.filter(due, pk__in=ids).update(
+        status=StripeEvent.PROCESSING, claimed_by=token, claimed_at=now,
+    )
+    return list(StripeEvent.objects.filter(claimed_by=token, status=StripeEvent.PROCESSING).order_by('pk'))
+
+
+def process(event):
+    """Handle one claimed event. Returns True on success."""
+    event.attempts += 1
+    try:
+        with transaction.atomic():
+            # Write before reading: SQLite then waits for the write lock
+            # instead of failing when a read transaction has to upgrade.
+            StripeEvent.objects.filter(pk=event.pk).update(attempts=event.attempts)
+            _handle(event)
+            event.status = StripeEvent.DONE
+            event.processed_at = timezone.now()
+            event.last_error = ""
+            event.save(update_fields=['status', 'processed_at', 'last_error'])
+    except Exception as exc:
+        event.last_error = f"{type(exc).__name__}: {exc}"
+        if event.attempts >= MAX_ATTEMPTS:
+            event.status = StripeEvent.DEAD
+            logger.error("Dead-lettered Stripe event %s after %s attempts: %s",
+                         event.event_id, event.attempts, event.last_error)
+        else:
+            event.status = StripeEvent.PENDING
+            event.available_at = timezone.now() + backoff(event.attempts)
+            logger.warning("Stripe event %s failed (attempt %s), retrying: %s",
+                           event.event_id, event.attempts, event.last_error)
+        event.save(update_fields=['status', 'attempts', 'last_error', 'available_at'])
+        metrics.record(failed=True)
+        return False
+    if event.type != RECOMMENDATIONS_TYPE:
+        metrics.record(latency=(event.processed_at - event.created_at).total_seconds())
+    return True
+
+
+def process_batch(worker_id, batch_size=100):
+    """Claim and process one batch; returns the number of events claimed."""
+    events = claim(worker_id, batch_size)
+    for event in events:
+        process(event)
+    return len(events)
+
+
+def drain(worker_id="drain", batch_size=100):
+    """Process until no event is due; returns the number claimed."""
+    total = 0
+    while n := process_batch(worker_id, batch_size):
+        total += n
+    return total
+
+
+def queue_depth():
+    """
+    Stripe event counts by status plus the age in seconds of the oldest due
+    event. Recommendations jobs are left out: they are queued ahead of when
+    they are due, so they would always look late.
+    """
+    events = StripeEvent.objects.exclude(type=RECOMMENDATIONS_TYPE)
+    counts = dict(events.exclude(status=StripeEvent.DONE).values_list('status').annotate(n=Count('pk')))
+    oldest = events.filter(status=StripeEvent.PENDING).aggregate(t=Min('created_at'))['t']
+    return {
+        StripeEvent.PENDING: counts.get(StripeEvent.PENDING, 0),
+        StripeEvent.PROCESSING: counts.get(StripeEvent.PROCESSING, 0),
+        StripeEvent.DEAD: counts.get(StripeEvent.DEAD, 0),
+        'oldest_pending_seconds': (timezone.now() - oldest).total_seconds() if oldest else 0.0,
+    }
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class Metrics:
+    """In-process counters and recent end-to-end latencies for this worker."""
+
+    def __init__(self, window=10000):
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=window)
+        self.started = time.monotonic()
+
+    def record(self, latency=None, failed=False):
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.processed += 1
+                self.latencies.append(latency)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            processed, failed = self.processed, self.failed
+        elapsed = time.monotonic() - self.started
+        return {
+            'processed': processed,
+            'failed': failed,
+            'rate_per_second': processed / elapsed if elapsed else 0.0,
+            'latency_p50_seconds': _percentile(latencies, 50),
+            'latency_p95_seconds': _percentile(latencies, 95),
+            'latency_p99_seconds': _percentile(latencies, 99),
+        }
+
+
+metrics = Metrics()
@@ -0,0 +1,364 @@
+"""
+Faceted catalogue filtering.
+
+For every facet value (a category, a price bucket, in stock, a star rating)
+the index keeps a bitmap of the products that have it, stored as one
+FacetBitmap row per value and held in memory as Python ints. Product and
+review changes update only the bits of the products involved. A listing
+ANDs the bitmaps of the selected values (ORing values within a facet), and
+counts next to each option are popcounts of that intersection, so facet
+counts and the page total cost no queries once the index is loaded.
+
+Each process keeps the index in memory. A change made through this
+process's cache reloads it at once; changes from other processes (the
+webhook worker, imports, other web servers) are picked up by checking the
+table's last write at most every FACETS_CHECK_SECONDS.
+"""
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BinaryField, Q
+from django.db.models.functions import Substr
+from django.utils import timezone
+
+from . import catalog_cache
+from .models import Category, FacetBitmap, Product
+
+ALL = "all"
+IN_STOCK = "stock:in"
+# (key, label, low, high): low <= price < high.
+PRICE_BUCKETS = [
+    ("0-5", "Under €5", Decimal("0"), Decimal("5")),
+    ("5-10", "€5 to €10", Decimal("5"), Decimal("10")),
+    ("10-20", "€10 to €20", Decimal("10"), Decimal("20")),
+    ("20-", "€20 and over", Decimal("20"), None),
+]
+MIN_RATINGS = [4, 3, 2, 1]
+FIELDS = ["pk", "category_id", "price", "stock", "rating_avg"]
+CHECK_SECONDS = getattr(settings, "FACETS_CHECK_SECONDS", 5)
+
+
+def price_bucket(price):
+    for key, _, low, high in PRICE_BUCKETS:
+        if price >= low and (high is None or price < high):
+            return key
+    return PRICE_BUCKETS[0][0]
+
+
+def keys_for(category_id, price, stock, rating_avg):
+    """Facet keys of a product with these field values."""
+    keys = [ALL, f"category:{category_id}", f"price:{price_bucket(price)}", f"rating:{min(5, int(rating_avg))}"]
+    if stock > 0:
+        keys.append(IN_STOCK)
+    return keys
+
+
+def to_bitmap(pks):
+    pks = list(pks)
+    if not pks:
+        return 0
+    buf = bytearray(max(pks) // 8 + 1)
+    for pk in pks:
+        buf[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(buf, "little")
+
+
+def _to_bytes(bits):
+    return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+
+def _load(rows):
+    return {key: int.from_bytes(bits, "little") for key, bits in rows}
+
+
+def _byte_ranges(pks, gap=64, limit=32):
+    """``[start, length]`` byte ranges of a bitmap that hold the bits of ``pks``, nearby ones merged."""
+    ranges = []
+    for index in sorted({pk >> 3 for pk in pks}):
+        if ranges and index - sum(ranges[-1]) < gap:
+            ranges[-1][1] = index - ranges[-1][0] + 1
+        else:
+            ranges.append([index, 1])
+    if len(ranges) > limit:
+        ranges = [[ranges[0][0], sum(ranges[-1]) - ranges[0][0]]]
+    return ranges
+
+
+def _load_bits_of(pks):
+    """``{key: bitmap}`` for every value, read only in the bytes holding ``pks``; other bits are zero."""
+    ranges = _byte_ranges(pks)
+    columns = {f"range{n}": Substr("bits", start + 1, length, output_field=BinaryField())
+               for n, (start, length) in enumerate(ranges)}
+    stored = {}
+    for row in FacetBitmap.objects.values("key", **columns):
+        stored[row["key"]] = sum(int.from_bytes(row[f"range{n}"] or b"", "little") << 8 * start
+                                 for n, (start, _) in enumerate(ranges))
+    return stored
+
+
+def _write(bitmaps):
+    now = timezone.now()
+    FacetBitmap.objects.bulk_create(
+        [FacetBitmap(key=key, bits=_to_bytes(bits), updated_at=now) for key, bits in bitmaps.items()],
+        update_conflicts=True, unique_fields=["key"], update_fields=["bits", "updated_at"],
+    )
+    transaction.on_commit(catalog_cache.bump_facets)
+
+
+def _changes(stored, wanted, mask):
+    """``{key: bitmap}`` for the values whose bits change when the products in ``mask`` become ``wanted``."""
+    changed = {}
+    for key in stored.keys() | wanted.keys():
+        old = stored.get(key, 0)
+        new = (old & ~mask) | wanted.get(key, 0)
+        if new != old:
+            changed[key] = new
+    return changed
+
+
+def update(pks):
+    """Re-file ``pks`` (products changed or deleted) under their current facet values."""
+    pks = set(pks)
+    if not pks:
+        return
+    rows = Product.objects.filter(pk__in=pks).values_list(*FIELDS)
+    wanted = {}
+    for pk, *values in rows:
+        for key in keys_for(*values):
+            wanted[key] = wanted.get(key, 0) | 1 << pk
+    mask = to_bitmap(pks)
+    # Read only the bytes holding these products' bits; just the values that change are loaded whole.
+    keys = _changes(_load_bits_of(pks), wanted, mask).keys()
+    if not keys:
+        return
+    with transaction.atomic():
+        # Lock only the values that change, so writers refiling other facets do not queue behind this one.
+        stored = _load(FacetBitmap.objects.select_for_update().filter(key__in=keys).values_list("key", "bits"))
+        changed = _changes(stored, {key: bits for key, bits in wanted.items() if key in keys}, mask)
+        if changed:
+            _write(changed)
+
+
+def rebuild(batch_size=5000):
+    """Build the whole index from the product table. Returns the number of products."""
+    pks = {}
+    for pk, *values in Product.objects.values_list(*FIELDS).iterator(chunk_size=batch_size):
+        for key in keys_for(*values):
+            pks.setdefault(key, []).append(pk)
+    with transaction.atomic():
+        FacetBitmap.objects.all().delete()
+        _write({key: to_bitmap(members) for key, members in pks.items()})
+    return len(pks.get(ALL, ()))
+
+
+class Selection:
+    """The facet values picked in a request's query string."""
+
+    def __init__(self, query):
+        self.query = query
+        self.categories = {int(v) for v in query.getlist("category") if v.isdigit()}
+        buckets = {key for key, *_ in PRICE_BUCKETS}
+        self.prices = {v for v in query.getlist("price") if v in buckets}
+        self.in_stock = query.get("in_stock") == "1"
+        rating = query.get("rating", "")
+        self.rating = int(rating) if rating.isdigit() and int(rating) in MIN_RATINGS else None
+
+    def __bool__(self):
+        return bool(self.categories or self.prices or self.in_stock or self.rating)
+
+    def filter(self, queryset):
+        """``queryset`` narrowed to the selection, for loading a page of products."""
+        if self.categories:
+            queryset = queryset.filter(category_id__in=self.categories)
+        if self.prices:
+            condition = Q()
+            for key, _, low, high in PRICE_BUCKETS:
+                if key in self.prices:
+                    condition |= Q(price__gte=low, price__lt=high) if high is not None else Q(price__gte=low)
+            queryset = queryset.filter(condition)
+        if self.in_stock:
+            queryset = queryset.filter(stock__gt=0)
+        if self.rating:
+            queryset = queryset.filter(rating_avg__gte=self.rating)
+        return queryset
+
+    def _without(self, *params):
+        query = self.query.copy()
+        for param in params:
+            query.pop(param, None)
+        return query.urlencode()
+
+    @property
+    def sort_query(self):
+        """Query string for sort links, which keep the filters."""
+        return self._without("sort", "cursor")
+
+    @property
+    def page_query(self):
+        """Query string for pagination links, which add a cursor."""
+        return self._without("cursor")
+
+    def url(self, param, value=None):
+        """Link with ``value`` of ``param`` toggled (or ``param`` cleared), back on the first page."""
+        query = self.query.copy()
+        query.pop("cursor", None)
+        values = query.getlist(param)
+        if value is None:
+            query.pop(param, None)
+        elif param in ("category", "price"):
+            query.setlist(param, [v for v in values if v != value] if value in values else [*values, value])
+        else:
+            query.setlist(param, [] if value in values else [value])
+        return "?" + query.urlencode()
+
+
+class FacetIndex:
+    def __init__(self, version, written_at, bitmaps, categories):
+        self.version = version
+        self.written_at = written_at
+        self.checked_at = time.monotonic()
+        self.bitmaps = bitmaps
+        self.categories = categories
+
+    def _any(self, keys):
+        bits = 0
+        for key in keys:
+            bits |= self.bitmaps.get(key, 0)
+        return bits
+
+    def _masks(self, selection):
+        """The bitmap each facet of ``selection`` allows, for the facets it constrains."""
+        masks = {}
+        if selection.categories:
+            masks["category"] = self._any(f"category:{pk}" for pk in selection.categories)
+        if selection.prices:
+            masks["price"] = self._any(f"price:{key}" for key in selection.prices)
+        if selection.in_stock:
+            masks["in_stock"] = self.bitmaps.get(IN_STOCK, 0)
+        if selection.rating:
+            masks["rating"] = self._rating(selection.rating)
+        return masks
+
+    def _rating(self, stars):
+        return self._any(f"rating:{n}" for n in range(stars, 6))
+
+    def filter_ranked(self, selection, ranked):
+        """
+        Search results ``[(pk, score), ...]`` narrowed to ``selection``, and
+        the bitmap of all the hits for counting the facets within them.
+        """
+        hits = to_bitmap(pk for pk, _ in ranked)
+        if selection:
+            matching = self.matching(selection, within=hits)
+            ranked = [(pk, score) for pk, score in ranked if matching >> pk & 1]
+        return ranked, hits
+
+    def matching(self, selection, within=None):
+        """Bitmap of the products matching ``selection`` (and ``within``, e.g. search hits)."""
+        bits = self.bitmaps.get(ALL, 0) if within is None else within
+        for mask in self._masks(selection).values():
+            bits &= mask
+        return bits
+
+    def groups(self, selection, within=None):
+        """
+        Facets for the template, each option with its count and toggle URL.
+        An option's count ignores the other values picked in its own facet,
+        so picking one category still shows how many the others have.
+        """
+        masks = self._masks(selection)
+        universe = self.bitmaps.get(ALL, 0) if within is None else within
+
+        def base(facet):
+            bits = universe
+            for name, mask in masks.items():
+                if name != facet:
+                    bits &= mask
+            return bits
+
+        def option(param, value, label, bits, active):
+            return {"label": label, "count": bits.bit_count(), "active": active, "url": selection.url(param, value)}
+
+        in_category, in_price, in_stock, in_rating = base("category"), base("price"), base("in_stock"), base("rating")
+        groups = [
+            ("Category", "category", [
+                option("category", str(pk), name, in_category & self.bitmaps.get(f"category:{pk}", 0),
+                       pk in selection.categories)
+                for pk, name in self.categories
+            ]),
+            ("Price", "price", [
+                option("price", key, label, in_price & self.bitmaps.get(f"price:{key}", 0), key in selection.prices)
+                for key, label, *_ in PRICE_BUCKETS
+            ]),
+            ("Availability", "in_stock", [
+                option("in_stock", "1", "In stock", in_stock & self.bitmaps.get(IN_STOCK, 0), selection.in_stock),
+            ]),
+            ("Rating", "rating", [
+                option("rating", str(n), f"{n}★ & up", in_rating & self._rating(n), selection.rating == n)
+                for n in MIN_RATINGS
+            ]),
+        ]
+        return [
+            {"title": title, "param": param, "clear_url": selection.url(param),
+             "options": [o for o in options if o["count"] or o["active"]]}
+            for title, param, options in groups
+        ]
+
+
+_index = None
+
+
+def _last_write():
+    return FacetBitmap.objects.order_by("-updated_at").values_list("updated_at", flat=True)[:1]
+
+
+def _reusable(index, version, written_at):
+    """
+    Whether the loaded ``index`` is still current. A write seen only in the
+    table came from a process not sharing this cache, so this process's
+    cached listing pages are expired as well.
+    """
+    if index is None or index.version != version:
+        return False
+    if index.written_at == written_at:
+        index.checked_at = time.monotonic()
+        return True
+    catalog_cache.bump_facets(publish=False)
+    return False
+
+
+def _checked_recently(index, version):
+    return index is not None and index.version == version and time.monotonic() - index.checked_at < CHECK_SECONDS
+
+
+def current():
+    """The index as of the last change, loaded once per process per change."""
+    global _index
+    version = catalog_cache.facets_version()
+    index = _index
+    if _checked_recently(index, version):
+        return index
+    written_at = _last_write().first()
+    if _reusable(index, version, written_at):
+        return index
+    index = _index = FacetIndex(catalog_cache.facets_version(), written_at,
+                                _load(FacetBitmap.objects.values_list("key", "bits")),
+                                list(Category.objects.order_by("name").values_list("pk", "name")))
+    return index
+
+
+async def acurrent():
+    global _index
+    version = catalog_cache.facets_version()
+    index = _index
+    if _checked_recently(index, version):
+        return index
+    written_at = await _last_write().afirst()
+    if _reusable(index, version, written_at):
+        return index
+    rows = [row async for row in FacetBitmap.objects.values_list("key", "bits")]
+    categories = [row async for row in Category.objects.order_by("name").values_list("pk", "name")]
+    index = _index = FacetIndex(catalog_cache.facets_version(), written_at, _load(rows), categories)
+    return index
@@ -0,0 +1,85 @@
+"""
+Order fulfilment for completed Stripe checkouts.
+
+Runs inside the caller's transaction (the event queue worker's): the order
+and its products are locked. Stock held for the order at checkout
+(store.stock) becomes the sale; anything the holds did not cover (lines
+added since, or holds that expired) is decremented by one conditional
+UPDATE, and lines that ask for more than is in stock are recorded as
+Oversell rows. The order's line count and totals are stored from the line
+price snapshots as it is marked paid, so order history never reads live
+prices.
+"""
+import logging
+from decimal import Decimal
+
+from django.db.models import Case, Count, F, IntegerField, Sum, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import cart, stock
+from .models import Order, OrderItem, Oversell, Product, snapshot_subtotal
+
+logger = logging.getLogger(__name__)
+
+
+def decrement_stock(quantities):
+    """
+    Subtract ``{product_id: quantity}`` from stock in one UPDATE, clamping at
+    zero. Returns ``{product_id: available}`` for lines that were short.
+    Must run inside a transaction.
+    """
+    if not quantities:
+        return {}
+    locked = Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk')
+    available = dict(locked.values_list('pk', 'stock'))
+    short = {pk: n for pk, n in available.items() if n < quantities[pk]}
+    Product.objects.filter(pk__in=quantities).update(stock=Case(
+        *[When(pk=pk, then=Greatest(F('stock') - n, 0)) for pk, n in quantities.items()],
+        default=F('stock'),
+        output_field=IntegerField(),
+    ))
+    stock.stock_changed(quantities, [pk for pk, n in available.items() if 0 < n <= quantities[pk]])
+    return short
+
+
+def set_totals(orders):
+    """Set ``Order.TOTAL_FIELDS`` on ``orders`` from their line snapshots, in one query; does not save."""
+    rows = (OrderItem.objects.filter(order__in=orders).values('order')
+            .annotate(lines=Count('id'), subtotal=Sum(snapshot_subtotal())))
+    totals = {row['order']: row for row in rows}
+    for order in orders:
+        row = totals.get(order.pk, {})
+        order.line_count = row.get('lines', 0)
+        order.subtotal = row.get('subtotal') or Decimal('0')
+        order.discount_amount = (order.subtotal * order.discount / 100).quantize(Decimal('0.01'))
+        order.total = order.subtotal - order.discount_amount
+    return orders
+
+
+def fulfil_checkout_session(session_id):
+    """Mark the order for ``session_id`` paid and take its stock. Returns the order, if any."""
+    order = (Order.objects.select_for_update()
+             .filter(stripe_checkout_session_id=session_id).first())
+    if order is None or order.is_paid:
+        return None
+
+    quantities = dict(order.items.values_list('product_id', 'quantity'))
+    # Stock held at checkout is already taken; only lines the holds missed are decremented now.
+    unheld = stock.convert(order, quantities)
+    short = decrement_stock(unheld)
+    if short:
+        Oversell.objects.bulk_create([
+            Oversell(order=order, product_id=pk, requested=unheld[pk], available=available)
+            for pk, available in short.items()
+        ])
+        logger.warning("Order %s oversold products %s", order.pk, sorted(short))
+
+    # Lines added after the checkout session was created have no snapshot yet.
+    cart.snapshot_prices(order.items.filter(unit_price__isnull=True))
+    set_totals([order])
+    order.is_paid = True
+    order.paid_at = timezone.now()
+    order.save(update_fields=['is_paid', 'paid_at', *Order.TOTAL_FIELDS])
+    cart.invalidate(order.user_id)
+    return order
@@ -0,0 +1,109 @@
+"""
+Product image renditions.
+
+Each product image is resized to a few fixed widths in WebP and JPEG. The
+files are named after a hash of the source image's content, so they never
+change once written and can be cached by browsers forever. Which files exist
+for a product is recorded in ``Product.image_renditions``; templates turn it
+into ``srcset`` attributes (see the ``store_images`` template tags).
+"""
+import hashlib
+import logging
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+from . import catalog_cache
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = tuple(getattr(settings, "STORE_IMAGE_WIDTHS", (160, 320, 640, 1280)))
+RENDITIONS_DIR = "products/renditions"
+# name: (Pillow format, save options, MIME type)
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}, "image/webp"),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}, "image/jpeg"),
+}
+
+
+def _open(data):
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def make_renditions(source_name):
+    """
+    Write the renditions of the stored image ``source_name`` and return its
+    manifest. Touches storage only, never the database, so it is safe to run
+    in worker processes.
+    """
+    with default_storage.open(source_name, "rb") as fh:
+        data = fh.read()
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    image = _open(data)
+    manifest = {"source": source_name, "hash": digest, "width": image.width, "height": image.height,
+                "renditions": {fmt: [] for fmt in FORMATS}}
+    for width in sorted({min(w, image.width) for w in WIDTHS}):
+        resized = image if width == image.width else image.resize(
+            (width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        for fmt, (pil_format, options, _) in FORMATS.items():
+            name = f"{RENDITIONS_DIR}/{digest}-{width}w.{fmt}"
+            if not default_storage.exists(name):
+                buffer = BytesIO()
+                resized.save(buffer, pil_format, **options)
+                name = default_storage.save(name, ContentFile(buffer.getvalue()))
+            manifest["renditions"][fmt].append([width, name])
+    return manifest
+
+
+def needs_renditions(product):
+    if not product.image:
+        return bool(product.image_renditions)
+    return product.image_renditions.get("source") != product.image.name
+
+
+def refresh(product_id, source_name):
+    """
+    Regenerate one product's renditions, unless its image has changed again
+    since. An image that is missing or unreadable is logged and leaves the
+    renditions as they are, so the save that triggered this still succeeds;
+    generate_renditions retries it.
+    """
+    products = Product.objects.filter(pk=product_id)
+    if source_name:
+        try:
+            manifest = make_renditions(source_name)
+        except (OSError, SuspiciousFileOperation, Image.DecompressionBombError) as exc:
+            # OSError covers missing files and PIL.UnidentifiedImageError.
+            logger.warning("Could not render image %s of product %s: %s", source_name, product_id, exc)
+            return
+        products = products.filter(image=source_name)
+    else:
+        manifest = {}
+        products = products.filter(Q(image="") | Q(image__isnull=True))
+    products.update(image_renditions=manifest)
+    catalog_cache.bump_products([product_id])
+
+
+def srcset(product, fmt):
+    return ", ".join(f"{default_storage.url(name)} {width}w"
+                     for width, name in product.image_renditions.get("renditions", {}).get(fmt, []))
+
+
+def fallback_url(product, width=640):
+    """URL of the JPEG closest to ``width`` for browsers that ignore srcset."""
+    candidates = product.image_renditions.get("renditions", {}).get("jpeg")
+    if not candidates:
+        return product.image.url
+    return default_storage.url(min(candidates, key=lambda c: abs(c[0] - width))[1])
@@ -0,0 +1,242 @@
+"""
+Per-request instrumentation.
+
+``InstrumentationMiddleware`` wraps every database connection with
+``execute_wrapper`` for the length of a request to count queries, time them
+and spot repeated statements (the usual sign of an N+1). Template render
+time comes from the ``InstrumentedDjangoTemplates`` backend. Everything is
+aggregated per view into in-process histograms, served in Prometheus text
+format by ``store.views.metrics_view``; each worker process reports its own numbers.
+Slow requests are logged with their query fingerprints.
+"""
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+_in_list = re.compile(r"\((?:%s, )+%s\)")
+
+_current = ContextVar("store_request_stats", default=None)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per label tuple."""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name, self.help_text, self.labels, self.buckets = name, help_text, labels, buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        with self._lock:
+            items = [(labels, list(counts), total, n) for labels, (counts, total, n) in self._series.items()]
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, counts, total, n in sorted(items):
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{{{labels + ',' if labels else ''}{le}}} {cumulative}")
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {n}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, help_text, labels):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def collect(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{{{_labels(self.labels, values)}}} {n}" for values, n in items)
+        return lines
+
+
+def _labels(names, values):
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in values)
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+REQUESTS = CounterMetric("store_http_requests_total", "Requests by view, method and status.",
+                         ("view", "method", "status"))
+DURATION = Histogram("store_http_request_duration_seconds", "Total request latency.", ("view",), SECONDS_BUCKETS)
+QUERIES = Histogram("store_http_request_queries", "SQL queries per request.", ("view",), QUERY_BUCKETS)
+SQL_TIME = Histogram("store_http_request_sql_seconds", "Time spent in SQL per request.", ("view",),
+                     SECONDS_BUCKETS)
+TEMPLATE_TIME = Histogram("store_http_request_template_seconds", "Template render time per request.",
+                          ("view",), SECONDS_BUCKETS)
+DUPLICATES = CounterMetric("store_http_duplicate_queries_total",
+                           "Queries that repeated an earlier statement in the same request.", ("view",))
+METRICS = [REQUESTS, DURATION, QUERIES, SQL_TIME, TEMPLATE_TIME, DUPLICATES]
+
+
+class RequestStats:
+    __slots__ = ("queries", "sql_seconds", "template_seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(n - 1 for n in self.statements.values() if n > 1)
+
+    def fingerprints(self, limit=5):
+        """The most repeated statements, with IN lists collapsed."""
+        merged = Counter()
+        for sql, n in self.statements.items():
+            merged[_in_list.sub("(...)", sql)] += n
+        return merged.most_common(limit)
+
+
+def _wrap_connections(stack, stats):
+    for conn in connections.all():
+        stack.enter_context(conn.execute_wrapper(stats))
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, "INSTRUMENTATION_SLOW_REQUEST_MS", 500)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                _wrap_connections(stack, stats)
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        # Connections are per thread; the async ORM runs on the request's
+        # thread-sensitive executor, so the wrappers are installed there.
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        stack = ExitStack()
+        try:
+            await sync_to_async(_wrap_connections)(stack, stats)
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, stats, elapsed):
+        match = request.resolver_match
+        view = (match.view_name or match._func_path) if match else "<unresolved>"
+        REQUESTS.inc((view, request.method, response.status_code))
+        DURATION.observe((view,), elapsed)
+        QUERIES.observe((view,), stats.queries)
+        SQL_TIME.observe((view,), stats.sql_seconds)
+        TEMPLATE_TIME.observe((view,), stats.template_seconds)
+        duplicates = stats.duplicates
+        if duplicates:
+            DUPLICATES.inc((view,), duplicates)
+        if self.slow_ms is not None and elapsed * 1000 >= self.slow_ms:
+            logger.warning(
+                "Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms, %d repeated, templates %.0f ms; "
+                "top statements: %s",
+                request.method, request.path, view, elapsed * 1000, stats.queries, stats.sql_seconds * 1000,
+                duplicates, stats.template_seconds * 1000,
+                "; ".join(f"{n}x {sql[:200]}" for sql, n in stats.fingerprints()),
+            )
+
+
+class InstrumentedTemplate:
+    def __init__(self, template):
+        self._wrapped = template
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return self._wrapped.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self._wrapped.render(context, request)
+        finally:
+            stats.template_seconds += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing each top-level render for the current request."""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name))
+
+
+def render_metrics():
+    """All request metrics plus the Stripe event queue depth, in Prometheus text format."""
+    from . import event_queue
+
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.collect())
+    # Events are processed by the process_stripe_events worker, not here, so
+    # only the queue's state in the database is reported; the worker logs its own rates.
+    for status, value in event_queue.queue_depth().items():
+        name = f"store_stripe_queue_{status}"
+        lines.extend([f"# TYPE {name} gauge", f"{name} {value}"])
+    return "\n".join(lines) + "\n"
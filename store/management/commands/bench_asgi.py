@@ -0,0 +1,131 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from store import payments
+from store.benchmarks import fake_stripe
+from store.benchmarks.server import serve, serve_asgi
+from store.benchmarks.storefront import seed_storefront, session_cookies
+from store.benchmarks.utils import summarize, throwaway_database
+
+DEPLOYMENTS = {
+    # name: extra environment for the child process
+    "wsgi": {"ASYNC_VIEWS": "0"},
+    "asgi": {"ASYNC_VIEWS": "1", "DB_CONN_MAX_AGE": "0"},
+}
+SHIPPING = {"full_name": "Bench User", "address1": "1 Main St", "city": "Dublin", "country": "IE"}
+SCENARIOS = {
+    # name: (method, url name, form data, expected status)
+    "checkout": ("POST", "create_checkout_session", SHIPPING, 302),
+    "product_list": ("GET", "product_list", None, 200),
+}
+
+
+async def run_clients(base, scenario, jars, duration):
+    """One asyncio task per cookie jar, each issuing requests back to back for ``duration`` seconds."""
+    method, name, data, expect = SCENARIOS[scenario]
+    path = reverse(name)
+    samples, statuses = [], Counter()
+    deadline = time.perf_counter() + duration
+
+    async def client(jar):
+        async with httpx.AsyncClient(base_url=base, cookies=jar, timeout=30,
+                                     headers={"X-CSRFToken": jar[settings.CSRF_COOKIE_NAME]}) as http:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    status = (await http.request(method, path, data=data)).status_code
+                except httpx.HTTPError:  # refused, reset or timed out under load
+                    status = None
+                samples.append(time.perf_counter() - started)
+                statuses[status == expect] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(jar) for jar in jars))
+    elapsed = time.perf_counter() - started
+    return {**summarize(samples), "per_second": statuses[True] / elapsed, "errors": statuses[False]}
+
+
+class Command(BaseCommand):
+    help = ("Compare how many concurrent connections the WSGI deployment (sync views, threaded server) "
+            "and the ASGI deployment (async views under uvicorn) sustain while Stripe is slow.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--deployments", default=",".join(DEPLOYMENTS))
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+        parser.add_argument("--concurrency", default="8,32,128",
+                            help="Comma-separated numbers of concurrent clients to try.")
+        parser.add_argument("--duration", type=float, default=5.0, help="Seconds per scenario and level.")
+        parser.add_argument("--stripe-latency", type=float, default=0.3,
+                            help="Simulated Stripe round-trip time in seconds.")
+        parser.add_argument("--server-threads", type=int, default=8, help="WSGI worker threads.")
+        parser.add_argument("--products", type=int, default=500)
+        parser.add_argument("--json", action="store_true",
+                            help="Run the deployment selected by ASYNC_VIEWS only and print JSON.")
+
+    def handle(self, *args, **options):
+        scenarios = [s for s in options["scenarios"].split(",") if s]
+        deployments = [d for d in options["deployments"].split(",") if d]
+        unknown = (set(scenarios) - set(SCENARIOS)) | (set(deployments) - set(DEPLOYMENTS))
+        if unknown:
+            raise CommandError(f"Unknown scenarios or deployments: {', '.join(sorted(unknown))}")
+        levels = [int(n) for n in options["concurrency"].split(",") if n]
+        if options["json"]:
+            self.stdout.write(json.dumps(self.measure(scenarios, levels, options)))
+            return
+
+        results = {}
+        for deployment in deployments:
+            # ASYNC_VIEWS and CONN_MAX_AGE are read at startup, so each deployment runs in a child.
+            self.stdout.write(f"Running {deployment} ...")
+            child = subprocess.run(
+                [sys.executable, str(settings.BASE_DIR / "manage.py"), "bench_asgi", "--json",
+                 "--scenarios", ",".join(scenarios), "--concurrency", options["concurrency"],
+                 "--duration", str(options["duration"]), "--stripe-latency", str(options["stripe_latency"]),
+                 "--server-threads", str(options["server_threads"]), "--products", str(options["products"])],
+                env={**os.environ, **DEPLOYMENTS[deployment]}, capture_output=True, text=True,
+            )
+            if child.returncode:
+                raise CommandError(f"{deployment} failed:\n{child.stderr.strip()}")
+            results[deployment] = json.loads(child.stdout.strip().splitlines()[-1])
+
+        self.stdout.write(f"Stripe latency {options['stripe_latency'] * 1000:.0f} ms, "
+                          f"{options['server_threads']} WSGI threads, {options['duration']:.0f}s per level")
+        for scenario in scenarios:
+            self.stdout.write(f"{scenario}:")
+            for level in levels:
+                for deployment, result in results.items():
+                    stats = result[scenario][str(level)]
+                    self.stdout.write(f"  {level:>4} clients  {deployment:<5} {stats['per_second']:7.1f}/s  "
+                                      f"p50 {stats['p50_ms']:7.1f}  p95 {stats['p95_ms']:7.1f}  "
+                                      f"p99 {stats['p99_ms']:7.1f} ms  errors {stats['errors']}")
+
+    def measure(self, scenarios, levels, options):
+        with throwaway_database(on_disk=True), \
+                fake_stripe.FakeStripeServer(latency=options["stripe_latency"]) as stripe_api, \
+                override_settings(ALLOWED_HOSTS=["*"], STRIPE_API_BASE=stripe_api.url,
+                                  STRIPE_SECRET_KEY="sk_test_local", INSTRUMENTATION_SLOW_REQUEST_MS=None):
+            payments.reset()
+            ctx = seed_storefront(max(levels), options["products"], 0, 0)
+            jars = session_cookies(ctx["users"])
+            connection.close()
+            server = serve_asgi() if settings.ASYNC_VIEWS else serve(threads=options["server_threads"])
+            results = {}
+            with server as base:
+                for scenario in scenarios:
+                    results[scenario] = {
+                        str(level): asyncio.run(run_clients(base, scenario, jars[:level], options["duration"]))
+                        for level in levels
+                    }
+            return results
@@ -0,0 +1,64 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from store.benchmarks.seed import seed_catalogue
+from store.benchmarks.utils import throwaway_database
+from store.models import Order, OrderItem, Product
+
+
+def fill_cart(user, lines):
+    order, _ = Order.objects.get_or_create(user=user, is_paid=False)
+    products = Product.objects.order_by("pk")[:lines]
+    OrderItem.objects.bulk_create(OrderItem(order=order, product=p, quantity=2) for p in products)
+    return order
+
+
+def count_queries(client, url):
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get(url)
+    if response.status_code != 200:
+        raise CommandError(f"GET {url} returned {response.status_code}")
+    return len(ctx)
+
+
+class Command(BaseCommand):
+    help = ("Query-count regression check for the cart and checkout pages: "
+            "fails if the number of queries grows with the number of cart lines.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lines", type=int, nargs="+", default=[1, 50])
+        parser.add_argument("--max-queries", type=int, default=8,
+                            help="Upper bound for a warm (cached summary) page load.")
+
+    def handle(self, *args, **options):
+        sizes = sorted(options["lines"])
+        results = {}
+        with throwaway_database():
+            seed_catalogue(max(sizes))
+            for lines in sizes:
+                user = User.objects.create_user(f"bench-cart-{lines}", password="x")
+                fill_cart(user, lines)
+                client = Client()
+                client.force_login(user)
+                results[lines] = {
+                    "cart (cold)": count_queries(client, reverse("cart")),
+                    "cart (warm)": count_queries(client, reverse("cart")),
+                    "checkout": count_queries(client, reverse("checkout")),
+                }
+
+        pages = list(results[sizes[0]])
+        self.stdout.write("lines  " + "".join(f"{page:>14}" for page in pages))
+        for lines in sizes:
+            self.stdout.write(f"{lines:>5}  " + "".join(f"{results[lines][p]:>14}" for p in pages))
+
+        failures = [p for p in pages if len({results[n][p] for n in sizes}) > 1]
+        if failures:
+            raise CommandError(f"Query count grows with cart size on: {', '.join(failures)}")
+        warm = results[sizes[-1]]["cart (warm)"]
+        if warm > options["max_queries"]:
+            raise CommandError(f"Warm cart page issued {warm} queries (limit {options['max_queries']}).")
+        self.stdout.write(self.style.SUCCESS("Query counts are constant in cart size."))
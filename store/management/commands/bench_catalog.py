@@ -0,0 +1,88 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from store import search
+from store.benchmarks.seed import seed_catalogue
+from store.benchmarks.utils import summarize, throwaway_database
+from store.models import Product
+from store.views import PRODUCT_SORTS
+
+SEARCHES = ["oat", "almond", "protein", "organic", "tea", "seed", "bar", "rice", "honey", "nut"]
+NO_CACHE = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+
+
+def crawl(client, pages):
+    """URLs of the first ``pages`` pages of every sort order and of a few searches."""
+    base = reverse("product_list")
+    starts = [f"{base}?sort={sort}" for sort in PRODUCT_SORTS] + [f"{base}?q={q}" for q in SEARCHES]
+    urls = []
+    for url in starts:
+        for _ in range(pages):
+            urls.append(url)
+            products = client.get(url).context["products"]
+            if not products.has_next():
+                break
+            url = f"{url.split('&cursor=')[0]}&cursor={products.next_cursor}"
+    return urls
+
+
+def replay(client, urls, requests, write_every, rng):
+    """Anonymous traffic skewed towards the first pages, with an occasional product edit."""
+    weights = [1 / (i + 1) for i in range(len(urls))]
+    pks = list(Product.objects.values_list("pk", flat=True))
+    samples, queries, hits = [], 0, 0
+    for n in range(1, requests + 1):
+        if write_every and n % write_every == 0:
+            Product.objects.get(pk=rng.choice(pks)).save()
+        url = rng.choices(urls, weights)[0]
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = client.get(url)
+            samples.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise CommandError(f"GET {url} returned {response.status_code}")
+        queries += len(ctx)
+        hits += not ctx.captured_queries
+    return {**summarize(samples), "queries": queries / requests, "hit_ratio": hits / requests}
+
+
+class Command(BaseCommand):
+    help = ("Replay anonymous catalogue traffic with and without the cache and fail if too few "
+            "requests are served from it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=2000)
+        parser.add_argument("--pages", type=int, default=5, help="Pages crawled per sort order or search.")
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--write-every", type=int, default=500,
+                            help="Save a random product every N requests (0 disables).")
+        parser.add_argument("--min-hit-ratio", type=float, default=0.8)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            search.index_products(seed_catalogue(options["products"]))
+            client = Client()
+            urls = crawl(client, options["pages"])
+            results = {}
+            for label, caches in [("uncached", NO_CACHE), ("cached", None)]:
+                with override_settings(**({"CACHES": caches} if caches else {})):
+                    rng = random.Random(options["seed"])
+                    results[label] = replay(client, urls, options["requests"], options["write_every"], rng)
+
+        self.stdout.write(f"{options['requests']} anonymous requests over {len(urls)} catalogue URLs, "
+                          f"a product edit every {options['write_every']} requests")
+        for label, result in results.items():
+            self.stdout.write(f"  {label:<9} p50 {result['p50_ms']:6.2f} ms  p95 {result['p95_ms']:6.2f} ms  "
+                              f"queries/request {result['queries']:.2f}  served from cache {result['hit_ratio']:.0%}")
+        ratio = results["cached"]["hit_ratio"]
+        if ratio < options["min_hit_ratio"]:
+            raise CommandError(f"Only {ratio:.0%} of requests were served from the cache "
+                               f"(minimum {options['min_hit_ratio']:.0%}).")
+        self.stdout.write(self.style.SUCCESS("Anonymous catalogue traffic is mostly served from the cache."))
@@ -0,0 +1,81 @@
+from datetime import timedelta
+
+import stripe
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from store import cart, payments
+from store.benchmarks.fake_stripe import FakeStripeServer
+from store.benchmarks.seed import seed_catalogue
+from store.benchmarks.utils import summarize, throwaway_database, time_calls
+from store.models import Order, OrderItem, Product
+from vouchers.models import Voucher
+
+SHIPPING = {"full_name": "Bench User", "address1": "1 Main St", "city": "Dublin", "country": "IE"}
+
+
+def legacy_checkout(order, voucher):
+    # The previous path: a brand-new coupon and a session, both via the module-global client.
+    coupon = stripe.Coupon.create(percent_off=int(voucher.discount), duration="once")
+    stripe.checkout.Session.create(
+        mode="payment", payment_method_types=["card"],
+        line_items=[{"price_data": {"currency": "eur", "product_data": {"name": i.product.name},
+                                    "unit_amount": int(i.product.price * 100)}, "quantity": i.quantity}
+                    for i in order.items.select_related("product")],
+        success_url="http://testserver/success/", cancel_url="http://testserver/cancel/",
+        discounts=[{"coupon": coupon.id}],
+    )
+
+
+class Command(BaseCommand):
+    help = "Measure checkout-session latency and Stripe calls per checkout against a local fake Stripe."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--checkouts", type=int, default=50)
+        parser.add_argument("--lines", type=int, default=10)
+        parser.add_argument("--latency", type=float, default=0.05,
+                            help="Simulated Stripe round-trip time in seconds.")
+
+    def handle(self, *args, **options):
+        with throwaway_database(), FakeStripeServer(latency=options["latency"]) as server, \
+                override_settings(STRIPE_API_BASE=server.url, STRIPE_SECRET_KEY="sk_test_local"):
+            payments.reset()
+            seed_catalogue(options["lines"])
+            user = User.objects.create_user("bench-checkout", email="bench@example.com", password="x")
+            order = Order.objects.create(user=user)
+            cart.add_items(order, {pk: 1 for pk in Product.objects.values_list("pk", flat=True)})
+            now = timezone.now()
+            voucher = Voucher.objects.create(code="BENCH10", discount=10, active=True,
+                                             valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1))
+            client = Client()
+            client.force_login(user)
+            session = client.session
+            session["voucher_id"] = voucher.pk
+            session.save()
+            url = reverse("create_checkout_session")
+
+            def checkout():
+                Order.objects.filter(pk=order.pk).update(is_paid=False)
+                response = client.post(url, SHIPPING)
+                assert "/pay/cs_" in response.get("Location", ""), response.status_code
+
+            server.calls.clear()
+            gateway = summarize(time_calls(checkout, options["checkouts"]))
+            gateway_calls = sum(server.calls.values()) / options["checkouts"]
+
+            stripe.api_key, stripe.api_base = "sk_test_local", server.url
+            server.calls.clear()
+            legacy = summarize(time_calls(lambda: legacy_checkout(order, voucher), options["checkouts"]))
+            legacy_calls = sum(server.calls.values()) / options["checkouts"]
+
+            self.stdout.write(f"{options['checkouts']} checkouts, {options['lines']} lines, "
+                              f"simulated Stripe latency {options['latency'] * 1000:.0f} ms")
+            for label, stats, calls in [("legacy", legacy, legacy_calls), ("gateway", gateway, gateway_calls)]:
+                self.stdout.write(f"  {label:<8} p50 {stats['p50_ms']:7.1f} ms  p95 {stats['p95_ms']:7.1f} ms  "
+                                  f"p99 {stats['p99_ms']:7.1f} ms  Stripe calls/checkout {calls:.2f}")
+            self.stdout.write(f"  coupons created on the fake server: {len(server.coupons)}")
+            assert OrderItem.objects.filter(order=order).count() == options["lines"]
@@ -0,0 +1,146 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from store.benchmarks import fake_stripe
+from store.benchmarks.seed import seed_catalogue
+from store.benchmarks.server import serve
+from store.benchmarks.storefront import session_cookies
+from store.benchmarks.utils import summarize, throwaway_database
+from store.models import Product
+
+SCENARIOS = ("cart", "webhook")
+
+
+def cart_step(http, base, product_ids):
+    # One add-to-cart followed by the cart page, as a shopper would.
+    response = http.post(base + reverse("add_to_cart", args=[random.choice(product_ids)]),
+                         allow_redirects=False)
+    if response.status_code != 302:
+        return response.status_code
+    return http.get(base + reverse("cart")).status_code
+
+
+def webhook_step(http, base, product_ids):
+    body, headers = fake_stripe.signed_request(fake_stripe.checkout_completed(fake_stripe.new_id("cs")))
+    return http.post(base + reverse("stripe_webhook"), data=body,
+                     headers={"Content-Type": "application/json",
+                              "Stripe-Signature": headers["HTTP_STRIPE_SIGNATURE"]}).status_code
+
+
+def run_load(base, step, cookies, product_ids, duration):
+    """Run ``step`` in one thread per cookie jar for ``duration`` seconds."""
+    samples, statuses, lock = [], Counter(), threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(jar):
+        http = requests.Session()
+        http.cookies.update(jar)
+        http.headers["X-CSRFToken"] = jar[settings.CSRF_COOKIE_NAME]
+        local_samples, local_statuses = [], Counter()
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status = step(http, base, product_ids)
+            except requests.RequestException:  # refused or reset under load
+                status = "error"
+            local_samples.append(time.perf_counter() - started)
+            local_statuses[status] += 1
+        with lock:
+            samples.extend(local_samples)
+            statuses.update(local_statuses)
+
+    threads = [threading.Thread(target=client, args=(jar,)) for jar in cookies]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    ok = statuses[200]
+    return {
+        **summarize(samples),
+        "ok": ok,
+        "errors": sum(statuses.values()) - ok,
+        "per_second": ok / elapsed,
+    }
+
+
+class Command(BaseCommand):
+    help = ("Load-test the cart and webhook endpoints through a threaded WSGI server, "
+            "once per database profile (DB_PROFILE), and compare throughput.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", default="sqlite-basic,sqlite",
+                            help="Comma-separated DB_PROFILE values to compare.")
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+        parser.add_argument("--clients", type=int, default=16, help="Concurrent client threads.")
+        parser.add_argument("--server-threads", type=int, default=8)
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario.")
+        parser.add_argument("--products", type=int, default=200)
+        parser.add_argument("--json", action="store_true",
+                            help="Run the current profile only and print the results as JSON.")
+
+    def handle(self, *args, **options):
+        scenarios = [s for s in options["scenarios"].split(",") if s]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        if options["json"]:
+            self.stdout.write(json.dumps(self.measure(scenarios, options)))
+            return
+
+        results = {}
+        for profile in [p for p in options["profiles"].split(",") if p]:
+            # Settings are read once per process, so each profile runs in a child.
+            self.stdout.write(f"Running profile {profile} ...")
+            child = subprocess.run(
+                [sys.executable, str(settings.BASE_DIR / "manage.py"), "bench_database", "--json",
+                 "--scenarios", ",".join(scenarios), "--clients", str(options["clients"]),
+                 "--server-threads", str(options["server_threads"]),
+                 "--duration", str(options["duration"]), "--products", str(options["products"])],
+                env={**os.environ, "DB_PROFILE": profile}, capture_output=True, text=True,
+            )
+            if child.returncode:
+                raise CommandError(f"Profile {profile} failed:\n{child.stderr.strip()}")
+            results[profile] = json.loads(child.stdout.strip().splitlines()[-1])
+
+        self.stdout.write(f"{options['clients']} clients, {options['server_threads']} server threads, "
+                          f"{options['duration']:.0f}s per scenario")
+        for scenario in scenarios:
+            self.stdout.write(f"{scenario}:")
+            for profile, result in results.items():
+                stats = result[scenario]
+                self.stdout.write(f"  {profile:<13} {stats['per_second']:7.1f} ops/s  "
+                                  f"p50 {stats['p50_ms']:7.1f} ms  p95 {stats['p95_ms']:7.1f} ms  "
+                                  f"p99 {stats['p99_ms']:7.1f} ms  errors {stats['errors']}")
+
+    def measure(self, scenarios, options):
+        steps = {"cart": cart_step, "webhook": webhook_step}
+        allowed = [*settings.ALLOWED_HOSTS, "127.0.0.1"]
+        with throwaway_database(on_disk=True), \
+                override_settings(ALLOWED_HOSTS=allowed, STRIPE_WEBHOOK_SECRET=fake_stripe.WEBHOOK_SECRET):
+            seed_catalogue(options["products"])
+            product_ids = list(Product.objects.values_list("pk", flat=True))
+            users = [User.objects.create_user(f"bench-db-{n}", password="x") for n in range(options["clients"])]
+            cookies = session_cookies(users)
+            connection.close()
+            results = {}
+            with serve(threads=options["server_threads"]) as base:
+                for scenario in scenarios:
+                    results[scenario] = run_load(base, steps[scenario], cookies, product_ids,
+                                                 options["duration"])
+            return results
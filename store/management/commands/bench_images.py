@@ -0,0 +1,148 @@
+import re
+import shutil
+import tempfile
+from html.parser import HTMLParser
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from PIL import Image
+
+from store import cart
+from store.benchmarks.seed import seed_catalogue
+from store.benchmarks.utils import throwaway_database
+from store.models import Order, Product
+
+
+def photo(size, seed):
+    """A noisy colour image that compresses about as badly as a real product photo."""
+    noise = Image.effect_noise((size, size), 40 + seed)
+    gradient = Image.linear_gradient("L").resize((size, size))
+    return Image.merge("RGB", [noise, gradient, noise.rotate(90 * seed)])
+
+
+def upload_photos(products, size, distinct):
+    sources = []
+    for n in range(distinct):
+        buffer = BytesIO()
+        photo(size, n).save(buffer, "JPEG", quality=90)
+        sources.append(buffer.getvalue())
+    for n, product in enumerate(products):
+        name = default_storage.save(f"products/product_images/bench-{product.pk}.jpg",
+                                    ContentFile(sources[n % distinct]))
+        Product.objects.filter(pk=product.pk).update(image=name)
+
+
+def slot_width(sizes, viewport):
+    """CSS pixel width of an image slot for a ``sizes`` attribute at ``viewport`` px."""
+    for entry in sizes.split(","):
+        match = re.fullmatch(r"\s*(?:\(min-width:\s*(\d+)px\)\s*)?(\d+)(px|vw)\s*", entry)
+        if match and (match[1] is None or viewport >= int(match[1])):
+            return int(match[2]) if match[3] == "px" else viewport * int(match[2]) / 100
+    return viewport
+
+
+def choose(srcset, needed):
+    candidates = sorted((int(w[:-1]), url) for url, w in (c.split() for c in srcset.split(",")))
+    return next((url for width, url in candidates if width >= needed), candidates[-1][1])
+
+
+class ImageFetches(HTMLParser):
+    """The image URLs a browser with the given viewport would download for a page."""
+
+    def __init__(self, viewport, dpr):
+        super().__init__()
+        self.viewport, self.dpr = viewport, dpr
+        self.urls = []
+        self.picked = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "picture":
+            self.picked = None
+        elif tag == "source" and attrs.get("type") == "image/webp" and self.picked is None:
+            self.picked = choose(attrs["srcset"], slot_width(attrs["sizes"], self.viewport) * self.dpr)
+        elif tag == "img":
+            if self.picked is not None:
+                self.urls.append(self.picked)
+            elif attrs.get("srcset"):
+                self.urls.append(choose(attrs["srcset"], slot_width(attrs["sizes"], self.viewport) * self.dpr))
+            else:
+                self.urls.append(attrs["src"])
+
+    def handle_endtag(self, tag):
+        if tag == "picture":
+            self.picked = None
+
+
+def page_weight(client, url, viewport, dpr):
+    """``(html_bytes, image_bytes)`` for one page; only uploaded media is counted."""
+    response = client.get(url)
+    if response.status_code != 200:
+        raise CommandError(f"GET {url} returned {response.status_code}")
+    parser = ImageFetches(viewport, dpr)
+    parser.feed(response.content.decode())
+    media = [u[len(settings.MEDIA_URL):] for u in parser.urls if u.startswith(settings.MEDIA_URL)]
+    return len(response.content), sum(default_storage.size(name) for name in media)
+
+
+class Command(BaseCommand):
+    help = "Compare page weight of the product grid, cart and order history before and after image renditions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=16)
+        parser.add_argument("--size", type=int, default=1600, help="Edge length of the uploaded originals.")
+        parser.add_argument("--viewport", type=int, default=1280)
+        parser.add_argument("--dpr", type=float, default=2.0, help="Device pixel ratio.")
+        parser.add_argument("--workers", type=int, default=2)
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp(prefix="store-bench-media-")
+        try:
+            with throwaway_database(), override_settings(MEDIA_ROOT=media_root):
+                results = self.measure(options)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.stdout.write(f"viewport {options['viewport']}px @{options['dpr']}x, "
+                          f"{options['size']}px JPEG originals")
+        self.stdout.write(f"{'page':<15}{'before':>12}{'after':>12}{'saved':>8}")
+        for page, (before, after) in results.items():
+            self.stdout.write(f"{page:<15}{before / 1024:>9.0f} KB{after / 1024:>9.0f} KB"
+                              f"{1 - after / before:>8.0%}")
+        if any(after >= before for before, after in results.values()):
+            raise CommandError("Renditions did not make every page lighter.")
+
+    def measure(self, options):
+        products = seed_catalogue(options["products"])
+        upload_photos(products, options["size"], distinct=4)
+        user = User.objects.create_user("bench-images", password="x")
+        paid = Order.objects.create(user=user)
+        cart.add_items(paid, {p.pk: 1 for p in products})
+        cart.snapshot_prices(paid.items.all())
+        Order.objects.filter(pk=paid.pk).update(is_paid=True)
+        cart.add_items(Order.objects.create(user=user), {p.pk: 1 for p in products[:6]})
+
+        anonymous, shopper = Client(), Client()
+        shopper.force_login(user)
+        pages = {
+            "product grid": (anonymous, reverse("product_list")),
+            "cart": (shopper, reverse("cart")),
+            "order history": (shopper, reverse("order_history")),
+        }
+
+        def weigh():
+            return {name: sum(page_weight(client, url, options["viewport"], options["dpr"]))
+                    for name, (client, url) in pages.items()}
+
+        before = weigh()
+        call_command("generate_renditions", workers=options["workers"], stdout=self.stdout)
+        after = weigh()
+        return {name: (before[name], after[name]) for name in pages}
@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from itertools import islice
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from store import cooccurrence
+from store.benchmarks.seed import seed_catalogue
+from store.benchmarks.utils import throwaway_database
+from store.models import Order, OrderItem, Product, ProductRecommendation, Wishlist
+
+CLUSTER_SIZE = 50
+# Share of basket items drawn from the basket's cluster; the rest are noise.
+IN_CLUSTER = 0.8
+
+
+def synthetic_baskets(product_ids, lines, rng, basket_size=(2, 7)):
+    """
+    ``(basket, product)`` id arrays for about ``lines`` lines. Products come in
+    clusters of CLUSTER_SIZE; each basket picks a cluster with Zipf-like
+    popularity and mostly buys from it.
+    """
+    clusters = len(product_ids) // CLUSTER_SIZE
+    sizes = rng.integers(*basket_size, size=int(lines / np.mean(basket_size)) + 1)
+    popularity = 1 / np.arange(1, clusters + 1) ** 0.8
+    chosen = rng.choice(clusters, size=len(sizes), p=popularity / popularity.sum())
+    baskets = np.repeat(np.arange(len(sizes)), sizes)
+    home = np.repeat(chosen, sizes)
+    picks = home * CLUSTER_SIZE + rng.integers(0, CLUSTER_SIZE, size=len(baskets))
+    noise = rng.random(len(baskets)) > IN_CLUSTER
+    picks[noise] = rng.integers(0, clusters * CLUSTER_SIZE, size=int(noise.sum()))
+    # One line per product per basket, as OrderItem requires.
+    pairs = np.unique(np.stack([baskets, picks], axis=1), axis=0)
+    return pairs[:, 0], product_ids[pairs[:, 1]]
+
+
+def insert_orders(user, baskets, products, paid_at, batch_size=20000):
+    """Paid orders and their lines, written with executemany; the ORM would dominate the run."""
+    count = int(baskets.max()) + 1
+    first = (Order.objects.order_by("-pk").values_list("pk", flat=True).first() or 0) + 1
+    orders = Order.objects.bulk_create(
+        (Order(pk=first + n, user=user, is_paid=True, paid_at=paid_at) for n in range(count)),
+        batch_size=2000,
+    )
+    table = OrderItem._meta.db_table
+    rows = zip((baskets + first).tolist(), products.tolist())
+    with transaction.atomic(), connection.cursor() as cursor:
+        while batch := [(o, p, 1, "", 1, "", "{}") for o, p in islice(rows, batch_size)]:
+            cursor.executemany(
+                f"INSERT INTO {table} (order_id, product_id, quantity, product_name, unit_price, category_name, "
+                "image_renditions) VALUES (%s, %s, %s, %s, %s, %s, %s)", batch)
+    return orders
+
+
+class Command(BaseCommand):
+    help = ("Build recommendations for a synthetic catalogue with clustered, Zipf-distributed baskets; "
+            "time full and incremental builds and check that neighbours come from the same cluster.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100000)
+        parser.add_argument("--lines", type=int, default=1000000, help="Paid order lines for the full build.")
+        parser.add_argument("--new-lines", type=int, default=10000, help="Order lines for the incremental update.")
+        parser.add_argument("--wishlists", type=int, default=5000)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--scoring", choices=cooccurrence.SCORINGS, default="cosine")
+        parser.add_argument("--max-seconds", type=float, default=600.0,
+                            help="Fail if the full build takes longer.")
+        parser.add_argument("--min-precision", type=float, default=0.8,
+                            help="Fail if fewer top neighbours than this share are in the product's cluster.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["products"] < CLUSTER_SIZE:
+            raise CommandError(f"--products must be at least {CLUSTER_SIZE}.")
+        rng = np.random.default_rng(options["seed"])
+        state_dir = tempfile.mkdtemp(prefix="store-recs-")
+        state_path = os.path.join(state_dir, "state.npz")
+        settle = cooccurrence.SETTLE_SECONDS
+        # Orders are inserted as already settled, so there is nothing to wait for.
+        cooccurrence.SETTLE_SECONDS = 0
+        try:
+            with throwaway_database(on_disk=True):
+                self.run(options, rng, state_path)
+        finally:
+            cooccurrence.SETTLE_SECONDS = settle
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+    def run(self, options, rng, state_path):
+        scoring = {"scoring": options["scoring"], "state_path": state_path}
+        started = time.perf_counter()
+        seed_catalogue(options["products"])
+        product_ids = np.array(Product.objects.order_by("pk").values_list("pk", flat=True))
+        cluster_of = dict(zip(product_ids.tolist(), (np.arange(len(product_ids)) // CLUSTER_SIZE).tolist()))
+        user = User.objects.create_user("bench-recs")
+        baskets, products = synthetic_baskets(product_ids, options["lines"], rng)
+        insert_orders(user, baskets, products, timezone.now() - timedelta(days=1))
+        shoppers = User.objects.bulk_create(User(username=f"bench-wish-{n}") for n in range(options["wishlists"]))
+        wishlists = Wishlist.objects.bulk_create(Wishlist(user=u) for u in shoppers)
+        if wishlists:
+            w_baskets, w_products = synthetic_baskets(product_ids, len(wishlists) * 4, rng)
+            keep = w_baskets < len(wishlists)
+            Wishlist.products.through.objects.bulk_create(
+                (Wishlist.products.through(wishlist_id=wishlists[b].pk, product_id=p)
+                 for b, p in zip(w_baskets[keep].tolist(), w_products[keep].tolist())),
+                batch_size=5000,
+            )
+        self.stdout.write(f"Seeded {len(product_ids)} products, {len(baskets)} order lines and "
+                          f"{len(wishlists)} wishlists in {time.perf_counter() - started:.1f}s")
+
+        full = cooccurrence.build(workers=options["workers"], **scoring)
+        self.report("Full build", full)
+        precision = self.precision(cluster_of, rng)
+        self.stdout.write(f"  top-5 neighbours in the same cluster: {precision:.1%}")
+
+        baskets, products = synthetic_baskets(product_ids, options["new_lines"], rng)
+        insert_orders(user, baskets, products, timezone.now())
+        incremental = cooccurrence.update(**scoring)
+        self.report("Incremental update", incremental)
+        updated = dict(ProductRecommendation.objects.filter(product_id__in=np.unique(products).tolist()[:500])
+                       .values_list("product_id", "neighbours"))
+        cooccurrence.build(workers=options["workers"], **scoring)
+        rebuilt = dict(ProductRecommendation.objects.filter(pk__in=list(updated)).values_list("product_id", "neighbours"))
+        agree = np.mean([[pk for pk, _ in updated[k][:5]] == [pk for pk, _ in rebuilt.get(k, [])[:5]]
+                         for k in updated]) if updated else 1.0
+        self.stdout.write(f"  top-5 matching a full rebuild: {agree:.1%}")
+
+        total = sum(full.timings.values())
+        if total > options["max_seconds"]:
+            raise CommandError(f"Full build took {total:.1f}s (limit {options['max_seconds']:.0f}s).")
+        if precision < options["min_precision"]:
+            raise CommandError(f"Only {precision:.1%} of top neighbours share the product's cluster.")
+        if agree < 0.95:
+            raise CommandError(f"Incremental update matched a full rebuild for only {agree:.1%} of products.")
+
+    def report(self, label, stats):
+        timings = "  ".join(f"{name} {seconds:.2f}s" for name, seconds in stats.timings.items())
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{label}: {stats.products} products from {stats.lines} lines in {sum(stats.timings.values()):.2f}s"
+        ))
+        self.stdout.write(f"  {timings}")
+
+    def precision(self, cluster_of, rng, sample=2000):
+        rows = list(ProductRecommendation.objects.exclude(neighbours=[]).values_list("product_id", "neighbours"))
+        picked = rng.choice(len(rows), size=min(sample, len(rows)), replace=False) if rows else []
+        hits = total = 0
+        for i in picked:
+            pk, neighbours = rows[i]
+            for other, _ in neighbours[:5]:
+                hits += cluster_of[other] == cluster_of[pk]
+                total += 1
+        return hits / total if total else 0.0
@@ -0,0 +1,145 @@
+import random
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from store import fulfilment, stock
+from store.benchmarks.seed import seed_catalogue
+from store.benchmarks.utils import summarize, throwaway_database
+from store.models import Order, OrderItem, Oversell, Product, StockHold
+
+
+def seed_orders(label, count, hot, others, rng):
+    """One open order per shopper: a unit of the hot product, and sometimes a second product."""
+    users = User.objects.bulk_create(User(username=f"bench-{label}-{n}") for n in range(count))
+    orders = Order.objects.bulk_create(Order(user=u) for u in users)
+    lines = [OrderItem(order=o, product_id=hot, quantity=1) for o in orders]
+    lines += [OrderItem(order=o, product_id=rng.choice(others), quantity=1) for o in orders if rng.random() < 0.5]
+    OrderItem.objects.bulk_create(lines)
+    return orders
+
+
+def pay(order):
+    """What the webhook does to stock for a paid order."""
+    with transaction.atomic():
+        quantities = dict(order.items.values_list("product_id", "quantity"))
+        unheld = stock.convert(order, quantities)
+        short = fulfilment.decrement_stock(unheld)
+        if short:
+            Oversell.objects.bulk_create(Oversell(order=order, product_id=pk, requested=unheld[pk], available=n)
+                                         for pk, n in short.items())
+        Order.objects.filter(pk=order.pk).update(is_paid=True)
+
+
+def run_threads(orders, threads, attempt):
+    """Split ``orders`` over ``threads`` workers calling ``attempt(order)``; returns latencies and outcomes."""
+    samples, outcomes, lock = [], [], threading.Lock()
+
+    def worker(chunk):
+        local, results = [], []
+        try:
+            for order in chunk:
+                started = time.perf_counter()
+                results.append(attempt(order))
+                local.append(time.perf_counter() - started)
+        finally:
+            connection.close()
+        with lock:
+            samples.extend(local)
+            outcomes.extend(results)
+
+    workers = [threading.Thread(target=worker, args=(orders[n::threads],)) for n in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return summarize(samples), outcomes, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = ("Many shoppers check out at once while one product has little stock: compare checking stock "
+            "and decrementing it at the webhook (the old flow) with reserving it at checkout.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shoppers", type=int, default=400)
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--stock", type=int, default=50, help="Units of the hot product.")
+        parser.add_argument("--pay-rate", type=float, default=0.7, help="Share of checkouts that are paid.")
+        parser.add_argument("--latency", type=float, default=0.02,
+                            help="Simulated seconds between starting a checkout and paying.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        with throwaway_database(on_disk=True):
+            self.run(options)
+
+    def run(self, options):
+        rng = random.Random(options["seed"])
+        seed_catalogue(20)
+        hot, *others = Product.objects.order_by("pk").values_list("pk", flat=True)
+        Product.objects.filter(pk__in=others).update(stock=10 ** 6)
+        units = options["stock"]
+
+        def legacy(order):
+            # Stock is read when checkout starts but only taken when the payment arrives.
+            available = Product.objects.filter(pk=hot).values_list("stock", flat=True).get()
+            if available < 1:
+                return "refused"
+            time.sleep(options["latency"])
+            if rng.random() < options["pay_rate"]:
+                pay(order)
+                return "paid"
+            return "abandoned"
+
+        def reserved(order):
+            try:
+                stock.reserve(order)
+            except stock.OutOfStock:
+                return "refused"
+            time.sleep(options["latency"])
+            if rng.random() < options["pay_rate"]:
+                pay(order)
+                return "paid"
+            return "abandoned"
+
+        results = {}
+        for label, attempt in [("legacy", legacy), ("reserved", reserved)]:
+            Product.objects.filter(pk=hot).update(stock=units)
+            orders = seed_orders(label, options["shoppers"], hot, others, rng)
+            latency, outcomes, elapsed = run_threads(orders, options["threads"], attempt)
+            oversold = Oversell.objects.filter(order__in=orders, product_id=hot).aggregate(
+                n=Sum("requested") - Sum("available"))["n"] or 0
+            results[label] = {**latency, "elapsed": elapsed, "oversold": oversold,
+                              **{k: outcomes.count(k) for k in ("paid", "abandoned", "refused")}}
+            if label == "reserved":
+                results[label]["held"] = StockHold.objects.filter(product_id=hot).aggregate(n=Sum("quantity"))["n"] or 0
+                results[label]["left"] = Product.objects.get(pk=hot).stock
+                # Expire every remaining hold and let the sweeper hand the units back.
+                StockHold.objects.update(expires_at=timezone.now() - timedelta(days=1))
+                while stock.release_expired(batch_size=50):
+                    pass
+                results[label]["after_sweep"] = Product.objects.get(pk=hot).stock
+
+        self.stdout.write(f"{options['shoppers']} shoppers on {options['threads']} threads, "
+                          f"{units} units of the hot product, {options['pay_rate']:.0%} of checkouts paid")
+        for label, r in results.items():
+            self.stdout.write(
+                f"  {label:<9} {r['n'] / r['elapsed']:7.1f} checkouts/s  p50 {r['p50_ms']:6.1f}  "
+                f"p95 {r['p95_ms']:6.1f} ms  paid {r['paid']:4}  abandoned {r['abandoned']:4}  "
+                f"refused {r['refused']:4}  oversold units {r['oversold']}"
+            )
+        r = results["reserved"]
+        self.stdout.write(f"  reserved: {r['held']} units still held, {r['left']} on sale; "
+                          f"{r['after_sweep']} on sale after releasing expired holds")
+
+        if r["oversold"]:
+            raise CommandError(f"Reservations oversold {r['oversold']} units.")
+        if r["left"] + r["held"] + r["paid"] != units or r["after_sweep"] != units - r["paid"]:
+            raise CommandError("Units on sale, held and paid for do not add up to the stock.")
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from store import search
+from store.benchmarks.seed import seed_catalogue
+from store.benchmarks.utils import summarize, throwaway_database, time_calls
+from store.models import Product
+
+DEFAULT_QUERIES = ["apple", "organic", "gran", "protein bar", "green tea", "olive oil", "zzz"]
+PAGE_SIZE = 8
+
+
+def icontains_page(q):
+    # The pre-index product_list path: a COUNT for the paginator plus the first page.
+    qs = (Product.objects.select_related("category")
+          .filter(Q(name__icontains=q) | Q(description__icontains=q) | Q(category__name__icontains=q)))
+    qs.count()
+    return list(qs[:PAGE_SIZE])
+
+
+def index_page(q, backend):
+    ranked_ids = [pk for pk, _ in search.search(q, backend=backend)]
+    found = Product.objects.select_related("category").in_bulk(ranked_ids[:PAGE_SIZE])
+    return [found[pk] for pk in ranked_ids[:PAGE_SIZE] if pk in found]
+
+
+class Command(BaseCommand):
+    help = "Compare indexed product search with the old icontains scan on a scaled-up catalogue."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, nargs="+", default=[1000, 10000, 100000],
+                            help="Catalogue sizes to benchmark, smallest first.")
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--query", action="append", dest="queries",
+                            help="Search term to time (repeatable).")
+
+    def handle(self, *args, **options):
+        queries = options["queries"] or DEFAULT_QUERIES
+        with throwaway_database():
+            backends = ["tokens"]
+            if search.fts5_available():
+                backends.insert(0, "fts5")
+            for size in sorted(options["products"]):
+                created = seed_catalogue(size)
+                for backend in backends:
+                    search.index_products(created, backend=backend)
+
+                self.stdout.write(self.style.MIGRATE_HEADING(f"\n{Product.objects.count()} products"))
+                paths = [("icontains", icontains_page)]
+                paths += [(b, lambda q, b=b: index_page(q, b)) for b in backends]
+                for label, fn in paths:
+                    samples = []
+                    for q in queries:
+                        samples += time_calls(lambda: fn(q), options["repeat"])
+                    stats = summarize(samples)
+                    self.stdout.write(
+                        f"  {label:<10} p50 {stats['p50_ms']:8.2f} ms   "
+                        f"p95 {stats['p95_ms']:8.2f} ms   p99 {stats['p99_ms']:8.2f} ms"
+                    )
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from store.benchmarks.server import serve
+from store.benchmarks.storefront import seed_storefront, session_cookies
+from store.benchmarks.utils import summarize, throwaway_database
+from vouchers.models import Voucher
+
+ENGINES = {
+    "db": "django.contrib.sessions.backends.db",
+    "cached_db": "django.contrib.sessions.backends.cached_db",
+    "store": "store.sessions",
+}
+VOUCHER = "BENCH10"
+
+
+def checkout_flow(products):
+    """The requests of one browse-to-checkout visit: (method, path, data, expected status)."""
+    return [
+        ("GET", reverse("product_detail", args=[products[0]]), None, 200),
+        ("POST", reverse("add_to_cart", args=[products[0]]), None, 302),
+        ("GET", reverse("cart"), None, 200),
+        ("POST", reverse("vouchers:apply"), {"code": VOUCHER}, 302),
+        ("GET", reverse("checkout"), None, 200),
+    ]
+
+
+def session_queries(user, flow):
+    """SELECTs and writes on django_session for one flow through the test client."""
+    client = Client()
+    client.force_login(user)
+    counts = Counter()
+    for method, path, data, _ in flow * 2:
+        with CaptureQueriesContext(connection) as captured:
+            client.generic(method, path, "&".join(f"{k}={v}" for k, v in (data or {}).items()),
+                           content_type="application/x-www-form-urlencoded")
+        for query in captured:
+            if "django_session" in query["sql"]:
+                counts["reads" if query["sql"].lstrip().upper().startswith("SELECT") else "writes"] += 1
+    # The first pass warms caches; report the second.
+    return {k: v / 2 for k, v in counts.items()}
+
+
+def run_flows(base, flow, jars, duration):
+    """One thread per logged-in user, repeating the flow for ``duration`` seconds."""
+    flows, samples, errors, lock = [0], [], [0], threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(jar):
+        http = requests.Session()
+        http.cookies.update(jar)
+        http.headers["X-CSRFToken"] = jar[settings.CSRF_COOKIE_NAME]
+        done, local, bad = 0, [], 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            for method, path, data, expect in flow:
+                try:
+                    status = http.request(method, base + path, data=data, allow_redirects=False).status_code
+                except requests.RequestException:
+                    status = None
+                bad += status != expect
+            local.append(time.perf_counter() - started)
+            done += 1
+        with lock:
+            flows[0] += done
+            samples.extend(local)
+            errors[0] += bad
+
+    threads = [threading.Thread(target=worker, args=(jar,)) for jar in jars]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return {**summarize(samples), "per_second": flows[0] / elapsed, "errors": errors[0]}
+
+
+class Command(BaseCommand):
+    help = ("Compare checkout-flow throughput (product page, add to cart, cart, voucher, checkout) "
+            "and django_session queries across session engines.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--engines", default=",".join(ENGINES))
+        parser.add_argument("--workers", type=int, default=8, help="Concurrent logged-in users.")
+        parser.add_argument("--server-threads", type=int, default=8)
+        parser.add_argument("--duration", type=float, default=5.0, help="Seconds per engine.")
+
+    def handle(self, *args, **options):
+        engines = [e for e in options["engines"].split(",") if e]
+        unknown = set(engines) - set(ENGINES)
+        if unknown:
+            raise CommandError(f"Unknown engines: {', '.join(sorted(unknown))}")
+        results = {}
+        with throwaway_database(on_disk=True), override_settings(ALLOWED_HOSTS=["*"]):
+            ctx = seed_storefront(options["workers"] + 1, 200, 0, 0)
+            now = timezone.now()
+            Voucher.objects.create(code=VOUCHER, valid_from=now - timedelta(days=1),
+                                   valid_to=now + timedelta(days=1), discount=10, active=True)
+            flow = checkout_flow(ctx["cart_products"])
+            for engine in engines:
+                with override_settings(SESSION_ENGINE=ENGINES[engine]):
+                    queries = session_queries(ctx["users"][-1], flow)
+                    jars = session_cookies(ctx["users"][:options["workers"]])
+                    connection.close()
+                    with serve(threads=options["server_threads"]) as base:
+                        results[engine] = {**run_flows(base, flow, jars, options["duration"]), **queries}
+
+        self.stdout.write(f"{options['workers']} users, {len(flow)} requests per flow, "
+                          f"{options['duration']:.0f}s per engine")
+        for engine, r in results.items():
+            self.stdout.write(
+                f"  {engine:<10} {r['per_second']:6.1f} flows/s  p50 {r['p50_ms']:7.1f}  p95 {r['p95_ms']:7.1f} ms  "
+                f"session reads {r.get('reads', 0):4.1f}  writes {r.get('writes', 0):4.1f} per flow  "
+                f"errors {r['errors']}"
+            )
+        if "db" in results and "store" in results:
+            if results["store"].get("writes", 0) >= results["db"].get("writes", 0) and results["db"].get("writes"):
+                raise CommandError("store.sessions wrote the session table as often as the database backend.")
+            if results["store"]["errors"]:
+                raise CommandError("The checkout flow failed under store.sessions.")
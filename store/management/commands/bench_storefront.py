@@ -0,0 +1,131 @@
+import json
+import os
+import random
+import subprocess
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from store.benchmarks import fake_stripe
+from store.benchmarks.server import serve
+from store.benchmarks.storefront import SCENARIOS, run_http, run_test_client, seed_storefront, session_cookies
+from store.benchmarks.utils import throwaway_database
+
+MODES = ("client", "wsgi")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def regressions(baseline, current, tolerance, min_delta_ms):
+    """Scenarios whose p95 latency or query count got worse than ``baseline`` allows."""
+    found = []
+    for mode, scenarios in current["results"].items():
+        for name, stats in scenarios.items():
+            old = baseline.get("results", {}).get(mode, {}).get(name)
+            if not old:
+                continue
+            slower = stats["p95_ms"] - old["p95_ms"]
+            if slower > min_delta_ms and stats["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+                found.append(f"{mode}/{name}: p95 {old['p95_ms']:.1f} -> {stats['p95_ms']:.1f} ms")
+            if "queries_max" in stats and stats["queries_max"] > old.get("queries_max", stats["queries_max"]):
+                found.append(f"{mode}/{name}: up to {old['queries_max']} -> {stats['queries_max']} queries")
+            if stats["errors"] > old["errors"]:
+                found.append(f"{mode}/{name}: errors {old['errors']} -> {stats['errors']}")
+    return found
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the storefront request paths through the test client (with query counts) "
+            "and a threaded WSGI server, write the results as JSON and optionally compare them "
+            "with an earlier run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--products", type=int, default=2000)
+        parser.add_argument("--orders", type=int, default=500)
+        parser.add_argument("--reviews", type=int, default=2000)
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+        parser.add_argument("--modes", default=",".join(MODES))
+        parser.add_argument("--iterations", type=int, default=200, help="Requests per scenario (client mode).")
+        parser.add_argument("--workers", type=int, default=8, help="Concurrent HTTP clients (wsgi mode).")
+        parser.add_argument("--server-threads", type=int, default=8)
+        parser.add_argument("--duration", type=float, default=5.0, help="Seconds per scenario (wsgi mode).")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", help="Results file (default bench-results/storefront-<time>.json).")
+        parser.add_argument("--compare", help="Earlier results file; fail on regressions against it.")
+        parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="Allowed relative p95 slowdown before --compare fails.")
+        parser.add_argument("--min-delta-ms", type=float, default=5.0,
+                            help="Ignore p95 slowdowns smaller than this, which are mostly noise.")
+
+    def handle(self, *args, **options):
+        scenarios = [s for s in options["scenarios"].split(",") if s]
+        modes = [m for m in options["modes"].split(",") if m]
+        unknown = (set(scenarios) - set(SCENARIOS)) | (set(modes) - set(MODES))
+        if unknown:
+            raise CommandError(f"Unknown scenarios or modes: {', '.join(sorted(unknown))}")
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as fh:
+                baseline = json.load(fh)
+
+        results = {}
+        with throwaway_database(on_disk=True), \
+                override_settings(ALLOWED_HOSTS=["*"], STRIPE_WEBHOOK_SECRET=fake_stripe.WEBHOOK_SECRET):
+            ctx = seed_storefront(options["users"], options["products"], options["orders"], options["reviews"])
+            if "client" in modes:
+                results["client"] = {
+                    name: run_test_client(name, ctx, options["iterations"], random.Random(options["seed"]))
+                    for name in scenarios
+                }
+            if "wsgi" in modes:
+                jars = session_cookies(ctx["users"][:options["workers"]])
+                connection.close()
+                with serve(threads=options["server_threads"]) as base:
+                    results["wsgi"] = {
+                        name: run_http(name, ctx, base, jars, options["duration"], options["seed"])
+                        for name in scenarios
+                    }
+
+        report = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "revision": git_revision(),
+                "db_profile": getattr(settings, "DB_PROFILE", None),
+                "cache_backend": getattr(settings, "CACHE_BACKEND", None),
+                "options": {k: options[k] for k in ("users", "products", "orders", "reviews", "iterations",
+                                                    "workers", "server_threads", "duration", "seed")},
+            },
+            "results": results,
+        }
+        output = Path(options["output"] or settings.BASE_DIR / "bench-results" /
+                      f"storefront-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        os.makedirs(output.parent, exist_ok=True)
+        with open(output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+
+        for mode, rows in results.items():
+            self.stdout.write(f"{mode}:")
+            for name, stats in rows.items():
+                queries = f"  queries {stats['queries_mean']:5.1f} (max {stats['queries_max']})" \
+                    if "queries_mean" in stats else ""
+                self.stdout.write(f"  {name:<15} p50 {stats['p50_ms']:7.1f}  p95 {stats['p95_ms']:7.1f}  "
+                                  f"p99 {stats['p99_ms']:7.1f} ms  {stats['per_second']:7.1f}/s  "
+                                  f"errors {stats['errors']}{queries}")
+        self.stdout.write(f"Results written to {output}")
+
+        if baseline is not None:
+            found = regressions(baseline, report, options["tolerance"], options["min_delta_ms"])
+            if found:
+                raise CommandError("Regressions against " + options["compare"] + ":\n  " + "\n  ".join(found))
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['compare']}."))
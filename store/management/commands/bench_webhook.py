@@ -0,0 +1,122 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from store import event_queue
+from store.benchmarks import fake_stripe
+from store.benchmarks.seed import seed_catalogue
+from store.benchmarks.utils import summarize, throwaway_database
+from store.models import Order, OrderItem, Oversell, Product, StripeEvent
+
+
+def create_orders(count, hot_products, quantity):
+    # A user has one open order, so each order gets its own shopper.
+    users = User.objects.bulk_create(User(username=f"bench-webhook-{n}") for n in range(count))
+    orders = Order.objects.bulk_create(
+        Order(user=user, stripe_checkout_session_id=fake_stripe.new_id("cs")) for user in users
+    )
+    OrderItem.objects.bulk_create(
+        OrderItem(order=o, product=p, quantity=quantity) for o in orders for p in hot_products
+    )
+    return orders
+
+
+class Command(BaseCommand):
+    help = ("Concurrent-load test for the Stripe webhook: fires signed checkout.session.completed "
+            "events (plus duplicate retries) for orders competing for the same SKUs, then drains "
+            "the event queue with a pool of workers.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=500)
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--hot-skus", type=int, default=3)
+        parser.add_argument("--quantity", type=int, default=2, help="Units of each hot SKU per order.")
+        parser.add_argument("--stock", type=int, default=600,
+                            help="Starting stock of each hot SKU; below orders * quantity forces oversells.")
+        parser.add_argument("--retries", type=int, default=1, help="Extra deliveries of every event.")
+        parser.add_argument("--workers", type=int, default=4, help="Queue worker threads draining the events.")
+
+    def handle(self, *args, **options):
+        with throwaway_database(on_disk=True), override_settings(STRIPE_WEBHOOK_SECRET=fake_stripe.WEBHOOK_SECRET):
+            seed_catalogue(max(options["hot_skus"], 10))
+            hot = list(Product.objects.order_by("pk")[:options["hot_skus"]])
+            Product.objects.filter(pk__in=[p.pk for p in hot]).update(stock=options["stock"])
+            orders = create_orders(options["orders"], hot, options["quantity"])
+
+            events = [fake_stripe.checkout_completed(o.stripe_checkout_session_id, o.pk) for o in orders]
+            deliveries = [fake_stripe.signed_request(e) for e in events] * (1 + options["retries"])
+            url = reverse("stripe_webhook")
+
+            def deliver(request):
+                body, headers = request
+                client = Client(raise_request_exception=False)
+                started = time.perf_counter()
+                try:
+                    status = client.post(url, body, content_type="application/json", **headers).status_code
+                finally:
+                    connection.close()
+                return status, time.perf_counter() - started
+
+            connection.close()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options["threads"]) as pool:
+                results = list(pool.map(deliver, deliveries))
+            elapsed = time.perf_counter() - started
+
+            # Stripe redelivers anything that did not get a 2xx; do the same.
+            failed = [d for d, (s, _) in zip(deliveries, results) if s != 200]
+            retry_statuses = [deliver(d)[0] for d in failed]
+
+            def work(n):
+                try:
+                    # Keep going through backoff delays until nothing is left.
+                    while event_queue.drain(f"bench-{n}") or event_queue.queue_depth()["pending"]:
+                        time.sleep(0.1)
+                finally:
+                    connection.close()
+
+            connection.close()
+            drain_started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+                list(pool.map(work, range(options["workers"])))
+            drain_elapsed = time.perf_counter() - drain_started
+            stats = summarize([t for _, t in results])
+            demand = options["orders"] * options["quantity"]
+            expected_stock = max(0, options["stock"] - demand)
+            stock = {p.pk: p.stock for p in Product.objects.filter(pk__in=[p.pk for p in hot])}
+            paid = Order.objects.filter(pk__in=[o.pk for o in orders], is_paid=True).count()
+            recorded = StripeEvent.objects.filter(status=StripeEvent.DONE).count()
+            depth = event_queue.queue_depth()
+            oversells = Oversell.objects.count()
+            short_units = Oversell.objects.aggregate(n=Sum("requested"))["n"] or 0
+
+            self.stdout.write(f"{len(deliveries)} deliveries in {elapsed:.2f}s "
+                              f"({len(deliveries) / elapsed:.0f} req/s, {options['threads']} threads)")
+            self.stdout.write(f"webhook ack latency p50 {stats['p50_ms']:.1f} ms  p95 {stats['p95_ms']:.1f} ms  "
+                              f"p99 {stats['p99_ms']:.1f} ms")
+            self.stdout.write(f"non-200 responses: {len(failed)} "
+                              f"({sum(1 for s in retry_statuses if s != 200)} still failing after redelivery)")
+            self.stdout.write(f"{options['workers']} workers drained the queue in {drain_elapsed:.2f}s "
+                              f"({recorded / drain_elapsed:.0f} events/s); left pending {depth['pending']}, "
+                              f"dead {depth['dead']}")
+            self.stdout.write(f"orders paid {paid}/{len(orders)}, events processed {recorded}, "
+                              f"oversold lines {oversells} ({short_units} units requested)")
+            self.stdout.write(f"hot SKU stock: {sorted(stock.values())} (expected {expected_stock})")
+
+            problems = []
+            if any(s != 200 for s in retry_statuses):
+                problems.append("some deliveries failed even after redelivery")
+            if paid != len(orders) or recorded != len(events):
+                problems.append("not every event was processed exactly once")
+            if any(v != expected_stock for v in stock.values()):
+                problems.append("stock does not match demand (lost or doubled updates)")
+            if problems:
+                raise CommandError("; ".join(problems))
+            self.stdout.write(self.style.SUCCESS("Every event processed once with no lost stock updates."))
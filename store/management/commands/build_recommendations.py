@@ -0,0 +1,37 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import cooccurrence
+
+
+class Command(BaseCommand):
+    help = ("Rebuild 'customers also bought' recommendations from paid orders and wishlists, "
+            "or with --incremental fold in only the orders paid since the last run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--incremental", action="store_true",
+                            help="Update from orders paid since the last build (falls back to a full build).")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="Processes counting pairs in a full build.")
+        # Left unset, a full build uses the defaults and --incremental the last build's.
+        parser.add_argument("--top-k", type=int, help=f"Default {cooccurrence.TOP_K}.")
+        parser.add_argument("--min-support", type=float,
+                            help="Weighted co-occurrences a pair needs before it is recommended "
+                                 f"(default {cooccurrence.MIN_SUPPORT}).")
+        parser.add_argument("--scoring", choices=cooccurrence.SCORINGS, help="Default cosine.")
+
+    def handle(self, *args, **options):
+        if options["top_k"] is not None and options["top_k"] < 1:
+            raise CommandError("--top-k must be at least 1.")
+        scoring = {k: options[k] for k in ("top_k", "min_support", "scoring") if options[k] is not None}
+        stats = cooccurrence.update(**scoring) if options["incremental"] else None
+        if stats is None:
+            stats = cooccurrence.build(workers=options["workers"], **scoring)
+            kind = "Rebuilt"
+        else:
+            kind = "Updated"
+        timings = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in stats.timings.items())
+        self.stdout.write(self.style.SUCCESS(
+            f"{kind} recommendations for {stats.products} products from {stats.lines} order lines ({timings})."
+        ))
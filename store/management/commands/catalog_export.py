@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import catalog_io
+
+
+class Command(BaseCommand):
+    help = ("Stream every product to JSON Lines or CSV, in the format catalog_import reads. "
+            "Stock is the quantity on hand, including units held by open checkouts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Output file, or - for standard output.")
+        parser.add_argument("--format", choices=["jsonl", "csv"],
+                            help="Defaults to the file extension (.jsonl/.ndjson or .csv).")
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("jsonl" if path == "-" else None)
+        try:
+            fmt = fmt or catalog_io.detect_format(path)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if fmt not in ("jsonl", "csv"):
+            raise CommandError("Export writes jsonl or csv.")
+
+        fh = sys.stdout if path == "-" else open(path, "w", encoding="utf-8", newline="")
+        try:
+            count = catalog_io.write_rows(catalog_io.export_rows(options["batch_size"]), fh, fmt)
+        finally:
+            if fh is not sys.stdout:
+                fh.close()
+        if path != "-":
+            self.stdout.write(self.style.SUCCESS(f"Exported {count} products to {path}."))
@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import catalog_io
+from store.benchmarks.seed import SAMPLE_DATA, synthetic_rows
+
+
+class Command(BaseCommand):
+    help = "Write a synthetic catalogue of N products shaped like the sample data, for import tests."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Output file, or - for standard output.")
+        parser.add_argument("--products", type=int, default=100000)
+        parser.add_argument("--start", type=int, default=0, help="First product number (for SKUs and names).")
+        parser.add_argument("--format", choices=["jsonl", "csv"])
+        parser.add_argument("--sample", default=str(SAMPLE_DATA), help="dumpdata fixture to take the shape from.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        try:
+            fmt = options["format"] or ("jsonl" if path == "-" else catalog_io.detect_format(path))
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        rows = synthetic_rows(options["start"] + options["products"], options["start"], options["sample"])
+        fh = sys.stdout if path == "-" else open(path, "w", encoding="utf-8", newline="")
+        try:
+            count = catalog_io.write_rows(rows, fh, fmt)
+        finally:
+            if fh is not sys.stdout:
+                fh.close()
+        if path != "-":
+            self.stdout.write(self.style.SUCCESS(f"Wrote {count} products to {path}."))
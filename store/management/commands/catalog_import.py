@@ -0,0 +1,52 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import catalog_io
+
+
+class Command(BaseCommand):
+    help = ("Stream a catalogue file (JSON Lines, CSV or a dumpdata JSON array) into the database, "
+            "upserting products by SKU and categories by name. Stock in the file is the quantity on hand: "
+            "units held by open checkouts are subtracted from it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, or - for standard input.")
+        parser.add_argument("--format", choices=catalog_io.FORMATS,
+                            help="Defaults to the file extension (.jsonl/.ndjson, .csv, .json).")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per bulk upsert.")
+        parser.add_argument("--batches-per-transaction", type=int, default=10)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        try:
+            fmt = options["format"] or catalog_io.detect_format(path)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        def progress(stats):
+            if options["verbosity"] > 1:
+                self.stdout.write(f"  {stats.imported} products, {stats.rows_per_second:.0f} rows/s")
+
+        fh = sys.stdin if path == "-" else open(path, encoding="utf-8", newline="")
+        try:
+            stats = catalog_io.import_rows(
+                catalog_io.read_rows(fh, fmt), batch_size=options["batch_size"],
+                batches_per_transaction=options["batches_per_transaction"], progress=progress,
+            )
+        except ValueError as exc:
+            raise CommandError(f"Could not parse {path}: {exc}")
+        finally:
+            if fh is not sys.stdin:
+                fh.close()
+
+        for error in stats.errors:
+            self.stderr.write(error)
+        if stats.skipped:
+            self.stderr.write(f"Skipped {stats.skipped} invalid rows.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats.imported} products from {stats.rows} rows in {stats.elapsed:.2f}s "
+            f"({stats.rows_per_second:.0f} rows/s)."
+        ))
+        if stats.new_images:
+            self.stdout.write(f"{stats.new_images} products have a new image; run generate_renditions.")
@@ -0,0 +1,103 @@
+import re
+import time
+from datetime import timedelta
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from store import cart, catalog_cache, facets
+from store.event_queue import LEASE_SECONDS
+from store.models import (Order, OrderItem, Product, ProductRecommendation, Review, SearchToken, StockHold,
+                          StripeEvent, Wishlist)
+from store.pagination import CursorPaginator
+from store.views import PRODUCT_SORTS
+from vouchers.models import Voucher
+
+# A table read row by row: SQLite "SCAN <table>" without an index, Postgres "Seq Scan on <table>".
+FULL_SCAN = {
+    "sqlite": re.compile(r"\bSCAN (?!CONSTANT ROW)(\S+)(?!.*\b(?:USING|VIRTUAL TABLE)\b)"),
+    "postgresql": re.compile(r"\bSeq Scan on (\S+)"),
+}
+
+
+def sample():
+    """Ids and sort keys to fill the queries with; any row will do, the plans hardly depend on them."""
+    order = Order.objects.values("pk", "user_id", "created_at").first() or {
+        "pk": 1, "user_id": 1, "created_at": timezone.now()}
+    product = Product.objects.values("pk", "name", "price", "rating_avg", "category_id").first() or {
+        "pk": 1, "name": "", "price": 0, "rating_avg": 0, "category_id": 1}
+    return order, product
+
+
+def hot_paths():
+    """(label, queryset) for every query the storefront runs on each request, as the views build them."""
+    order, product = sample()
+    user_id, now = order["user_id"], timezone.now()
+    open_order = Order(pk=order["pk"], user_id=user_id)
+    history = CursorPaginator(Order.objects.filter(user_id=user_id, is_paid=True), ("-created_at", "-pk"))
+    due = (Q(status=StripeEvent.PENDING, available_at__lte=now)
+           | Q(status=StripeEvent.PROCESSING, claimed_at__lt=now - timedelta(seconds=LEASE_SECONDS)))
+    paths = [
+        ("cart: open order by session id", Order.objects.filter(user_id=user_id, is_paid=False, pk=order["pk"])),
+        ("cart: open order by user", Order.objects.filter(user_id=user_id, is_paid=False)[:1]),
+        ("cart: lines", cart._lines(open_order)),
+        ("cart: summary", open_order.items.values("order").annotate(**cart.SUMMARY_AGGREGATES)),
+        ("webhook: order by checkout session", Order.objects.filter(stripe_checkout_session_id="cs_test")[:1]),
+        ("webhook: claim queued events", StripeEvent.objects.filter(due).order_by("available_at", "pk")
+         .values_list("pk", flat=True)[:100]),
+        ("checkout: expired stock holds", StockHold.objects.filter(expires_at__lt=now).order_by("expires_at")
+         .values_list("pk", flat=True)[:1000]),
+        ("order history", history._window([order["created_at"], order["pk"]], True)),
+        ("product page: product", Product.objects.select_related("category").filter(pk=product["pk"])),
+        ("product page: reviews", Review.objects.filter(product_id=product["pk"])
+         .select_related("user").order_by("-created_at")),
+        ("product page: can_review", OrderItem.objects.filter(
+            order__user_id=user_id, order__is_paid=True, product_id=product["pk"])[:1]),
+        ("product page: recommendations", ProductRecommendation.objects.filter(product_id=product["pk"])),
+        ("listing: category", CursorPaginator(Product.objects.filter(category_id=product["category_id"]))
+         ._window([product["pk"]], True)),
+        ("listing: facet index last write", facets._last_write()),
+        ("every request: published catalogue versions", catalog_cache._published_since(time.time())),
+        ("search: token prefix", SearchToken.objects.filter(token__gte="app", token__lt="app\uffff")
+         .values_list("product_id", "weight")),
+        ("session", Session.objects.filter(session_key="x" * 32, expire_date__gt=now)),
+        ("voucher by code", Voucher.objects.filter(code_normalized="BENCH10")[:1]),
+        ("wishlist", Wishlist.objects.filter(user_id=user_id)),
+    ]
+    for sort, ordering in PRODUCT_SORTS.items():
+        paginator = CursorPaginator(Product.objects.select_related("category"), ordering, per_page=8)
+        values = [product[name.lstrip("-")] for name in ordering]
+        paths.append((f"listing: sort {sort or 'default'}", paginator._window(values, True)))
+    return paths
+
+
+class Command(BaseCommand):
+    help = ("Print the query plan of every hot-path query against the current database "
+            "and fail if any of them reads a whole table.")
+
+    def handle(self, *args, **options):
+        pattern = FULL_SCAN.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f"Query plans are only checked on SQLite and PostgreSQL, not {connection.vendor}.")
+        scans = []
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                # Judge the indexes, not the table sizes: small tables are always cheaper to scan.
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            for label, queryset in hot_paths():
+                plan = queryset.explain()
+                tables = [m.group(1) for line in plan.splitlines() if (m := pattern.search(line))]
+                if tables:
+                    scans.append(f"{label} ({', '.join(tables)})")
+                if options["verbosity"] >= 1:
+                    style = self.style.ERROR if tables else self.style.MIGRATE_HEADING
+                    self.stdout.write(style(label))
+                    for line in plan.splitlines():
+                        self.stdout.write(f"    {line}")
+        if scans:
+            raise CommandError("Full table scans in: " + "; ".join(scans))
+        self.stdout.write(self.style.SUCCESS("No hot-path query scans a whole table."))
@@ -0,0 +1,60 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store import catalog_cache, images
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = "Generate missing or stale product image renditions in a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--batch-size", type=int, default=200,
+                            help="Products handed to the pool (and saved) at a time.")
+        parser.add_argument("--force", action="store_true", help="Regenerate renditions that look current.")
+
+    def handle(self, *args, **options):
+        products = (Product.objects.exclude(image="").exclude(image__isnull=True)
+                    .only("pk", "image", "image_renditions").order_by("pk"))
+        started = time.perf_counter()
+        done = failed = 0
+        # Workers only read and write image files; all database writes happen here.
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=django.setup) as pool:
+            batch = []
+            for product in products.iterator(chunk_size=options["batch_size"]):
+                if options["force"] or images.needs_renditions(product):
+                    batch.append((product.pk, product.image.name))
+                if len(batch) >= options["batch_size"]:
+                    ok, bad = self.process(pool, batch)
+                    done, failed, batch = done + ok, failed + bad, []
+            if batch:
+                ok, bad = self.process(pool, batch)
+                done, failed = done + ok, failed + bad
+        elapsed = time.perf_counter() - started
+        message = f"Generated renditions for {done} products in {elapsed:.2f}s ({options['workers']} workers)."
+        if failed:
+            self.stderr.write(f"{failed} images could not be processed.")
+        self.stdout.write(self.style.SUCCESS(message))
+
+    def process(self, pool, batch):
+        futures = {pool.submit(images.make_renditions, name): (pk, name) for pk, name in batch}
+        manifests, failed = {}, 0
+        for future in as_completed(futures):
+            pk, name = futures[future]
+            try:
+                manifests[pk] = (name, future.result())
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f"Product {pk} ({name}): {exc}")
+        with transaction.atomic():
+            for pk, (name, manifest) in manifests.items():
+                # Skip products whose image was replaced while we worked.
+                Product.objects.filter(pk=pk, image=name).update(image_renditions=manifest)
+        catalog_cache.bump_products(list(manifests))
+        return len(manifests), failed
@@ -0,0 +1,76 @@
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from store import event_queue
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Drain queued Stripe webhook events with retry, backoff and dead-lettering. "
+            "Run several instances (or --workers) to scale out.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=1, help="Worker threads in this process.")
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--poll-interval", type=float, default=1.0,
+                            help="Seconds to sleep when the queue is empty.")
+        parser.add_argument("--stats-interval", type=float, default=30.0,
+                            help="Seconds between queue depth / latency log lines (0 disables).")
+        parser.add_argument("--once", action="store_true", help="Exit as soon as the queue is empty.")
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        base_id = f"{socket.gethostname()}-{os.getpid()}"
+        threads = [
+            threading.Thread(target=self.work, args=(f"{base_id}-{n}", options), daemon=True)
+            for n in range(options["workers"])
+        ]
+        for t in threads:
+            t.start()
+        last_stats = time.monotonic()
+        try:
+            while any(t.is_alive() for t in threads):
+                time.sleep(0.2)
+                if options["stats_interval"] and time.monotonic() - last_stats >= options["stats_interval"]:
+                    self.report()
+                    last_stats = time.monotonic()
+        except KeyboardInterrupt:
+            self.stop.set()
+            for t in threads:
+                t.join()
+        self.report()
+
+    def work(self, worker_id, options):
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                try:
+                    claimed = event_queue.process_batch(worker_id, options["batch_size"])
+                except Exception:
+                    # Claimed events are retried once their lease expires.
+                    logger.exception("Worker %s failed to process a batch", worker_id)
+                    claimed = 0
+                if not claimed:
+                    if options["once"]:
+                        return
+                    self.stop.wait(options["poll_interval"])
+        finally:
+            connection.close()
+
+    def report(self):
+        depth = event_queue.queue_depth()
+        stats = event_queue.metrics.snapshot()
+        self.stdout.write(
+            f"queue pending={depth['pending']} processing={depth['processing']} dead={depth['dead']} "
+            f"oldest={depth['oldest_pending_seconds']:.1f}s | processed={stats['processed']} "
+            f"failed={stats['failed']} rate={stats['rate_per_second']:.1f}/s "
+            f"latency p50={stats['latency_p50_seconds'] * 1000:.0f}ms "
+            f"p95={stats['latency_p95_seconds'] * 1000:.0f}ms p99={stats['latency_p99_seconds'] * 1000:.0f}ms"
+        )
@@ -0,0 +1,37 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from store import stock
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = ("Delete open orders (carts) nobody has touched for --days, and empty ones after --empty-days, "
+            "in small batches so request writers are never blocked for long.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=float, default=30, help="Age of an abandoned cart, in days.")
+        parser.add_argument("--empty-days", type=float, default=1, help="Age of an empty cart, in days.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        now = timezone.now()
+        stale = (Q(updated_at__lt=now - timedelta(days=options["days"]))
+                 | Q(updated_at__lt=now - timedelta(days=options["empty_days"]), items__isnull=True))
+        carts = Order.objects.filter(stale, is_paid=False)
+        deleted = 0
+        while pks := list(carts.order_by("pk").values_list("pk", flat=True).distinct()[:options["batch_size"]]):
+            # Stock held by a checkout that was never finished goes back first.
+            stock.release_orders(pks)
+            # Re-checked per batch: a cart changed or paid since the scan is kept.
+            deleted += Order.objects.filter(stale, pk__in=pks, is_paid=False).delete()[1].get("store.Order", 0)
+            if options["pause"]:
+                time.sleep(options["pause"])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} abandoned carts in {elapsed:.2f}s."))
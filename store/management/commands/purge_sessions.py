@@ -0,0 +1,25 @@
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = ("Delete expired sessions in small batches, each its own transaction, "
+            "so request writers are never blocked for long (unlike clearsessions).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        expired = Session.objects.filter(expire_date__lt=timezone.now())
+        deleted = 0
+        while keys := list(expired.values_list("session_key", flat=True)[:options["batch_size"]]):
+            deleted += Session.objects.filter(session_key__in=keys, expire_date__lt=timezone.now()).delete()[0]
+            if options["pause"]:
+                time.sleep(options["pause"])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired sessions in {elapsed:.2f}s."))
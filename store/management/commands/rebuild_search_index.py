@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product search index from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backend", choices=["auto", "fts5", "tokens"], default=None,
+                            help="Index to rebuild (defaults to STORE_SEARCH_BACKEND).")
+        parser.add_argument("--batch-size", type=int, default=search.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        backend = options["backend"]
+        if backend == "fts5" and not search.fts5_available():
+            raise CommandError("This database has no FTS5 index table; run migrate on SQLite with FTS5.")
+        started = time.perf_counter()
+        count = search.rebuild(backend=backend, batch_size=options["batch_size"])
+        elapsed = time.perf_counter() - started
+        name = search.get_backend(backend).name
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} products ({name}) in {elapsed:.2f}s."))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized rating aggregates on every product from its reviews."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        checked, fixed = ratings.reconcile(batch_size=options["batch_size"])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {checked} products, fixed {fixed} in {elapsed:.2f}s."
+        ))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import stock
+
+
+class Command(BaseCommand):
+    help = ("Return the stock of expired checkout holds in small batches, each its own transaction. "
+            "Run it every minute or so.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        released = 0
+        while batch := stock.release_expired(options["batch_size"]):
+            released += batch
+            if options["pause"]:
+                time.sleep(options["pause"])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired stock holds in {elapsed:.2f}s."))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store import payments
+from vouchers.models import Voucher
+
+
+class Command(BaseCommand):
+    help = "Create the Stripe coupon for every current voucher ahead of time, off the checkout path."
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        vouchers = Voucher.objects.filter(active=True, valid_to__gte=now)
+        created = 0
+        for voucher in vouchers.iterator():
+            before = voucher.stripe_coupon_id
+            if payments.coupon_for_voucher(voucher) != before:
+                created += 1
+        self.stdout.write(self.style.SUCCESS(f"{created} coupon(s) created or updated."))
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:51
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    OrderItem = apps.get_model('store', 'OrderItem')
+    duplicates = (OrderItem.objects.values('order_id', 'product_id')
+                  .annotate(n=Count('id'), keep=Min('id'), quantity=Sum('quantity'))
+                  .filter(n__gt=1))
+    for dup in list(duplicates):
+        OrderItem.objects.filter(pk=dup['keep']).update(quantity=dup['quantity'])
+        (OrderItem.objects.filter(order_id=dup['order_id'], product_id=dup['product_id'])
+         .exclude(pk=dup['keep']).delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='one_line_per_order_product'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:55
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_done(apps, schema_editor):
+    # Events recorded before the queue existed were handled inline.
+    StripeEvent = apps.get_model('store', 'StripeEvent')
+    StripeEvent.objects.update(status='done', processed_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_stripeevent_oversell'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripeevent',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='stripeevent',
+            name='available_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='stripeevent',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stripeevent',
+            name='claimed_by',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='stripeevent',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='stripeevent',
+            name='payload',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='stripeevent',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stripeevent',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('dead', 'Dead-lettered')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='stripeevent',
+            index=models.Index(fields=['status', 'available_at'], name='stripeevent_queue_idx'),
+        ),
+        migrations.RunPython(mark_existing_done, migrations.RunPython.noop),
+    ]
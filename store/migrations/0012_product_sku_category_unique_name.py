@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:10
+
+from django.db import migrations, models
+from django.db.models import CharField, Count, Min, Value
+from django.db.models.functions import Cast, Concat
+
+
+def backfill_skus_and_merge_categories(apps, schema_editor):
+    Category = apps.get_model('store', 'Category')
+    Product = apps.get_model('store', 'Product')
+    Product.objects.filter(sku__isnull=True).update(
+        sku=Concat(Value('HF-'), Cast('pk', CharField()), output_field=CharField()),
+    )
+    duplicates = Category.objects.values('name').annotate(n=Count('id'), keep=Min('id')).filter(n__gt=1)
+    for dup in list(duplicates):
+        others = Category.objects.filter(name=dup['name']).exclude(pk=dup['keep'])
+        Product.objects.filter(category__in=others).update(category_id=dup['keep'])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_product_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_skus_and_merge_categories, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:29
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+
+BATCH_SIZE = 500
+
+
+def backfill_paid_order_totals(apps, schema_editor):
+    # Historical orders only have live prices to go on; new ones are stored at payment.
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    line = ExpressionWrapper(F('quantity') * F('product__price'),
+                             output_field=DecimalField(max_digits=12, decimal_places=2))
+    paid = Order.objects.filter(is_paid=True).order_by('pk').only('pk', 'discount')
+    last_pk = 0
+    while True:
+        orders = list(paid.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not orders:
+            break
+        totals = {row['order']: row for row in OrderItem.objects.filter(order__in=orders).values('order')
+                  .annotate(lines=Count('id'), subtotal=Sum(line))}
+        for order in orders:
+            row = totals.get(order.pk, {})
+            order.line_count = row.get('lines', 0)
+            order.subtotal = row.get('subtotal') or Decimal('0')
+            order.discount_amount = (order.subtotal * order.discount / 100).quantize(Decimal('0.01'))
+            order.total = order.subtotal - order.discount_amount
+        Order.objects.bulk_update(orders, ['line_count', 'subtotal', 'discount_amount', 'total'])
+        last_pk = orders[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_product_sku_category_unique_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discount_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12),
+        ),
+        migrations.RunPython(backfill_paid_order_totals, migrations.RunPython.noop),
+    ]
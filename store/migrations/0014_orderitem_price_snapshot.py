@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:31
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def backfill_paid_line_snapshots(apps, schema_editor):
+    # Paid lines get today's product name and price, the closest record there is.
+    OrderItem = apps.get_model('store', 'OrderItem')
+    Product = apps.get_model('store', 'Product')
+    product = Product.objects.filter(pk=OuterRef('product_id'))
+    last = OrderItem.objects.aggregate(m=Max('pk'))['m'] or 0
+    for start in range(0, last, BATCH_SIZE):
+        OrderItem.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE, order__is_paid=True).update(
+            product_name=Subquery(product.values('name')[:1]),
+            unit_price=Subquery(product.values('price')[:1]),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_order_stored_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.RunPython(backfill_paid_line_snapshots, migrations.RunPython.noop),
+    ]
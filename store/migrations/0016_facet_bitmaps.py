@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:49
+
+from decimal import Decimal
+from django.db import migrations, models
+
+# Frozen copy of store.facets' keys as of this migration.
+PRICE_BUCKETS = [("0-5", Decimal("5")), ("5-10", Decimal("10")), ("10-20", Decimal("20")), ("20-", None)]
+
+
+def price_bucket(price):
+    for key, high in PRICE_BUCKETS:
+        if high is None or price < high:
+            return key
+
+
+def to_bytes(pks):
+    bits = bytearray(max(pks) // 8 + 1)
+    for pk in pks:
+        bits[pk >> 3] |= 1 << (pk & 7)
+    return bytes(bits)
+
+
+def build_facet_index(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    FacetBitmap = apps.get_model('store', 'FacetBitmap')
+    members = {}
+    rows = Product.objects.values_list('pk', 'category_id', 'price', 'stock', 'rating_avg')
+    for pk, category_id, price, stock, rating_avg in rows.iterator(chunk_size=5000):
+        keys = ['all', f'category:{category_id}', f'price:{price_bucket(price)}', f'rating:{min(5, int(rating_avg))}']
+        if stock > 0:
+            keys.append('stock:in')
+        for key in keys:
+            members.setdefault(key, []).append(pk)
+    FacetBitmap.objects.bulk_create([FacetBitmap(key=key, bits=to_bytes(pks)) for key, pks in members.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetBitmap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('bits', models.BinaryField(default=b'')),
+            ],
+        ),
+        migrations.RunPython(build_facet_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:54
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def merge_duplicate_open_orders(apps, schema_editor):
+    # Keep each user's newest open order and move the other carts' lines into it.
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    duplicates = (Order.objects.filter(is_paid=False).values('user_id')
+                  .annotate(n=Count('id'), keep=Max('id')).filter(n__gt=1))
+    for dup in list(duplicates):
+        others = Order.objects.filter(user_id=dup['user_id'], is_paid=False).exclude(pk=dup['keep'])
+        kept = {item.product_id: item for item in OrderItem.objects.filter(order_id=dup['keep'])}
+        for item in OrderItem.objects.filter(order__in=others).order_by('pk'):
+            if item.product_id in kept:
+                kept[item.product_id].quantity += item.quantity
+                kept[item.product_id].save(update_fields=['quantity'])
+                item.delete()
+            else:
+                item.order_id = dup['keep']
+                item.save(update_fields=['order'])
+                kept[item.product_id] = item
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_facet_bitmaps'),
+        ('vouchers', '0003_voucher_code_normalized'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(merge_duplicate_open_orders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_paid', False)), fields=('user',), name='one_open_order_per_user'),
+        ),
+    ]
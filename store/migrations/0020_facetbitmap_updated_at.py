@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_stock_holds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facetbitmap',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:40
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def backfill_paid_line_snapshots(apps, schema_editor):
+    # As in 0014: paid lines get the product's current category and image.
+    OrderItem = apps.get_model('store', 'OrderItem')
+    Product = apps.get_model('store', 'Product')
+    product = Product.objects.filter(pk=OuterRef('product_id'))
+    last = OrderItem.objects.aggregate(m=Max('pk'))['m'] or 0
+    for start in range(0, last, BATCH_SIZE):
+        OrderItem.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE, order__is_paid=True).update(
+            category_name=Subquery(product.values('category__name')[:1]),
+            image=Subquery(product.values('image')[:1]),
+            image_renditions=Subquery(product.values('image_renditions')[:1]),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_cache_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='category_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='image',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='products/product_images/'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(backfill_paid_line_snapshots, migrations.RunPython.noop),
+    ]
@@ -1,27 +1,66 @@
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from decimal import Decimal
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from vouchers.models import Voucher
 
 class Category(models.Model):
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, unique=True)
 
     def __str__(self):
         return self.name
 
 class Product(models.Model):
+    # Supplier stock-keeping unit; the key catalogue imports upsert on.
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
     price = models.DecimalField(max_digits=8, decimal_places=2)
     stock = models.PositiveIntegerField()
     image = models.ImageField(upload_to="products/product_images/", blank=True, null=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="products")
+    # Resized copies of image, maintained by store.images.
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    # Review aggregates, maintained by store.ratings on every review change.
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        # One per catalogue sort (store.views.PRODUCT_SORTS), so keyset pages are index range scans.
+        indexes = [
+            models.Index(fields=['rating_avg', 'id'], name='product_rating_avg_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # A full save of a stale instance must not overwrite the rating
+        # aggregates or image renditions, which only store.ratings and
+        # store.images write.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and not f.name.startswith('rating_') and f.name != 'image_renditions'
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def rating_histogram(self):
+        """Review counts per star, highest first: [(5, n), (4, n), ...]."""
+        return [(star, getattr(self, f"rating_{star}")) for star in range(5, 0, -1)]
+
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     full_name = models.CharField(max_length=100, blank=True)
@@ -33,28 +72,82 @@ class Order(models.Model):
     country = models.CharField(max_length=2, blank=True, help_text="ISO 2-letter code, e.g. IE, GB, US")
     phone = models.CharField(max_length=30, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Touched by every cart change (store.cart.add_items); purge_carts reads it.
+    updated_at = models.DateTimeField(auto_now=True)
     is_paid = models.BooleanField(default=False)
+    paid_at = models.DateTimeField(null=True, blank=True, db_index=True)
     voucher = models.ForeignKey(Voucher,related_name='orders', null=True, blank=True, on_delete=models.SET_NULL)
     discount = models.IntegerField(default = 0, validators=[MinValueValidator(0), MaxValueValidator(100)])
     
     stripe_checkout_session_id = models.CharField(max_length=255, blank=True, null=True)
 
+    # Stored when the order is paid (store.fulfilment.set_totals).
+    line_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+    discount_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+
+    TOTAL_FIELDS = ['line_count', 'subtotal', 'discount_amount', 'total']
+
+    class Meta:
+        constraints = [
+            # A user has at most one open order: their cart (store.cart.get_open_order).
+            models.UniqueConstraint(fields=['user'], condition=models.Q(is_paid=False), name='one_open_order_per_user'),
+            # Webhook fulfilment looks orders up by their Checkout Session. Unique, so the
+            # planner knows it matches one row even while most orders have none yet.
+            models.UniqueConstraint(fields=['stripe_checkout_session_id'], name='one_order_per_checkout_session'),
+        ]
+        indexes = [
+            # Order history, and the paid-order join behind can_review on product pages. Partial
+            # rather than on (user, is_paid, ...) because is_paid=True compiles to a bare
+            # "is_paid" test, which SQLite cannot match against an index column.
+            models.Index(fields=['user', '-created_at', '-id'], condition=models.Q(is_paid=True),
+                         name='order_paid_user_created_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} - {self.user.username}"
 
     def total_amount(self):
-        return sum((item.subtotal() for item in self.items.select_related('product')), Decimal('0'))
+        # Paid orders are priced from their line snapshots; open carts follow live prices.
+        subtotal = snapshot_subtotal() if self.is_paid else line_subtotal()
+        return self.items.aggregate(total=models.Sum(subtotal))['total'] or Decimal('0')
+
+def line_subtotal():
+    """Database expression for an OrderItem's quantity times its product's price."""
+    return models.ExpressionWrapper(
+        models.F('quantity') * models.F('product__price'),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    )
+
+def snapshot_subtotal():
+    """Database expression for an OrderItem's quantity times its captured unit price (no product join)."""
+    return models.ExpressionWrapper(
+        models.F('quantity') * models.F('unit_price'),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    )
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    # Captured at checkout (store.cart.snapshot_prices); empty while the line is in an open cart.
+    product_name = models.CharField(max_length=200, blank=True)
+    unit_price = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    category_name = models.CharField(max_length=100, blank=True)
+    # Named as on Product, so the product_image template tag renders a line like a product.
+    image = models.ImageField(upload_to="products/product_images/", blank=True, null=True, editable=False)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['order', 'product'], name='one_line_per_order_product')]
 
     def __str__(self):
-        return f"{self.product.name} x {self.quantity}"
+        return f"{self.product_name or self.product.name} x {self.quantity}"
 
     def subtotal(self):
-        return (self.product.price or Decimal("0")) * self.quantity
+        price = self.unit_price if self.unit_price is not None else self.product.price
+        return (price or Decimal("0")) * self.quantity
 
 class Wishlist(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -72,6 +165,137 @@ class Review(models.Model):
 
     class Meta:
         constraints = [ models.UniqueConstraint(fields=['user','product'], name='one_review_per_user_product')]
+        indexes = [models.Index(fields=['product', '-created_at'], name='review_product_created_idx')]
 
     def __str__(self):
         return f"{self.product.name} - {self.rating} stars"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what is stored so edits can be applied to Product as a delta.
+        instance._saved = (instance.__dict__.get('product_id'), instance.__dict__.get('rating'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Keep the review and its product's rating aggregates in one transaction.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._saved = (self.product_id, self.rating)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
+
+class SearchToken(models.Model):
+    """Inverted index row used when the database has no FTS5 support."""
+    token = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="search_tokens")
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [models.Index(fields=['token', 'product'], name='searchtoken_token_product')]
+
+    def __str__(self):
+        return f"{self.token} -> {self.product_id}"
+
+
+class StripeEvent(models.Model):
+    """
+    A verified Stripe webhook event, queued for the background worker
+    (``process_stripe_events``). The unique event id makes redeliveries no-ops.
+    """
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    DEAD = 'dead'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (DEAD, 'Dead-lettered'),
+    ]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=64, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'available_at'], name='stripeevent_queue_idx')]
+
+    def __str__(self):
+        return f"{self.type} {self.event_id}"
+
+
+class Oversell(models.Model):
+    """Recorded when a paid order asked for more units than were in stock."""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="oversells")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="oversells")
+    requested = models.PositiveIntegerField()
+    available = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.product} short by {self.requested - self.available} on order {self.order_id}"
+
+
+class StockHold(models.Model):
+    """Units taken from a product's stock for an order whose checkout is in progress (store.stock)."""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="stock_holds")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="stock_holds")
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['order', 'product'], name='one_hold_per_order_product')]
+
+    def __str__(self):
+        return f"{self.quantity} x product {self.product_id} held for order {self.order_id}"
+
+
+class ProductRecommendation(models.Model):
+    """Top neighbours of a product, as ``[[product_id, score], ...]`` best first (store.cooccurrence)."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True,
+                                   related_name="recommendation")
+    neighbours = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Recommendations for {self.product_id}"
+
+
+class FacetBitmap(models.Model):
+    """
+    Products having one facet value (``category:3``, ``price:5-10``, ...), as a
+    little-endian bitmap indexed by product id (store.facets).
+    """
+    key = models.CharField(max_length=64, unique=True)
+    bits = models.BinaryField(default=b"")
+    # The latest one tells each process's in-memory index when to reload.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return self.key
+
+
+class CacheVersion(models.Model):
+    """
+    When a cached thing (``catalog:product:3``, ``catalog:version``, ...) last
+    changed, so processes that do not share a cache still see each other's
+    version bumps (store.catalog_cache).
+    """
+    key = models.CharField(max_length=100, unique=True)
+    version = models.FloatField(db_index=True)
+
+    def __str__(self):
+        return self.key
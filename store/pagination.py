@@ -0,0 +1,238 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are addressed by an opaque, signed cursor holding the sort key of the
+row at the page boundary, so fetching page 500 costs the same as page 1 and
+no COUNT(*) is needed to render a page. Totals are optional and cached.
+"""
+import hashlib
+import json
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from datetime import datetime
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+CURSOR_SALT = "store.pagination.cursor"
+COUNT_CACHE_SECONDS = 60
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts datetimes to milliseconds, which would move the
+    # boundary off the row it came from; keep them whole and tagged.
+    def default(self, o):
+        if isinstance(o, datetime):
+            return {"dt": o.isoformat()}
+        return super().default(o)
+
+
+def _decode_value(obj):
+    return datetime.fromisoformat(obj["dt"]) if obj.keys() == {"dt"} else obj
+
+
+class _CursorSerializer:
+    def dumps(self, obj):
+        return json.dumps(obj, cls=_CursorEncoder, separators=(",", ":")).encode("latin-1")
+
+    def loads(self, data):
+        return json.loads(data.decode("latin-1"), object_hook=_decode_value)
+
+
+def encode_cursor(values, direction, number):
+    return signing.dumps({"v": values, "d": direction, "n": number},
+                         salt=CURSOR_SALT, serializer=_CursorSerializer, compress=True)
+
+
+def decode_cursor(token):
+    """Return the cursor payload, or None for a missing or tampered token."""
+    if not token:
+        return None
+    try:
+        payload = signing.loads(token, salt=CURSOR_SALT, serializer=_CursorSerializer)
+    except (signing.BadSignature, ValueError):
+        return None
+    if not isinstance(payload, dict) or payload.get("d") not in ("next", "prev"):
+        return None
+    return payload
+
+
+class CursorPage(Sequence):
+    def __init__(self, object_list, paginator, number, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.number = number
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __repr__(self):
+        return f"<CursorPage {self.number}>"
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class CursorPaginator:
+    """
+    Paginate ``queryset`` by ``ordering``, which must end in a unique field
+    (normally ``pk``/``-pk``) so that every row has a distinct position.
+    """
+
+    def __init__(self, queryset, ordering=("pk",), per_page=10, count_timeout=COUNT_CACHE_SECONDS, count=None):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.count_timeout = count_timeout
+        if count is not None:
+            # Known from elsewhere (the facet index), so no COUNT query is needed.
+            self._count = count
+        self._fields = [(f.lstrip("-"), f.startswith("-")) for f in self.ordering]
+
+    def _boundary(self, obj):
+        return [getattr(obj, name) for name, _ in self._fields]
+
+    def _after(self, values, forward):
+        """Rows strictly after ``values`` in page order (or before, going back)."""
+        condition = Q()
+        for i, (name, desc) in enumerate(self._fields):
+            lookup = "lt" if desc == forward else "gt"
+            clause = Q(**{f"{name}__{lookup}": values[i]})
+            for j in range(i):
+                clause &= Q(**{self._fields[j][0]: values[j]})
+            condition |= clause
+        if len(self._fields) > 1:
+            # Repeat the first key as a plain range so the database can seek an index on it.
+            name, desc = self._fields[0]
+            condition &= Q(**{f"{name}__{'lte' if desc == forward else 'gte'}": values[0]})
+        return condition
+
+    def _window(self, values, forward):
+        qs = self.queryset
+        if values is not None:
+            qs = qs.filter(self._after(values, forward))
+        ordering = self.ordering if forward else [
+            f[1:] if f.startswith("-") else f"-{f}" for f in self.ordering
+        ]
+        return qs.order_by(*ordering)[:self.per_page + 1]
+
+    def _position(self, cursor):
+        payload = decode_cursor(cursor)
+        values = payload["v"] if payload and len(payload["v"]) == len(self._fields) else None
+        if values is None:
+            payload = None
+        forward = payload is None or payload["d"] == "next"
+        number = max(1, int(payload["n"])) if payload else 1
+        return values, forward, number
+
+    def get_page(self, cursor=None):
+        values, forward, number = self._position(cursor)
+        rows = list(self._window(values, forward))
+        if not rows and values is not None:
+            # The cursor points past the end (rows were deleted): start over.
+            return self.get_page(None)
+        return self._build(rows, values, forward, number)
+
+    async def aget_page(self, cursor=None):
+        """Async ``get_page``, fetching the rows with async iteration."""
+        values, forward, number = self._position(cursor)
+        rows = [row async for row in self._window(values, forward)]
+        if not rows and values is not None:
+            return await self.aget_page(None)
+        return self._build(rows, values, forward, number)
+
+    def _build(self, rows, values, forward, number):
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if forward:
+            has_next, has_previous = more, values is not None
+        else:
+            rows.reverse()
+            has_next, has_previous = True, more
+        return self._page(rows, number, has_next, has_previous)
+
+    def _page(self, rows, number, has_next, has_previous):
+        next_cursor = encode_cursor(self._boundary(rows[-1]), "next", number + 1) if has_next and rows else None
+        prev_cursor = encode_cursor(self._boundary(rows[0]), "prev", number - 1) if has_previous and rows else None
+        return CursorPage(rows, self, number, has_next, has_previous, next_cursor, prev_cursor)
+
+    _count = None
+
+    def _count_key(self):
+        return "cursor-count:" + hashlib.md5(str(self.queryset.query).encode()).hexdigest()
+
+    @property
+    def count(self):
+        """Total rows, cached for ``count_timeout`` seconds per distinct query."""
+        if self._count is None:
+            self._count = cache.get_or_set(self._count_key(), self.queryset.count, self.count_timeout)
+        return self._count
+
+    async def acount(self):
+        """Async ``count``; call it before rendering ``num_pages`` from an async view."""
+        if self._count is None:
+            key = self._count_key()
+            count = await cache.aget(key)
+            if count is None:
+                count = await self.queryset.acount()
+                await cache.aset(key, count, self.count_timeout)
+            self._count = count
+        return self._count
+
+    @property
+    def num_pages(self):
+        return max(1, -(-self.count // self.per_page))
+
+
+class RankedCursorPaginator(CursorPaginator):
+    """
+    Keyset pagination over an in-memory ranked list of ``(pk, score)``
+    pairs, ordered by score descending then pk, as returned by search.
+    """
+
+    def __init__(self, ranked, per_page=10):
+        self.ranked = list(ranked)
+        self.per_page = per_page
+        self._keys = [(-score, pk) for pk, score in self.ranked]
+
+    def _boundary(self, item):
+        pk, score = item
+        return [score, pk]
+
+    def get_page(self, cursor=None):
+        payload = decode_cursor(cursor)
+        if payload and len(payload["v"]) == 2:
+            score, pk = payload["v"]
+            key = (-score, pk)
+            number = max(1, int(payload["n"]))
+            if payload["d"] == "next":
+                start = bisect_right(self._keys, key)
+                end = start + self.per_page
+            else:
+                end = bisect_left(self._keys, key)
+                start = max(0, end - self.per_page)
+        else:
+            start, end, number = 0, self.per_page, 1
+        rows = self.ranked[start:end]
+        if not rows and start:
+            return self.get_page(None)
+        return self._page(rows, number, end < len(self.ranked), start > 0)
+
+    @property
+    def count(self):
+        return len(self.ranked)
@@ -0,0 +1,152 @@
+"""
+Stripe gateway.
+
+All Stripe API calls go through one lazily built ``StripeClient`` per
+process: persistent keep-alive HTTP sessions, explicit timeouts, automatic
+retries (Stripe's client adds idempotency keys) and an optional base URL so
+tests and benchmarks can point it at the local fake server. Each voucher
+maps to a single reusable Stripe coupon whose id is derived from the voucher,
+remembered on the Voucher row and in memory, so checkout makes one API
+call instead of two.
+"""
+import threading
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from vouchers.models import Voucher
+
+try:
+    import httpx
+except ImportError:  # async calls fall back to a worker thread
+    httpx = None
+
+_lock = threading.Lock()
+_client = None
+_coupons = {}
+
+
+def _build_client():
+    timeout = getattr(settings, "STRIPE_TIMEOUT", 10)
+    http_client = stripe.RequestsClient(
+        timeout=timeout,
+        async_fallback_client=stripe.HTTPXClient(timeout=timeout) if httpx else None,
+    )
+    base = getattr(settings, "STRIPE_API_BASE", "")
+    return stripe.StripeClient(
+        settings.STRIPE_SECRET_KEY,
+        http_client=http_client,
+        max_network_retries=getattr(settings, "STRIPE_MAX_NETWORK_RETRIES", 2),
+        base_addresses={"api": base} if base else None,
+    )
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def reset():
+    """Forget the client and coupon cache (after changing Stripe settings)."""
+    global _client
+    with _lock:
+        _client = None
+        _coupons.clear()
+
+
+def coupon_id_for(voucher):
+    return f"hf-voucher-{voucher.pk}-{int(voucher.discount)}"
+
+
+def coupon_for_voucher(voucher):
+    """Return the Stripe coupon id for ``voucher``, creating it on first use."""
+    coupon_id = coupon_id_for(voucher)
+    if _coupons.get(voucher.pk) == coupon_id:
+        return coupon_id
+    if voucher.stripe_coupon_id != coupon_id:
+        try:
+            get_client().v1.coupons.create(params={
+                "id": coupon_id,
+                "percent_off": int(voucher.discount),
+                "duration": "once",
+                "name": voucher.code,
+            })
+        except stripe.InvalidRequestError as exc:
+            # Another process created it first; the id is deterministic.
+            if exc.code != "resource_already_exists":
+                raise
+        Voucher.objects.filter(pk=voucher.pk).update(stripe_coupon_id=coupon_id)
+        voucher.stripe_coupon_id = coupon_id
+    _coupons[voucher.pk] = coupon_id
+    return coupon_id
+
+
+def checkout_session_params(order, lines, voucher, success_url, cancel_url, customer_email=None, expires_at=None):
+    params = {
+        "mode": "payment",
+        "payment_method_types": ["card"],
+        "line_items": [{
+            "price_data": {
+                "currency": "eur",
+                "product_data": {"name": item.product_name},
+                "unit_amount": int(item.unit_price * 100),
+            },
+            "quantity": item.quantity,
+        } for item in lines],
+        "success_url": success_url,
+        "cancel_url": cancel_url,
+        "metadata": {
+            "order_id": str(order.id),
+            "full_name": order.full_name,
+            "address1": order.address1,
+            "address2": order.address2,
+            "city": order.city,
+            "county": order.county,
+            "postcode": order.postcode,
+            "country": order.country,
+            "phone": order.phone,
+        },
+    }
+    if customer_email:
+        params["customer_email"] = customer_email
+    if expires_at is not None:
+        params["expires_at"] = int(expires_at.timestamp())
+    if voucher is not None:
+        params["discounts"] = [{"coupon": coupon_for_voucher(voucher)}]
+    return params
+
+
+def create_checkout_session(order, lines, voucher, success_url, cancel_url, customer_email=None, expires_at=None):
+    params = checkout_session_params(order, lines, voucher, success_url, cancel_url, customer_email, expires_at)
+    return get_client().v1.checkout.sessions.create(params=params)
+
+
+def expire_checkout_session(session_id):
+    """
+    Close an open Checkout Session so it can no longer be paid. Returns the
+    session's status afterwards: "expired", or "complete" if it was paid first.
+    """
+    client = get_client()
+    try:
+        return client.v1.checkout.sessions.expire(session_id).status
+    except stripe.InvalidRequestError:
+        # Only open sessions can be expired; this one was already paid or expired.
+        return client.v1.checkout.sessions.retrieve(session_id).status
+
+
+async def acreate_checkout_session(order, lines, voucher, success_url, cancel_url, customer_email=None,
+                                   expires_at=None):
+    """Async variant for ASGI views; uses httpx when it is installed."""
+    if voucher is not None and _coupons.get(voucher.pk) != coupon_id_for(voucher):
+        await sync_to_async(coupon_for_voucher)(voucher)
+    params = await sync_to_async(checkout_session_params)(
+        order, lines, voucher, success_url, cancel_url, customer_email, expires_at,
+    )
+    if httpx is None:
+        return await sync_to_async(get_client().v1.checkout.sessions.create, thread_sensitive=False)(params=params)
+    return await get_client().v1.checkout.sessions.create_async(params=params)
@@ -0,0 +1,101 @@
+"""
+Denormalized review aggregates on Product.
+
+Each review change is applied to its product as a single UPDATE built from
+F() expressions, so concurrent reviews never lose counts and product pages
+can show and sort by rating without aggregating the Review table.
+"""
+import math
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+
+from . import catalog_cache, facets
+from .models import Product, Review
+
+STARS = range(1, 6)
+FIELDS = ['rating_count', 'rating_sum', 'rating_avg'] + [f'rating_{s}' for s in STARS]
+
+
+def apply_review_change(product_id, old_rating=None, new_rating=None):
+    """Move one review from ``old_rating`` to ``new_rating`` (None = absent)."""
+    if old_rating == new_rating:
+        return
+    count_delta = (new_rating is not None) - (old_rating is not None)
+    sum_delta = (new_rating or 0) - (old_rating or 0)
+    count = F('rating_count') + count_delta
+    total = F('rating_sum') + sum_delta
+    updates = {
+        'rating_count': count,
+        'rating_sum': total,
+        # SET expressions see the pre-update row, so recompute from the deltas.
+        'rating_avg': Case(
+            When(rating_count__gt=-count_delta, then=Cast(total, FloatField()) / Cast(count, FloatField())),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ),
+    }
+    if old_rating is not None:
+        updates[f'rating_{old_rating}'] = F(f'rating_{old_rating}') - 1
+    if new_rating is not None:
+        updates[f'rating_{new_rating}'] = F(f'rating_{new_rating}') + 1
+    Product.objects.filter(pk=product_id).update(**updates)
+
+
+def aggregate_for(product_ids):
+    """Expected aggregate values for ``product_ids``, from one GROUP BY over Review."""
+    rows = (Review.objects.filter(product_id__in=product_ids)
+            .values('product_id')
+            .annotate(count=Count('id'), total=Sum('rating'),
+                      **{f's{star}': Count('id', filter=Q(rating=star)) for star in STARS}))
+    by_product = {row['product_id']: row for row in rows}
+    result = {}
+    for pk in product_ids:
+        row = by_product.get(pk, {})
+        count, total = row.get('count', 0), row.get('total') or 0
+        values = {'rating_count': count, 'rating_sum': total, 'rating_avg': total / count if count else 0.0}
+        values.update({f'rating_{s}': row.get(f's{s}', 0) for s in STARS})
+        result[pk] = values
+    return result
+
+
+def recompute(product_id):
+    """Rebuild one product's aggregates when the previous rating is unknown."""
+    Product.objects.filter(pk=product_id).update(**aggregate_for([product_id])[product_id])
+
+
+def _is_stale(product, expected):
+    return any(
+        not math.isclose(getattr(product, k), v) if k == 'rating_avg' else getattr(product, k) != v
+        for k, v in expected.items()
+    )
+
+
+def reconcile(batch_size=1000):
+    """
+    Recompute every product's aggregates in batches and fix any drift.
+    Returns ``(checked, fixed)``.
+    """
+    checked = fixed = 0
+    last_pk = 0
+    while True:
+        products = list(Product.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', *FIELDS)[:batch_size])
+        if not products:
+            break
+        last_pk = products[-1].pk
+        expected = aggregate_for([p.pk for p in products])
+        stale = []
+        for p in products:
+            if _is_stale(p, expected[p.pk]):
+                for k, v in expected[p.pk].items():
+                    setattr(p, k, v)
+                stale.append(p)
+        with transaction.atomic():
+            Product.objects.bulk_update(stale, FIELDS)
+        if stale:
+            catalog_cache.bump_products([p.pk for p in stale])
+            facets.update([p.pk for p in stale])
+        checked += len(products)
+        fixed += len(stale)
+    return checked, fixed
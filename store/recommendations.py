@@ -0,0 +1,68 @@
+"""
+"Customers also bought" lookups for product pages, read from the
+neighbours store.cooccurrence builds. Neighbour ids are cached per
+recommendations build, so a page view costs one cache hit and one
+primary-key query.
+"""
+from django.core.cache import cache
+
+from . import catalog_cache
+from .models import Product, ProductRecommendation
+
+LIMIT = 4
+TIMEOUT = 3600
+
+
+def _key(pk):
+    return f"recommendations:{catalog_cache.recommendations_version():.6f}:{pk}"
+
+
+def _ids(row):
+    return [pk for pk, _ in row[0]] if row else []
+
+
+def cached_neighbour_ids(pk):
+    """Neighbour ids if a page view has already cached them, else []."""
+    return cache.get(_key(pk)) or []
+
+
+def neighbour_ids(pk):
+    """Ids of ``pk``'s neighbours, best first."""
+    key = _key(pk)
+    ids = cache.get(key)
+    if ids is None:
+        ids = _ids(ProductRecommendation.objects.filter(product_id=pk).values_list("neighbours").first())
+        cache.set(key, ids, TIMEOUT)
+    return ids
+
+
+async def aneighbour_ids(pk):
+    key = _key(pk)
+    ids = await cache.aget(key)
+    if ids is None:
+        ids = _ids(await ProductRecommendation.objects.filter(product_id=pk).values_list("neighbours").afirst())
+        await cache.aset(key, ids, TIMEOUT)
+    return ids
+
+
+def _in_stock(ids):
+    return Product.objects.filter(pk__in=ids, stock__gt=0)
+
+
+def _best(ids, found, limit):
+    return [found[pk] for pk in ids if pk in found][:limit]
+
+
+def similar_products(pk, limit=LIMIT):
+    """Up to ``limit`` in-stock neighbours of ``pk``, best first."""
+    ids = neighbour_ids(pk)
+    if not ids:
+        return []
+    return _best(ids, _in_stock(ids).in_bulk(), limit)
+
+
+async def asimilar_products(pk, limit=LIMIT):
+    ids = await aneighbour_ids(pk)
+    if not ids:
+        return []
+    return _best(ids, {p.pk: p async for p in _in_stock(ids)}, limit)
@@ -0,0 +1,212 @@
+"""
+Product search index.
+
+Products are indexed on name, description and category name. On SQLite
+builds with FTS5 the index is a virtual table ranked with bm25; everywhere
+else it falls back to an inverted token table (SearchToken) that is ranked
+in Python. Both backends treat the last query term as a prefix so results
+update while the user is still typing.
+"""
+import math
+import re
+import unicodedata
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import Product, SearchToken
+
+FTS_TABLE = "store_product_fts"
+
+# Relative weight of each indexed field (name, description, category).
+FIELD_WEIGHTS = {"name": 10, "description": 1, "category": 4}
+
+RESULT_LIMIT = getattr(settings, "STORE_SEARCH_RESULT_LIMIT", 1000)
+BATCH_SIZE = 1000
+MAX_TOKEN_LENGTH = 64
+# Number of products, for IDF. Kept in step by product creates and deletes,
+# and recounted at most every DOCUMENTS_TIMEOUT seconds.
+DOCUMENTS_KEY = "search:documents"
+DOCUMENTS_TIMEOUT = 3600
+
+_word_re = re.compile(r"\w+", re.UNICODE)
+_fts5_tables = {}
+
+
+def tokenize(text):
+    """Lowercase, strip accents and split text into word tokens."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return [t[:MAX_TOKEN_LENGTH] for t in _word_re.findall(text)]
+
+
+def _document(product):
+    return {
+        "name": product.name,
+        "description": product.description,
+        "category": product.category.name if product.category_id else "",
+    }
+
+
+def fts5_available(using=connection):
+    """True when the FTS5 table was created by the migration on this database."""
+    if using.vendor != "sqlite":
+        return False
+    key = str(using.settings_dict["NAME"])
+    if key not in _fts5_tables:
+        with using.cursor() as cursor:
+            _fts5_tables[key] = FTS_TABLE in using.introspection.table_names(cursor)
+    return _fts5_tables[key]
+
+
+class Fts5Backend:
+    name = "fts5"
+
+    def index(self, products):
+        rows = []
+        for p in products:
+            doc = _document(p)
+            rows.append((p.pk, doc["name"], doc["description"], doc["category"]))
+        if not rows:
+            return
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(r[0],) for r in rows])
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, description, category) VALUES (%s, %s, %s, %s)",
+                rows,
+            )
+
+    def remove(self, pks):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk in pks])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+    def search(self, tokens, limit):
+        terms = ['"%s"' % t for t in tokens[:-1]] + ['"%s"*' % tokens[-1]]
+        weights = ", ".join(str(float(w)) for w in FIELD_WEIGHTS.values())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, bm25({FTS_TABLE}, {weights}) AS score FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s ORDER BY score, rowid LIMIT %s",
+                [" ".join(terms), limit],
+            )
+            return [(pk, -score) for pk, score in cursor.fetchall()]
+
+
+class TokenIndexBackend:
+    name = "tokens"
+
+    def index(self, products):
+        products = list(products)
+        rows = []
+        for p in products:
+            weights = defaultdict(int)
+            for field, text in _document(p).items():
+                for token in tokenize(text):
+                    weights[token] += FIELD_WEIGHTS[field]
+            rows.extend(SearchToken(token=t, product_id=p.pk, weight=w) for t, w in weights.items())
+        with transaction.atomic():
+            SearchToken.objects.filter(product_id__in=[p.pk for p in products]).delete()
+            SearchToken.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+    def remove(self, pks):
+        SearchToken.objects.filter(product_id__in=list(pks)).delete()
+
+    def clear(self):
+        SearchToken.objects.all().delete()
+
+    def _postings(self, token, prefix):
+        qs = SearchToken.objects.all()
+        if prefix:
+            # A range scan keeps the (token, product) index usable for prefixes.
+            qs = qs.filter(token__gte=token, token__lt=token + "\uffff")
+        else:
+            qs = qs.filter(token=token)
+        postings = defaultdict(int)
+        for product_id, weight in qs.values_list("product_id", "weight"):
+            postings[product_id] += weight
+        return postings
+
+    def search(self, tokens, limit):
+        total = document_count() or 1
+        scores = None
+        last = len(tokens) - 1
+        # Rarest terms first, so the candidate set shrinks as fast as possible.
+        for postings in sorted((self._postings(t, i == last) for i, t in enumerate(tokens)), key=len):
+            if not postings:
+                return []
+            idf = math.log(1 + total / len(postings))
+            if scores is None:
+                scores = {pk: idf * w / (w + 1) for pk, w in postings.items()}
+            else:
+                scores = {pk: s + idf * postings[pk] / (postings[pk] + 1)
+                          for pk, s in scores.items() if pk in postings}
+            if not scores:
+                return []
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
+        return ranked[:limit]
+
+
+def document_count():
+    return cache.get_or_set(DOCUMENTS_KEY, Product.objects.count, DOCUMENTS_TIMEOUT)
+
+
+def add_documents(n):
+    """Adjust the cached product count by ``n`` (negative for deletes)."""
+    if n:
+        try:
+            cache.incr(DOCUMENTS_KEY, n)
+        except ValueError:
+            pass  # not cached: the next search counts
+
+
+def get_backend(name=None):
+    name = name or getattr(settings, "STORE_SEARCH_BACKEND", "auto")
+    if name == "auto":
+        name = "fts5" if fts5_available() else "tokens"
+    if name == "fts5":
+        return Fts5Backend()
+    if name == "tokens":
+        return TokenIndexBackend()
+    raise ValueError(f"Unknown search backend: {name!r}")
+
+
+def search(q, limit=RESULT_LIMIT, backend=None):
+    """Return ``[(product_pk, score), ...]`` for ``q``, best match first."""
+    tokens = tokenize(q)
+    if not tokens:
+        return []
+    return get_backend(backend).search(tokens, limit)
+
+
+def index_products(products, backend=None):
+    get_backend(backend).index(products)
+
+
+def remove_products(pks, backend=None):
+    get_backend(backend).remove(pks)
+
+
+def rebuild(backend=None, batch_size=BATCH_SIZE):
+    """Drop and re-index every product; returns the number indexed."""
+    backend = get_backend(backend)
+    backend.clear()
+    count = 0
+    qs = Product.objects.select_related("category").order_by("pk")
+    batch = []
+    for product in qs.iterator(chunk_size=batch_size):
+        batch.append(product)
+        if len(batch) >= batch_size:
+            backend.index(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        backend.index(batch)
+        count += len(batch)
+    cache.set(DOCUMENTS_KEY, count, DOCUMENTS_TIMEOUT)
+    return count
@@ -0,0 +1,152 @@
+"""
+Cache-first sessions (SESSION_ENGINE = "store.sessions").
+
+Sessions are read from the cache and only fall back to django_session on a
+miss. Saving a session whose data has not changed does nothing. Changed
+data goes to the cache at once but to the database at most once per
+SESSION_DB_WRITE_INTERVAL seconds; new sessions and login/logout changes
+are written through immediately, so losing the cache never logs anyone
+out. SessionMiddleware slides the expiry forward at most once per
+SESSION_REFRESH_INTERVAL instead of on every hit, and ``purge_sessions``
+deletes expired rows in batches.
+
+The cache must be shared by every process serving requests (file or
+redis); a system check refuses the per-process locmem and dummy caches.
+"""
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.contrib.sessions.middleware import SessionMiddleware as DjangoSessionMiddleware
+
+WRITE_INTERVAL = getattr(settings, "SESSION_DB_WRITE_INTERVAL", 60)
+REFRESH_INTERVAL = getattr(settings, "SESSION_REFRESH_INTERVAL", 3600)
+AUTH_KEYS = (SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY)
+
+logger = logging.getLogger(__name__)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    # Session changes reach the database late, so a cache other processes cannot see loses them.
+    if settings.SESSION_ENGINE != __name__:
+        return []
+    backend = caches[settings.SESSION_CACHE_ALIAS]
+    if not isinstance(backend, (LocMemCache, DummyCache)):
+        return []
+    return [checks.Error(
+        f"{__name__} needs a cache shared by every process, not {type(backend).__name__}.",
+        hint="Set CACHE_BACKEND=file or redis, or SESSION_ENGINE=django.contrib.sessions.backends.db.",
+        id="store.E001",
+    )]
+
+
+class SessionStore(CachedDBStore):
+    # Cache entries are {"data", "expires", "written", "dirty"}, not cached_db's bare dicts.
+    cache_key_prefix = "store.sessions"
+
+    _entry = None
+
+    def _remember(self, entry):
+        self._entry = entry
+        self._loaded = self._snapshot(entry["data"])
+        self._loaded_auth = self._auth(entry["data"])
+
+    def _snapshot(self, data):
+        return self.serializer().dumps(data)
+
+    def _auth(self, data):
+        return [data.get(key) for key in AUTH_KEYS]
+
+    def _from_db(self, row):
+        if not row:
+            return None
+        return {"data": self.decode(row.session_data), "expires": row.expire_date.timestamp(),
+                "written": time.time(), "dirty": False}
+
+    def _cache_entry(self, entry):
+        timeout = max(1, int(entry["expires"] - time.time()))
+        try:
+            self._cache.set(self.cache_key, entry, timeout)
+        except Exception:
+            logger.exception("Error saving session to cache (%s)", self._cache)
+
+    def load(self):
+        try:
+            entry = self._cache.get(self.cache_key)
+        except Exception:
+            entry = None
+        if entry is None:
+            entry = self._from_db(self._get_session_from_db())
+            if entry is None:
+                return {}
+            self._cache_entry(entry)
+        self._remember(entry)
+        return entry["data"]
+
+    async def aload(self):
+        try:
+            entry = await self._cache.aget(await self.acache_key())
+        except Exception:
+            entry = None
+        if entry is None:
+            entry = self._from_db(await self._aget_session_from_db())
+            if entry is None:
+                return {}
+            await sync_to_async(self._cache_entry)(entry)
+        self._remember(entry)
+        return entry["data"]
+
+    def needs_save(self):
+        """True when an unmodified session is still due a write: its expiry or a deferred change."""
+        if self._entry is None:
+            return False
+        now = time.time()
+        if now + self.get_expiry_age() - self._entry["expires"] >= REFRESH_INTERVAL:
+            return True
+        return self._entry["dirty"] and now - self._entry["written"] >= WRITE_INTERVAL
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        now = time.time()
+        if must_create or self._entry is None:
+            write = True
+        else:
+            changed = self._snapshot(data) != self._loaded
+            if not changed and not self.needs_save():
+                return
+            write = (
+                self.needs_save()
+                or self._auth(data) != self._loaded_auth
+                or now - self._entry["written"] >= WRITE_INTERVAL
+            )
+        if write:
+            super(CachedDBStore, self).save(must_create)
+            entry = {"data": data, "expires": now + self.get_expiry_age(), "written": now, "dirty": False}
+        else:
+            entry = {**self._entry, "data": data, "dirty": True}
+        self._cache_entry(entry)
+        self._remember(entry)
+
+    async def asave(self, must_create=False):
+        return await sync_to_async(self.save)(must_create)
+
+
+class SessionMiddleware(DjangoSessionMiddleware):
+    """Also saves sessions whose expiry or deferred database write has come due."""
+
+    def process_response(self, request, response):
+        session = getattr(request, "session", None)
+        needs_save = getattr(session, "needs_save", None)
+        if needs_save and session.accessed and not session.modified and needs_save():
+            session.modified = True
+        return super().process_response(request, response)
@@ -0,0 +1,116 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import cart, catalog_cache, facets, images, ratings, search
+from .models import Category, Product, Review
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, created=False, **kwargs):
+    search.index_products([instance])
+    if created:
+        search.add_documents(1)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+    search.add_documents(-1)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def refile_product_facets(sender, instance, raw=False, **kwargs):
+    if not raw:
+        facets.update([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def expire_cart_summaries(sender, instance, **kwargs):
+    cart.bump_prices_version()
+
+
+@receiver(post_save, sender=Product)
+def render_product_image(sender, instance, raw=False, **kwargs):
+    if raw or not images.needs_renditions(instance):
+        return
+    source = instance.image.name if instance.image else None
+    transaction.on_commit(lambda: images.refresh(instance.pk, source))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def expire_product_pages(sender, instance, **kwargs):
+    catalog_cache.bump_products([instance.pk])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def expire_reviewed_product(sender, instance, **kwargs):
+    catalog_cache.bump_products([instance.product_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def expire_category_pages(sender, instance, **kwargs):
+    catalog_cache.bump_categories()
+    # Facet labels show category names.
+    catalog_cache.bump_facets()
+
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    products = instance.products.select_related('category').order_by('pk')
+    batch = []
+    for product in products.iterator(chunk_size=search.BATCH_SIZE):
+        batch.append(product)
+        if len(batch) >= search.BATCH_SIZE:
+            search.index_products(batch)
+            batch = []
+    if batch:
+        search.index_products(batch)
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_save(sender, instance, created, raw=False, **kwargs):
+    saved = getattr(instance, '_saved', None)
+    if raw or (not created and saved is None):
+        # Fixture loads and hand-built instances: the old rating is unknown.
+        ratings.recompute(instance.product_id)
+    elif created:
+        ratings.apply_review_change(instance.product_id, None, instance.rating)
+    elif saved[0] != instance.product_id:
+        ratings.apply_review_change(saved[0], saved[1], None)
+        ratings.apply_review_change(instance.product_id, None, instance.rating)
+    else:
+        ratings.apply_review_change(instance.product_id, saved[1], instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_delete(sender, instance, **kwargs):
+    product_id, rating = getattr(instance, '_saved', (instance.product_id, instance.rating))
+    ratings.apply_review_change(product_id, rating, None)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def refile_reviewed_product_facets(sender, instance, **kwargs):
+    # Connected after the rating receivers above, so it sees the new average.
+    saved = getattr(instance, '_saved', None)
+    facets.update({instance.product_id, saved[0] if saved else instance.product_id})
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', None)
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
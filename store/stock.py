@@ -0,0 +1,151 @@
+"""
+Stock reservations at checkout.
+
+Product.stock is the quantity available to sell, so listings and the
+in-stock facet read it directly. Starting a Stripe checkout takes the
+order's quantities off it in one conditional UPDATE that only applies if
+every line is still in stock, so two customers can never both be sold the
+last unit. The units are recorded as StockHold rows that expire after
+STOCK_HOLD_SECONDS. Fulfilment turns an order's holds into the sale,
+cancelling a checkout gives them back at once, and ``release_expired`` (the
+release_stock_holds command) returns abandoned ones in batches.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, When
+from django.utils import timezone
+
+from . import catalog_cache, facets
+from .models import OrderItem, Product, StockHold
+
+HOLD_SECONDS = getattr(settings, "STOCK_HOLD_SECONDS", 35 * 60)
+# Expired holds are kept this much longer, for webhooks of payments made just before expiry.
+GRACE_SECONDS = getattr(settings, "STOCK_HOLD_GRACE_SECONDS", 5 * 60)
+
+
+class OutOfStock(Exception):
+    def __init__(self, short):
+        # {product_id: (name, available)}
+        self.short = short
+        super().__init__("Not enough stock: " + "; ".join(
+            f"only {available} left of {name}" for name, available in short.values()
+        ))
+
+
+def _by_product(rows):
+    quantities = {}
+    for product_id, quantity in rows:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def _change(quantities):
+    return Case(
+        *[When(pk=pk, then=n) for pk, n in quantities.items()],
+        default=0,
+        output_field=IntegerField(),
+    )
+
+
+def stock_changed(pks, crossed_zero):
+    """
+    Expire the cached pages of the products ``pks`` whose stock changed, and
+    refile under the in-stock facet those of them that sold out or came back.
+    """
+    pks = list(pks)
+    if pks:
+        facets.update(crossed_zero)
+        transaction.on_commit(lambda: catalog_cache.bump_products(pks))
+
+
+def restock(quantities):
+    """Add ``{product_id: quantity}`` back to stock in one UPDATE. Must run inside a transaction."""
+    quantities = {pk: n for pk, n in quantities.items() if n > 0}
+    if not quantities:
+        return
+    sold_out = list(Product.objects.filter(pk__in=quantities, stock=0).values_list('pk', flat=True))
+    Product.objects.filter(pk__in=quantities).update(stock=F('stock') + _change(quantities))
+    stock_changed(quantities, sold_out)
+
+
+def _take_holds(holds):
+    """Lock and delete ``holds``, returning their ``{product_id: quantity}``."""
+    rows = list(holds.select_for_update().values_list('pk', 'product_id', 'quantity'))
+    StockHold.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+    return _by_product((product_id, quantity) for _, product_id, quantity in rows)
+
+
+def reserve(order, now=None):
+    """
+    Hold stock for every line of ``order`` until the returned expiry time,
+    replacing any holds from an earlier checkout of the same order. Raises
+    OutOfStock, holding nothing new, if any line asks for more than is left.
+    """
+    now = now or timezone.now()
+    expires_at = now + timedelta(seconds=HOLD_SECONDS)
+    with transaction.atomic():
+        restock(_take_holds(StockHold.objects.filter(order=order)))
+        quantities = _by_product(OrderItem.objects.filter(order=order).values_list('product_id', 'quantity'))
+        if not quantities:
+            return expires_at
+        enough = Q()
+        for pk, n in quantities.items():
+            enough |= Q(pk=pk, stock__gte=n)
+        savepoint = transaction.savepoint()
+        taken = Product.objects.filter(enough).update(stock=F('stock') - _change(quantities))
+        if taken < len(quantities):
+            # Undo the partial take before reading, so only the short lines are reported.
+            transaction.savepoint_rollback(savepoint)
+            raise OutOfStock({
+                pk: (name, stock) for pk, name, stock in
+                Product.objects.filter(pk__in=quantities).values_list('pk', 'name', 'stock')
+                if stock < quantities[pk]
+            })
+        transaction.savepoint_commit(savepoint)
+        StockHold.objects.bulk_create([
+            StockHold(order=order, product_id=pk, quantity=n, expires_at=expires_at)
+            for pk, n in quantities.items()
+        ])
+        stock_changed(quantities, Product.objects.filter(pk__in=quantities, stock=0).values_list('pk', flat=True))
+    return expires_at
+
+
+def checkout_expires_at(expires_at):
+    """
+    ``expires_at`` for the Stripe Checkout Session, so payment closes with the
+    hold; None (Stripe's default) if the hold is outside the 30 minutes to
+    24 hours Stripe accepts.
+    """
+    return expires_at if 31 * 60 <= HOLD_SECONDS <= 24 * 3600 else None
+
+
+def convert(order, quantities):
+    """
+    Settle ``order``'s holds against the ``{product_id: quantity}`` it is
+    being paid for: the holds are deleted, units held beyond ``quantities``
+    go back to stock, and what the holds did not cover is returned for the
+    caller to take from stock. Must run inside a transaction.
+    """
+    held = _take_holds(StockHold.objects.filter(order=order))
+    restock({pk: n - quantities.get(pk, 0) for pk, n in held.items()})
+    return {pk: n - held.get(pk, 0) for pk, n in quantities.items() if n > held.get(pk, 0)}
+
+
+def release_orders(order_ids):
+    """Give back the stock held for ``order_ids`` (cancelled checkouts, purged carts)."""
+    with transaction.atomic():
+        restock(_take_holds(StockHold.objects.filter(order_id__in=list(order_ids))))
+
+
+def release_expired(batch_size=1000, now=None):
+    """Release one batch of expired holds. Returns how many were released."""
+    cutoff = (now or timezone.now()) - timedelta(seconds=GRACE_SECONDS)
+    expired = StockHold.objects.filter(expires_at__lt=cutoff)
+    with transaction.atomic():
+        pks = list(expired.order_by('expires_at').values_list('pk', flat=True)[:batch_size])
+        # Re-checked under the lock: fulfilment may have taken some of them meanwhile.
+        quantities = _take_holds(expired.filter(pk__in=pks))
+        restock(quantities)
+    return len(pks)
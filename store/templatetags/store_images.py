@@ -0,0 +1,29 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from store import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_image(product, sizes="100vw", css_class="", alt=None, style="", loading="lazy"):
+    """
+    ``<picture>`` for a product with WebP and JPEG ``srcset`` candidates, so the
+    browser downloads the smallest rendition that fills ``sizes``. Falls back
+    to the original image until renditions exist, or to the placeholder.
+    """
+    alt = product.name if alt is None else alt
+    if not product.image:
+        return format_html('<img src="{}" class="{}" style="{}" alt="No image">',
+                           static("store/placeholder.jpg"), css_class, style)
+    if not product.image_renditions.get("renditions"):
+        return format_html('<img src="{}" class="{}" style="{}" alt="{}" loading="{}">',
+                           product.image.url, css_class, style, alt, loading)
+    return format_html(
+        '<picture><source type="{}" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" class="{}" style="{}" alt="{}" loading="{}" decoding="async"></picture>',
+        images.FORMATS["webp"][2], images.srcset(product, "webp"), sizes,
+        images.fallback_url(product), images.srcset(product, "jpeg"), sizes, css_class, style, alt, loading,
+    )
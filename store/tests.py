@@ -0,0 +1,1126 @@
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from functools import partial
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+import stripe
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, connection, transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+from PIL import Image
+
+from healthfoods.urls import urlpatterns as site_urlpatterns
+
+from . import (async_views, cart, catalog_cache, catalog_io, cooccurrence, event_queue, facets, fulfilment,
+               instrumentation, ratings, search, sessions, signals, stock)
+from .benchmarks import fake_stripe
+from .management.commands import explain_hot_paths
+from .models import (Category, FacetBitmap, Order, Oversell, Product, ProductRecommendation, Review, StockHold,
+                     StripeEvent, Wishlist)
+from .pagination import CursorPaginator, decode_cursor, encode_cursor
+
+# The site as healthfoods/asgi.py serves it, with the async cart and checkout views.
+urlpatterns = [
+    path('cart/', async_views.cart_view, name='cart'),
+    path('create-checkout-session/', async_views.create_checkout_session, name='create_checkout_session'),
+    path('stripe/webhook/', async_views.stripe_webhook, name='stripe_webhook'),
+    *site_urlpatterns,
+]
+
+
+def make_product(name="Oats", price="2.50", stock=10, category=None):
+    category = category or Category.objects.get_or_create(name="Grains")[0]
+    return Product.objects.create(name=name, description="", price=price, stock=stock, category=category)
+
+
+# Sessions from the cache and no catalogue version poll, so only the page's own queries are counted.
+@override_settings(SESSION_ENGINE="store.sessions")
+@mock.patch.object(catalog_cache, "CHECK_SECONDS", float("inf"))
+class CartQueryCountTests(TestCase):
+    """The cart and checkout pages run the same queries whatever the number of lines."""
+
+    def assert_queries(self, lines):
+        cache.clear()
+        user = User.objects.create_user(f"shopper-{lines}")
+        order = Order.objects.create(user=user)
+        for n in range(lines):
+            order.items.create(product=make_product(f"Product {n}"), quantity=2)
+        self.client.force_login(user)
+        # User, order, lines and the summary aggregate; the cached summary saves one on later loads.
+        with self.assertNumQueries(4):
+            self.client.get("/cart/")
+        with self.assertNumQueries(3):
+            self.client.get("/cart/")
+        with self.assertNumQueries(3):
+            self.client.get("/checkout/")
+
+    def test_one_line(self):
+        self.assert_queries(1)
+
+    def test_fifty_lines(self):
+        self.assert_queries(50)
+
+
+class CartMutationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("shopper")
+        self.order = Order.objects.create(user=self.user)
+        self.products = [make_product(f"Product {n}") for n in range(20)]
+
+    def lines(self):
+        return dict(self.order.items.values_list("product_id", "quantity"))
+
+    def test_add_items_merges_and_removes(self):
+        first, second, third = (p.pk for p in self.products[:3])
+        cart.add_items(self.order, {first: 2, second: 1})
+        cart.add_items(self.order, {first: 3, third: 1, second: -1})
+        self.assertEqual(self.lines(), {first: 5, third: 1})
+        cart.add_items(self.order, {first: -9})
+        self.assertEqual(self.lines(), {third: 1})
+        cart.remove_items(self.order, [third])
+        self.assertEqual(self.lines(), {})
+
+    def test_queries_do_not_grow_with_the_lines(self):
+        with CaptureQueriesContext(connection) as one:
+            cart.add_items(self.order, {self.products[0].pk: 1})
+        with CaptureQueriesContext(connection) as many:
+            cart.add_items(self.order, {p.pk: 1 for p in self.products})
+        self.assertEqual(len(many), len(one))
+
+    def test_move_wishlist_to_cart(self):
+        wishlist = Wishlist.objects.create(user=self.user)
+        wishlist.products.add(*self.products[:3])
+        cart.add_items(self.order, {self.products[0].pk: 2})
+        self.client.force_login(self.user)
+        self.client.post("/wishlist/move-to-cart/")
+        self.assertEqual(self.lines(), {self.products[0].pk: 3, self.products[1].pk: 1, self.products[2].pk: 1})
+        self.assertFalse(wishlist.products.exists())
+
+    def test_reorder(self):
+        paid = Order.objects.create(user=self.user, is_paid=True)
+        paid.items.create(product=self.products[0], quantity=2)
+        paid.items.create(product=self.products[1], quantity=1)
+        self.client.force_login(self.user)
+        self.assertRedirects(self.client.post(f"/orders/reorder/{paid.pk}/"), "/cart/", fetch_redirect_response=False)
+        self.client.post(f"/orders/reorder/{paid.pk}/")
+        self.assertEqual(self.lines(), {self.products[0].pk: 4, self.products[1].pk: 2})
+        other = Order.objects.create(user=User.objects.create_user("someone-else"), is_paid=True)
+        self.assertEqual(self.client.post(f"/orders/reorder/{other.pk}/").status_code, 404)
+
+
+class OpenCartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("shopper")
+        self.request = SimpleNamespace(user=self.user, session={})
+
+    def test_one_open_order_per_user(self):
+        Order.objects.create(user=self.user)
+        Order.objects.create(user=self.user, is_paid=True)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=self.user)
+
+    def test_viewing_the_cart_creates_nothing(self):
+        self.client.force_login(self.user)
+        self.client.get("/cart/")
+        self.assertIsNone(cart.get_open_order(self.request))
+        self.assertFalse(Order.objects.exists())
+
+    def test_first_add_creates_the_cart(self):
+        product = make_product()
+        self.client.force_login(self.user)
+        self.client.get(f"/add-to-cart/{product.pk}/")
+        self.client.get(f"/add-to-cart/{product.pk}/")
+        order = Order.objects.get()
+        self.assertEqual(list(order.items.values_list("product_id", "quantity")), [(product.pk, 2)])
+        self.assertEqual(self.client.session[cart.SESSION_KEY], order.pk)
+
+    def test_paid_order_in_the_session_is_not_the_cart(self):
+        order = cart.get_open_order(self.request, create=True)
+        self.assertEqual(self.request.session[cart.SESSION_KEY], order.pk)
+        Order.objects.filter(pk=order.pk).update(is_paid=True)
+        self.assertIsNone(cart.get_open_order(self.request))
+        self.assertNotIn(cart.SESSION_KEY, self.request.session)
+        self.assertNotEqual(cart.get_open_order(self.request, create=True).pk, order.pk)
+
+    def test_create_returns_the_cart_a_concurrent_request_made(self):
+        first = Order.objects.create(user=self.user)
+        self.assertEqual(cart._create(self.user), first)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncCartViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("shopper", email="shopper@example.com", password="x")
+        self.product = make_product()
+
+    async def test_cart_without_an_order(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get("/cart/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context["order"])
+
+    async def test_cart_with_lines(self):
+        order = await Order.objects.acreate(user=self.user)
+        await order.items.acreate(product=self.product, quantity=2)
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get("/cart/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["order"], order)
+        self.assertEqual(response.context["summary"]["item_count"], 2)
+
+    async def test_create_checkout_session(self):
+        order = await Order.objects.acreate(user=self.user)
+        await order.items.acreate(product=self.product, quantity=3)
+        await self.async_client.aforce_login(self.user)
+        session = SimpleNamespace(id="cs_test_1", url="https://checkout.stripe.test/cs_test_1")
+        with mock.patch("store.payments.acreate_checkout_session", return_value=session) as create:
+            response = await self.async_client.post("/create-checkout-session/", {"full_name": "A Shopper"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], session.url)
+        self.assertEqual(create.call_args.kwargs["customer_email"], "shopper@example.com")
+        await order.arefresh_from_db()
+        self.assertEqual(order.stripe_checkout_session_id, "cs_test_1")
+        await self.product.arefresh_from_db()
+        self.assertEqual(self.product.stock, 7)
+
+    async def test_create_checkout_session_without_a_cart(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post("/create-checkout-session/", {"full_name": "A Shopper"})
+        self.assertEqual(response.status_code, 404)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("shopper")
+        self.orders = Order.objects.bulk_create(Order(user=self.user, is_paid=True) for _ in range(25))
+
+    def paginator(self):
+        # As order_history pages them.
+        return CursorPaginator(Order.objects.filter(user=self.user, is_paid=True), ("-created_at", "-pk"), per_page=10)
+
+    def set_created_at(self, step):
+        start = timezone.now().replace(microsecond=123456)
+        for n, order in enumerate(self.orders):
+            Order.objects.filter(pk=order.pk).update(created_at=start + n * step)
+
+    def assert_round_trip(self):
+        expected = list(self.paginator().queryset.order_by("-created_at", "-pk").values_list("pk", flat=True))
+        pages = [self.paginator().get_page()]
+        while pages[-1].has_next() and len(pages) < 5:
+            pages.append(self.paginator().get_page(pages[-1].next_cursor))
+        self.assertEqual([o.pk for p in pages for o in p], expected)
+        self.assertEqual([p.number for p in pages], [1, 2, 3])
+        for newer, older in zip(pages, pages[1:]):
+            back = self.paginator().get_page(older.previous_cursor)
+            self.assertEqual([o.pk for o in back], [o.pk for o in newer])
+            self.assertEqual(back.number, newer.number)
+            self.assertEqual(back.has_previous(), newer.has_previous())
+
+    def test_orders_a_second_apart(self):
+        self.set_created_at(timedelta(seconds=1))
+        self.assert_round_trip()
+
+    def test_orders_in_the_same_millisecond(self):
+        self.set_created_at(timedelta(microseconds=10))
+        self.assert_round_trip()
+
+    def test_cursor_keeps_microseconds(self):
+        when = timezone.now().replace(microsecond=123456)
+        self.assertEqual(decode_cursor(encode_cursor([when, 7], "next", 2))["v"], [when, 7])
+
+    def test_tampered_cursor_is_rejected(self):
+        cursor = self.paginator().get_page().next_cursor
+        payload, signature = cursor.rsplit(":", 1)
+        forged = encode_cursor([timezone.now(), 1], "next", 2).rsplit(":", 1)[0] + ":" + signature
+        for token in (forged, payload + ":" + signature[::-1], "garbage", cursor[:-1]):
+            self.assertIsNone(decode_cursor(token))
+            page = self.paginator().get_page(token)
+            self.assertEqual((page.number, page.has_previous()), (1, False))
+        self.client.force_login(self.user)
+        response = self.client.get("/orders/", {"cursor": forged})
+        self.assertEqual(response.context["orders"].number, 1)
+
+    def test_cursor_from_another_salt_is_rejected(self):
+        self.assertIsNone(decode_cursor(signing.dumps({"v": [1], "d": "next", "n": 2})))
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.oats = make_product("Oats")
+        self.rice = make_product("Rice")
+        self.users = [User.objects.create_user(f"reviewer-{n}") for n in range(3)]
+
+    def assert_aggregates(self, product, count, avg, histogram):
+        product.refresh_from_db()
+        self.assertEqual(product.rating_count, count)
+        self.assertAlmostEqual(product.rating_avg, avg)
+        self.assertEqual([n for _, n in product.rating_histogram], histogram)
+        self.assertEqual(ratings.aggregate_for([product.pk])[product.pk]["rating_count"], count)
+
+    def test_reviews_added_edited_moved_and_deleted(self):
+        first = Review.objects.create(product=self.oats, user=self.users[0], rating=5)
+        Review.objects.create(product=self.oats, user=self.users[1], rating=2)
+        self.assert_aggregates(self.oats, 2, 3.5, [1, 0, 0, 1, 0])
+        first.rating = 4
+        first.save()
+        self.assert_aggregates(self.oats, 2, 3.0, [0, 1, 0, 1, 0])
+        first.product = self.rice
+        first.save()
+        self.assert_aggregates(self.oats, 1, 2.0, [0, 0, 0, 1, 0])
+        self.assert_aggregates(self.rice, 1, 4.0, [0, 1, 0, 0, 0])
+        first.delete()
+        self.assert_aggregates(self.rice, 0, 0.0, [0, 0, 0, 0, 0])
+
+    def test_saving_a_stale_product_keeps_the_aggregates(self):
+        stale = Product.objects.get(pk=self.oats.pk)
+        Review.objects.create(product=self.oats, user=self.users[0], rating=5)
+        stale.name = "Rolled oats"
+        stale.save()
+        self.assert_aggregates(self.oats, 1, 5.0, [1, 0, 0, 0, 0])
+
+    def test_reconcile_fixes_drift(self):
+        Review.objects.create(product=self.oats, user=self.users[0], rating=3)
+        Product.objects.filter(pk=self.oats.pk).update(rating_count=7, rating_sum=1, rating_avg=0.1)
+        self.assertEqual(ratings.reconcile(batch_size=1), (2, 1))
+        self.assert_aggregates(self.oats, 1, 3.0, [0, 0, 1, 0, 0])
+        self.assertEqual(ratings.reconcile(), (2, 0))
+
+
+class OrderHistoryTests(TestCase):
+    def paid_order(self, user, lines, discount=0):
+        order = Order.objects.create(user=user, discount=discount, stripe_checkout_session_id=fake_stripe.new_id("cs"))
+        for n in range(lines):
+            order.items.create(product=make_product(f"Product {n}", price="1.25"), quantity=n + 1)
+        cart.snapshot_prices(order.items.all())
+        return fulfilment.fulfil_checkout_session(order.stripe_checkout_session_id)
+
+    def test_totals_are_stored_from_the_snapshot_when_paid(self):
+        order = self.paid_order(User.objects.create_user("shopper"), 3, discount=10)
+        Product.objects.update(price="9.99")
+        order.refresh_from_db()
+        # 6 units at 1.25, less 10%.
+        self.assertEqual((order.line_count, order.subtotal, order.discount_amount, order.total),
+                         (3, Decimal("7.50"), Decimal("0.75"), Decimal("6.75")))
+
+    def test_queries_do_not_grow_with_the_orders(self):
+        user = User.objects.create_user("shopper")
+        self.paid_order(user, 2)
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as one:
+            self.client.get("/orders/")
+        for _ in range(9):
+            self.paid_order(user, 2)
+        with CaptureQueriesContext(connection) as ten:
+            response = self.client.get("/orders/")
+        self.assertEqual(len(ten), len(one))
+        self.assertEqual([o.total for o in response.context["orders"]], [Decimal("3.75")] * 10)
+
+    def test_lines_render_from_their_snapshot(self):
+        user = User.objects.create_user("shopper")
+        order = Order.objects.create(user=user, is_paid=True)
+        order.items.create(product=make_product("Oats", category=Category.objects.create(name="Cereals")), quantity=1)
+        cart.snapshot_prices(order.items.all())
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/orders/")
+        self.assertContains(response, "Cereals")
+        self.assertFalse([q["sql"] for q in queries if '"store_product"' in q["sql"] or '"store_category"' in q["sql"]])
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.oats = make_product("Oats", stock=3)
+        self.rice = make_product("Rice", stock=5)
+        self.order = Order.objects.create(user=User.objects.create_user("shopper"))
+        self.order.items.create(product=self.oats, quantity=2)
+        self.order.items.create(product=self.rice, quantity=1)
+
+    def stock_of(self, product):
+        product.refresh_from_db()
+        return product.stock
+
+    def test_reserve_holds_every_line(self):
+        stock.reserve(self.order)
+        self.assertEqual((self.stock_of(self.oats), self.stock_of(self.rice)), (1, 4))
+        self.assertEqual(dict(self.order.stock_holds.values_list("product_id", "quantity")),
+                         {self.oats.pk: 2, self.rice.pk: 1})
+
+    def test_reserve_again_replaces_the_holds(self):
+        stock.reserve(self.order)
+        stock.reserve(self.order)
+        self.assertEqual((self.stock_of(self.oats), self.stock_of(self.rice)), (1, 4))
+        self.assertEqual(self.order.stock_holds.count(), 2)
+
+    def test_out_of_stock_reports_only_short_lines(self):
+        Product.objects.filter(pk=self.rice.pk).update(stock=0)
+        with self.assertRaises(stock.OutOfStock) as raised:
+            stock.reserve(self.order)
+        self.assertEqual(raised.exception.short, {self.rice.pk: ("Rice", 0)})
+        self.assertEqual((self.stock_of(self.oats), self.stock_of(self.rice)), (3, 0))
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_convert_settles_the_holds(self):
+        stock.reserve(self.order)
+        # Paid for one more oat than was held and no rice.
+        with transaction.atomic():
+            unheld = stock.convert(self.order, {self.oats.pk: 3})
+        self.assertEqual(unheld, {self.oats.pk: 1})
+        self.assertEqual((self.stock_of(self.oats), self.stock_of(self.rice)), (1, 5))
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_release_orders(self):
+        stock.reserve(self.order)
+        stock.release_orders([self.order.pk])
+        self.assertEqual((self.stock_of(self.oats), self.stock_of(self.rice)), (3, 5))
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_release_expired_keeps_holds_in_their_grace_period(self):
+        now = timezone.now()
+        stock.reserve(self.order, now=now - timedelta(seconds=stock.HOLD_SECONDS + stock.GRACE_SECONDS // 2))
+        self.assertEqual(stock.release_expired(now=now), 0)
+        self.assertEqual(stock.release_expired(now=now + timedelta(seconds=stock.GRACE_SECONDS)), 2)
+        self.assertEqual((self.stock_of(self.oats), self.stock_of(self.rice)), (3, 5))
+
+
+class OrderAdminStockTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin"))
+        self.oats = make_product("Oats", stock=3)
+        self.order = Order.objects.create(user=User.objects.create_user("shopper"))
+        self.order.items.create(product=self.oats, quantity=2)
+        stock.reserve(self.order)
+
+    def run_action(self, action, **extra):
+        return self.client.post("/admin/store/order/", {"action": action, "_selected_action": [self.order.pk],
+                                                         **extra})
+
+    def test_mark_paid_settles_the_holds(self):
+        self.run_action("mark_paid")
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_paid)
+        self.assertFalse(StockHold.objects.exists())
+        stock.release_expired(now=timezone.now() + timedelta(days=1))
+        self.oats.refresh_from_db()
+        self.assertEqual(self.oats.stock, 1)
+
+    def test_delete_gives_the_held_stock_back(self):
+        self.run_action("delete_selected", post="yes")
+        self.assertFalse(Order.objects.exists())
+        self.oats.refresh_from_db()
+        self.assertEqual(self.oats.stock, 3)
+
+    def test_mark_paid_expires_the_product_page(self):
+        anonymous = Client()
+        etag = anonymous.get(f"/product/{self.oats.pk}/")["ETag"]
+        self.run_action("mark_paid")
+        response = anonymous.get(f"/product/{self.oats.pk}/", headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+
+class AdminCountTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin"))
+        products = [make_product(f"Product {n}") for n in range(6)]
+        Product.objects.filter(pk__in=[products[1].pk, products[2].pk]).delete()
+
+    def result_count(self, query=""):
+        return self.client.get(f"/admin/store/product/?{query}").context["cl"].result_count
+
+    def test_unfiltered_list_without_statistics_is_counted(self):
+        self.assertEqual(self.result_count(), 4)
+
+    def test_unfiltered_list_from_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.result_count(), 4)
+        self.assertFalse([q["sql"] for q in queries if "COUNT(" in q["sql"].upper() and "store_product" in q["sql"]])
+
+    def test_filtered_list_is_counted(self):
+        self.assertEqual(self.result_count("category__id__exact=%d" % Category.objects.get().pk), 4)
+        self.assertEqual(self.result_count("q=Product 3"), 1)
+
+
+class PaymentCancelTests(TestCase):
+    def setUp(self):
+        self.oats = make_product("Oats", stock=3)
+        user = User.objects.create_user("shopper")
+        self.order = Order.objects.create(user=user, stripe_checkout_session_id="cs_test_1")
+        self.order.items.create(product=self.oats, quantity=2)
+        stock.reserve(self.order)
+        self.client.force_login(user)
+
+    def cancel(self, **expire):
+        with mock.patch("store.payments.expire_checkout_session", **expire) as expired:
+            response = self.client.get("/cancel/")
+        expired.assert_called_once_with("cs_test_1")
+        self.oats.refresh_from_db()
+        return response
+
+    def test_expired_session_releases_the_hold(self):
+        self.cancel(return_value="expired")
+        self.assertEqual(self.oats.stock, 3)
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_session_paid_meanwhile_keeps_the_hold(self):
+        response = self.cancel(return_value="complete")
+        self.assertRedirects(response, "/orders/", fetch_redirect_response=False)
+        self.assertEqual(self.oats.stock, 1)
+        self.assertTrue(StockHold.objects.exists())
+
+    def test_stripe_unreachable_keeps_the_hold(self):
+        self.cancel(side_effect=stripe.APIConnectionError("down"))
+        self.assertEqual(self.oats.stock, 1)
+        self.assertTrue(StockHold.objects.exists())
+
+
+class FacetIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.oats = make_product("Oats", stock=3)
+        self.rice = make_product("Rice", stock=5)
+
+    def in_stock(self):
+        return facets.current().bitmaps.get(facets.IN_STOCK, 0).bit_count()
+
+    def test_reloads_after_a_write_from_another_process(self):
+        self.assertEqual(self.in_stock(), 2)
+        # Another process sells out the oats; its cache is not this one's, so no version is bumped here.
+        with mock.patch("store.catalog_cache.bump_facets"):
+            Product.objects.filter(pk=self.oats.pk).update(stock=0)
+            facets.update([self.oats.pk])
+        self.assertEqual(self.in_stock(), 2)
+        facets.current().checked_at -= facets.CHECK_SECONDS
+        self.assertEqual(self.in_stock(), 1)
+
+    def test_update_rewrites_only_the_values_that_change(self):
+        before = dict(FacetBitmap.objects.values_list("key", "updated_at"))
+        Product.objects.filter(pk=self.oats.pk).update(stock=0)
+        with CaptureQueriesContext(connection) as ctx:
+            facets.update([self.oats.pk])
+        after = dict(FacetBitmap.objects.values_list("key", "updated_at"))
+        self.assertEqual([key for key in after if after[key] != before[key]], [facets.IN_STOCK])
+        locked = [q["sql"] for q in ctx.captured_queries if '"key" IN' in q["sql"]]
+        self.assertEqual(len(locked), 1)
+        whole = [q["sql"] for q in ctx.captured_queries if '"bits" FROM' in q["sql"]]
+        self.assertEqual(whole, locked)
+
+    def test_update_matches_a_rebuild(self):
+        far = Product.objects.create(pk=5000, name="Quinoa", description="", price="12.00", stock=0,
+                                     category=Category.objects.create(name="Seeds"))
+        facets.rebuild()
+        Product.objects.filter(pk=self.oats.pk).update(price="25.00", category=far.category, stock=0)
+        Product.objects.filter(pk=far.pk).update(price="1.00", category=self.rice.category, stock=4)
+        facets.update([self.oats.pk, far.pk, self.rice.pk])
+        updated = dict(FacetBitmap.objects.values_list("key", "bits"))
+        facets.rebuild()
+        rebuilt = dict(FacetBitmap.objects.values_list("key", "bits"))
+        self.assertEqual({k: bytes(v).rstrip(b"\0") for k, v in updated.items() if any(v)},
+                         {k: bytes(v).rstrip(b"\0") for k, v in rebuilt.items() if any(v)})
+
+
+class DatabaseProfileTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_sqlite_profile(self):
+        if settings.DB_PROFILE != "sqlite":
+            self.skipTest("Only the sqlite profile tunes connections")
+        self.assertEqual(self.pragma("journal_mode"), "wal")
+        self.assertEqual(self.pragma("synchronous"), 1)
+        self.assertEqual(self.pragma("busy_timeout"), settings.SQLITE_PRAGMAS["busy_timeout"])
+        self.assertEqual(connection.transaction_mode, "IMMEDIATE")
+
+    @override_settings(SQLITE_PRAGMAS={"cache_size": -4000})
+    def test_pragmas_are_applied_to_new_connections(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite only")
+        original = self.pragma("cache_size")
+        self.addCleanup(connection.cursor().execute, f"PRAGMA cache_size = {original}")
+        signals.tune_sqlite(sender=type(connection), connection=connection)
+        self.assertEqual(self.pragma("cache_size"), -4000)
+
+
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        make_product()
+
+    def test_hot_paths_use_indexes(self):
+        call_command("explain_hot_paths", verbosity=0, stdout=StringIO())
+
+    def test_full_table_scan_fails(self):
+        unindexed = [("product by description", Product.objects.filter(description="x"))]
+        with mock.patch.object(explain_hot_paths, "hot_paths", return_value=unindexed):
+            with self.assertRaisesMessage(CommandError, "product by description (store_product)"):
+                call_command("explain_hot_paths", verbosity=0, stdout=StringIO())
+
+
+class SessionCheckTests(TestCase):
+    @override_settings(SESSION_ENGINE="store.sessions")
+    def test_cache_first_sessions_need_a_shared_cache(self):
+        self.assertEqual([e.id for e in sessions.check_shared_cache(None)], ["store.E001"])
+
+    @override_settings(SESSION_ENGINE="store.sessions", CACHES={"default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": "/tmp/healthfoods-test-cache"}})
+    def test_shared_cache(self):
+        self.assertEqual(sessions.check_shared_cache(None), [])
+
+
+class CacheFirstSessionTests(TestCase):
+    def setUp(self):
+        session = sessions.SessionStore()
+        session["cart"] = 1
+        session.save()
+        self.key = session.session_key
+
+    def stored(self):
+        return Session.objects.get(pk=self.key).get_decoded()
+
+    def test_unchanged_session_writes_nothing(self):
+        session = sessions.SessionStore(self.key)
+        self.assertEqual(session["cart"], 1)
+        with self.assertNumQueries(0):
+            session.save()
+        self.assertFalse(session.needs_save())
+
+    def test_change_reaches_the_database_after_the_write_interval(self):
+        session = sessions.SessionStore(self.key)
+        session["voucher"] = "SAVE10"
+        with self.assertNumQueries(0):
+            session.save()
+        self.assertEqual(sessions.SessionStore(self.key)["voucher"], "SAVE10")
+        self.assertNotIn("voucher", self.stored())
+        with mock.patch.object(sessions, "WRITE_INTERVAL", 0):
+            session = sessions.SessionStore(self.key)
+            session.load()
+            self.assertTrue(session.needs_save())
+            session.save()
+        self.assertEqual(self.stored()["voucher"], "SAVE10")
+
+    def test_login_is_written_through(self):
+        user = User.objects.create_user("ana")
+        session = sessions.SessionStore(self.key)
+        session[SESSION_KEY] = str(user.pk)
+        session.save()
+        self.assertEqual(self.stored()[SESSION_KEY], str(user.pk))
+
+    def test_purge_deletes_only_expired_sessions(self):
+        Session.objects.bulk_create(
+            Session(session_key=f"expired{i}", session_data="", expire_date=timezone.now() - timedelta(days=1))
+            for i in range(5)
+        )
+        call_command("purge_sessions", batch_size=2, stdout=StringIO())
+        self.assertEqual(list(Session.objects.values_list("pk", flat=True)), [self.key])
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user("staff", is_staff=True)
+        make_product()
+
+    def value(self, name, labels):
+        self.client.force_login(self.staff)
+        text = self.client.get("/metrics/").content.decode()
+        self.client.logout()
+        line = next((line for line in text.splitlines() if line.startswith(f"{name}{{{labels}}} ")), None)
+        return float(line.split()[-1]) if line else 0.0
+
+    def test_requests_are_recorded_per_view(self):
+        requests = ('store_http_requests_total', 'view="product_list",method="GET",status="200"')
+        queries = ('store_http_request_queries_count', 'view="product_list"')
+        templates = ('store_http_request_template_seconds_count', 'view="product_list"')
+        before = [self.value(*metric) for metric in (requests, queries, templates)]
+        self.client.get("/", {"q": "oats"})
+        after = [self.value(*metric) for metric in (requests, queries, templates)]
+        self.assertEqual([b - a for a, b in zip(before, after)], [1, 1, 1])
+        self.assertGreater(self.value("store_http_request_template_seconds_sum", 'view="product_list"'), 0)
+
+    def test_metrics_need_staff_or_the_token(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 403)
+        with override_settings(METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get("/metrics/", headers={"authorization": "Bearer wrong"}).status_code, 403)
+            response = self.client.get("/metrics/", headers={"authorization": "Bearer secret"})
+        self.assertContains(response, "# TYPE store_http_request_duration_seconds histogram")
+        self.assertContains(response, "store_stripe_queue_pending 0")
+
+    @override_settings(INSTRUMENTATION_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_their_repeated_statements(self):
+        with self.assertLogs("store.instrumentation", "WARNING") as logs:
+            self.client.get("/")
+        self.assertIn("Slow request GET / (product_list)", logs.output[0])
+        self.assertIn("top statements: ", logs.output[0])
+
+    def test_repeated_statements(self):
+        stats = instrumentation.RequestStats()
+        for sql in ["SELECT 1 WHERE id IN (%s, %s)", "SELECT 1 WHERE id IN (%s, %s, %s)", "SELECT 2", "SELECT 2"]:
+            stats(lambda *args: None, sql, [], False, {})
+        self.assertEqual((stats.queries, stats.duplicates), (4, 1))
+        self.assertEqual(stats.fingerprints(), [("SELECT 1 WHERE id IN (...)", 2), ("SELECT 2", 2)])
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET="whsec_test")
+class StripeWebhookTests(TestCase):
+    event = {"id": "evt_1", "object": "event", "type": "checkout.session.completed",
+             "data": {"object": {"id": "cs_test_1", "object": "checkout.session", "metadata": {"order_id": "1"}}}}
+
+    def post(self, client):
+        payload = json.dumps(self.event)
+        timestamp = int(time.time())
+        signature = hmac.new(b"whsec_test", f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+        return client.post("/stripe/webhook/", payload, content_type="application/json",
+                           headers={"stripe-signature": f"t={timestamp},v1={signature}"})
+
+    def test_queues_the_verified_event(self):
+        self.assertEqual(self.post(self.client).status_code, 200)
+        self.assertEqual(StripeEvent.objects.get().payload, self.event)
+
+    @override_settings(ROOT_URLCONF=__name__)
+    async def test_async_view_queues_the_verified_event(self):
+        self.assertEqual((await self.post(self.async_client)).status_code, 200)
+        self.assertEqual((await StripeEvent.objects.aget()).payload, self.event)
+
+    def test_rejects_a_bad_signature(self):
+        response = self.client.post("/stripe/webhook/", json.dumps(self.event), content_type="application/json",
+                                    headers={"stripe-signature": "t=1,v1=bad"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+
+class EventQueueTests(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(user=User.objects.create_user("shopper"), stripe_checkout_session_id="cs_1")
+        self.order.items.create(product=make_product(stock=5), quantity=1)
+
+    def event(self, event_id="evt_1", session_id="cs_1", type="checkout.session.completed"):
+        return {"id": event_id, "type": type, "data": {"object": {"id": session_id}}}
+
+    def test_enqueue_ignores_redeliveries_and_other_types(self):
+        self.assertTrue(event_queue.enqueue(self.event()))
+        self.assertFalse(event_queue.enqueue(self.event()))
+        self.assertFalse(event_queue.enqueue(self.event("evt_2", type="invoice.paid")))
+        self.assertEqual(StripeEvent.objects.count(), 1)
+
+    def test_drain_fulfils_the_order(self):
+        event_queue.enqueue(self.event())
+        self.assertEqual(event_queue.drain(), 1)
+        self.assertEqual(StripeEvent.objects.get(event_id="evt_1").status, StripeEvent.DONE)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_paid)
+
+    def test_failures_back_off_then_dead_letter(self):
+        event_queue.enqueue(self.event())
+        with mock.patch.object(event_queue.fulfilment, "fulfil_checkout_session", side_effect=RuntimeError("down")), \
+                self.assertLogs("store.event_queue", "WARNING"):
+            self.assertEqual(event_queue.drain(), 1)
+            event = StripeEvent.objects.get()
+            self.assertEqual((event.status, event.attempts), (StripeEvent.PENDING, 1))
+            self.assertGreater(event.available_at, timezone.now())
+            self.assertEqual(event.last_error, "RuntimeError: down")
+            for _ in range(event_queue.MAX_ATTEMPTS - 1):
+                StripeEvent.objects.update(available_at=timezone.now())
+                event_queue.drain()
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (StripeEvent.DEAD, event_queue.MAX_ATTEMPTS))
+        self.assertEqual(event_queue.queue_depth()[StripeEvent.DEAD], 1)
+
+    def test_claims_do_not_overlap_and_expired_leases_are_retried(self):
+        for n in range(3):
+            event_queue.enqueue(self.event(f"evt_{n}", f"cs_{n}"))
+        first = event_queue.claim("a", 2)
+        second = event_queue.claim("b", 2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({e.pk for e in first} & {e.pk for e in second})
+        self.assertEqual(event_queue.claim("c", 10), [])
+        StripeEvent.objects.filter(pk=first[0].pk).update(
+            claimed_at=timezone.now() - timedelta(seconds=event_queue.LEASE_SECONDS + 1))
+        self.assertEqual([e.pk for e in event_queue.claim("c", 10)], [first[0].pk])
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        self.oats = make_product("Oats", stock=10)
+        Product.objects.filter(pk=self.oats.pk).update(
+            sku="OATS", image="products/product_images/oats.png",
+            image_renditions={"source": "products/product_images/oats.png", "renditions": {}})
+        order = Order.objects.create(user=User.objects.create_user("shopper"))
+        order.items.create(product=self.oats, quantity=4)
+        stock.reserve(order)
+
+    def row(self, **values):
+        return {"sku": "OATS", "name": "Oats", "price": "2.50", "stock": 10, "category": "Grains",
+                "image": "products/product_images/oats.png", **values}
+
+    def test_held_units_are_subtracted_from_the_feed(self):
+        catalog_io.import_rows([self.row(stock=20)])
+        self.oats.refresh_from_db()
+        self.assertEqual(self.oats.stock, 16)
+        self.assertEqual([r["stock"] for r in catalog_io.export_rows()], [20])
+
+    def test_changed_image_drops_the_renditions(self):
+        stats = catalog_io.import_rows([self.row(image="products/product_images/oats-2.png")])
+        self.oats.refresh_from_db()
+        self.assertEqual((stats.new_images, self.oats.image_renditions), (1, {}))
+
+    def test_unchanged_image_keeps_the_renditions(self):
+        stats = catalog_io.import_rows([self.row()])
+        self.oats.refresh_from_db()
+        self.assertEqual(stats.new_images, 0)
+        self.assertEqual(self.oats.image_renditions["source"], "products/product_images/oats.png")
+
+
+class CatalogFileTests(TestCase):
+    rows = [
+        {"sku": "RICE", "name": "Rice", "description": "Long grain", "price": "1.20", "stock": 5,
+         "category": "Grains", "image": ""},
+        {"sku": "TEA", "name": "Green tea", "description": "", "price": "3.00", "stock": 0,
+         "category": "Drinks", "image": "products/product_images/tea.png"},
+    ]
+
+    def round_trip(self, fmt):
+        catalog_io.import_rows(self.rows)
+        out = StringIO()
+        self.assertEqual(catalog_io.write_rows(catalog_io.export_rows(), out, fmt), 2)
+        out.seek(0)
+        self.assertEqual([catalog_io.clean_row(r) for r in catalog_io.read_rows(out, fmt)],
+                         [catalog_io.clean_row(r) for r in self.rows])
+
+    def test_jsonl_round_trip(self):
+        self.round_trip("jsonl")
+
+    def test_csv_round_trip(self):
+        self.round_trip("csv")
+
+    def test_json_array_split_across_reads(self):
+        items = [{"model": "store.category", "pk": 7, "fields": {"name": "Grains"}},
+                 {"model": "store.product", "pk": 3, "fields": {"name": "Rice", "price": "1.20", "stock": 12,
+                                                                "category": 7, "description": "x" * 50}}]
+        with mock.patch.object(catalog_io, "READ_SIZE", 16):
+            rows = list(catalog_io.read_rows(StringIO(json.dumps(items, indent=1)), "json"))
+        self.assertEqual([(r["sku"], r["category"], r["stock"]) for r in rows], [("HF-3", "Grains", 12)])
+
+    def test_upserts_by_sku_in_batches_and_skips_bad_rows(self):
+        rows = [*self.rows, {"sku": "RICE", "name": "Basmati rice", "price": "1.50", "stock": 7, "category": "Grains"},
+                {"sku": "", "name": "No SKU", "price": "1", "category": "Grains"},
+                {"sku": "BAD", "name": "Bad", "price": "cheap", "category": "Grains"}]
+        stats = catalog_io.import_rows(rows, batch_size=1, batches_per_transaction=2)
+        self.assertEqual((stats.rows, stats.imported, stats.skipped), (5, 3, 2))
+        self.assertEqual(len(stats.errors), 2)
+        self.assertEqual(Product.objects.count(), 2)
+        rice = Product.objects.get(sku="RICE")
+        self.assertEqual((rice.name, rice.price, rice.stock), ("Basmati rice", Decimal("1.50"), 7))
+        self.assertEqual(sorted(Category.objects.values_list("name", flat=True)), ["Drinks", "Grains"])
+        self.assertEqual([pk for pk, _ in search.search("basmati")], [rice.pk])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.oats = make_product("Rolled oats")
+        self.muesli = Product.objects.create(name="Muesli", description="Toasted oats and raisins", price="4.00",
+                                             stock=5, category=Category.objects.create(name="Cereals"))
+        self.creme = make_product("Crème fraîche")
+
+    def assert_search(self, backend):
+        self.assertEqual([pk for pk, _ in search.search("oats", backend=backend)], [self.oats.pk, self.muesli.pk])
+        self.assertEqual([pk for pk, _ in search.search("toasted oa", backend=backend)], [self.muesli.pk])
+        self.assertEqual([pk for pk, _ in search.search("cereal", backend=backend)], [self.muesli.pk])
+        self.assertEqual([pk for pk, _ in search.search("creme", backend=backend)], [self.creme.pk])
+        self.assertEqual(search.search("  ", backend=backend), [])
+
+        self.oats.name = "Porridge"
+        self.oats.save()
+        self.creme.delete()
+        self.assertEqual([pk for pk, _ in search.search("porr", backend=backend)], [self.oats.pk])
+        self.assertEqual(search.search("creme", backend=backend), [])
+
+    def test_fts5(self):
+        if not search.fts5_available():
+            self.skipTest("SQLite without FTS5")
+        with override_settings(STORE_SEARCH_BACKEND="fts5"):
+            self.assert_search("fts5")
+
+    def test_token_index(self):
+        with override_settings(STORE_SEARCH_BACKEND="tokens"):
+            search.rebuild()
+            self.assert_search("tokens")
+
+    def test_product_list_search(self):
+        response = self.client.get("/", {"q": "oats"})
+        self.assertEqual([p.pk for p in response.context["products"]], [self.oats.pk, self.muesli.pk])
+
+
+class SearchDocumentCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.oats = make_product("Rolled oats")
+        make_product("Oat bran")
+
+    def test_token_search_does_not_count_the_products(self):
+        backend = search.TokenIndexBackend()
+        backend.index(Product.objects.select_related("category"))
+        backend.search(["oat"], 10)
+        with CaptureQueriesContext(connection) as ctx:
+            results = backend.search(["oat"], 10)
+        self.assertEqual(len(results), 2)
+        self.assertFalse([q for q in ctx.captured_queries if "COUNT(" in q["sql"]])
+
+    def test_count_follows_creates_and_deletes(self):
+        self.assertEqual(search.document_count(), 2)
+        make_product("Oat milk")
+        self.assertEqual(search.document_count(), 3)
+        self.oats.delete()
+        self.assertEqual(search.document_count(), 2)
+
+
+class ImageRenditionTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.oats = make_product("Oats")
+
+    def save_image(self, name):
+        buffer = BytesIO()
+        Image.new("RGB", (400, 300), "green").save(buffer, "PNG")
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def test_saving_a_new_image_writes_its_renditions(self):
+        self.oats.image = self.save_image("products/product_images/oats.png")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.oats.save()
+        self.oats.refresh_from_db()
+        manifest = self.oats.image_renditions
+        self.assertEqual((manifest["source"], manifest["width"], manifest["height"]), (self.oats.image.name, 400, 300))
+        self.assertEqual([width for width, _ in manifest["renditions"]["webp"]], [160, 320, 400])
+        for width, name in manifest["renditions"]["jpeg"]:
+            with default_storage.open(name) as fh:
+                self.assertEqual(Image.open(fh).size[0], width)
+
+    def test_missing_image_file_does_not_fail_the_save(self):
+        self.oats.image = "products/product_images/missing.png"
+        with self.assertLogs("store.images", "WARNING"), self.captureOnCommitCallbacks(execute=True):
+            self.oats.save()
+        self.oats.price = "3.00"
+        with self.assertLogs("store.images", "WARNING"), self.captureOnCommitCallbacks(execute=True):
+            self.oats.save()
+        self.oats.refresh_from_db()
+        self.assertEqual((self.oats.price, self.oats.image_renditions), (Decimal("3.00"), {}))
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.oats = make_product("Oats", price="2.50")
+
+    def get(self, etag=None):
+        return self.client.get("/", headers={"if-none-match": etag} if etag else {})
+
+    def test_conditional_get(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header("Last-Modified"))
+        self.assertEqual(self.get(response["ETag"]).status_code, 304)
+        self.client.force_login(User.objects.create_user("shopper"))
+        self.assertEqual(self.get(response["ETag"]).status_code, 200)
+
+    def test_price_change_expires_the_page(self):
+        etag = self.get()["ETag"]
+        self.oats.price = "3.75"
+        self.oats.save()
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "3.75")
+
+    def test_price_change_in_another_process(self):
+        etag = self.get()["ETag"]
+        # Another process's save: the row and its published versions, but not this process's cache.
+        Product.objects.filter(pk=self.oats.pk).update(price="3.75")
+        catalog_cache._publish([catalog_cache.CATALOG_KEY, catalog_cache._product_key(self.oats.pk)])
+        self.assertEqual(self.get(etag).status_code, 304)
+        catalog_cache._polled["at"] -= catalog_cache.CHECK_SECONDS
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "3.75")
+
+    def test_stock_change_expires_the_product_page(self):
+        etag = self.client.get(f"/product/{self.oats.pk}/")["ETag"]
+        order = Order.objects.create(user=User.objects.create_user("shopper"))
+        order.items.create(product=self.oats, quantity=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.reserve(order)
+        response = self.client.get(f"/product/{self.oats.pk}/", headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+
+
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("shopper")
+        self.oats = make_product("Oats", price="2.50")
+        self.order = Order.objects.create(user=self.user)
+        self.order.items.create(product=self.oats, quantity=2)
+        self.client.force_login(self.user)
+
+    def summary(self):
+        return self.client.get("/cart/").context["summary"]
+
+    def test_cart_change_in_another_process(self):
+        self.assertEqual(self.summary()["item_count"], 2)
+        # The other process's invalidation only reaches its own cache.
+        with mock.patch("store.cart.invalidate"):
+            cart.add_items(Order.objects.get(pk=self.order.pk), {self.oats.pk: 3})
+        self.assertEqual(self.summary()["item_count"], 5)
+
+    def test_price_change_in_another_process(self):
+        self.assertEqual(self.summary()["total"], Decimal("5.00"))
+        Product.objects.filter(pk=self.oats.pk).update(price="3.00")
+        catalog_cache._publish([catalog_cache.PRICES_KEY])
+        catalog_cache._polled["at"] -= catalog_cache.CHECK_SECONDS
+        self.assertEqual(self.summary()["total"], Decimal("6.00"))
+
+    def test_admin_mark_paid_expires_the_summary(self):
+        self.client.force_login(User.objects.create_superuser("admin"))
+        with mock.patch("store.cart.invalidate") as invalidate:
+            self.client.post("/admin/store/order/", {"action": "mark_paid", "_selected_action": [self.order.pk]})
+        invalidate.assert_called_once_with(self.user.pk)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=fake_stripe.WEBHOOK_SECRET)
+@mock.patch.object(event_queue, "BACKOFF_SECONDS", 0)
+class WebhookFulfilmentTests(TransactionTestCase):
+    """Events delivered concurrently through the webhook and drained by competing queue workers."""
+
+    def setUp(self):
+        cache.clear()
+        self.oats = make_product("Oats", stock=1)
+
+    def order(self, username):
+        order = Order.objects.create(user=User.objects.create_user(username),
+                                     stripe_checkout_session_id=fake_stripe.new_id("cs"))
+        order.items.create(product=self.oats, quantity=1)
+        return order
+
+    def deliver(self, events):
+        def post(event):
+            body, headers = fake_stripe.signed_request(event)
+            client = Client(raise_request_exception=False)
+            try:
+                # Stripe redelivers anything that does not get a 2xx.
+                while client.post("/stripe/webhook/", body, content_type="application/json",
+                                  **headers).status_code != 200:
+                    time.sleep(0.01)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(events)) as pool:
+            list(pool.map(post, events))
+
+    def drain(self, workers=2):
+        def work(n):
+            try:
+                while event_queue.drain(f"test-{n}") or event_queue.queue_depth()["pending"]:
+                    time.sleep(0.01)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(work, range(workers)))
+
+    def test_duplicate_deliveries_fulfil_the_order_once(self):
+        Product.objects.filter(pk=self.oats.pk).update(stock=5)
+        order = self.order("shopper")
+        event = fake_stripe.checkout_completed(order.stripe_checkout_session_id, order.pk)
+        self.deliver([event] * 3)
+        self.drain()
+        self.deliver([event])
+        self.drain()
+        self.assertEqual(StripeEvent.objects.get(event_id=event["id"]).status, StripeEvent.DONE)
+        self.assertEqual(StripeEvent.objects.filter(type=event_queue.RECOMMENDATIONS_TYPE).count(), 1)
+        order.refresh_from_db()
+        self.oats.refresh_from_db()
+        self.assertEqual((order.is_paid, self.oats.stock), (True, 4))
+        self.assertFalse(Oversell.objects.exists())
+
+    def test_orders_competing_for_the_last_unit(self):
+        orders = [self.order("first"), self.order("second")]
+        self.deliver([fake_stripe.checkout_completed(o.stripe_checkout_session_id, o.pk) for o in orders])
+        self.drain()
+        self.assertEqual(Order.objects.filter(is_paid=True).count(), 2)
+        self.oats.refresh_from_db()
+        self.assertEqual(self.oats.stock, 0)
+        oversell = Oversell.objects.get()
+        self.assertIn(oversell.order_id, [o.pk for o in orders])
+        self.assertEqual((oversell.product_id, oversell.requested, oversell.available), (self.oats.pk, 1, 0))
+
+
+@mock.patch.object(cooccurrence, "SETTLE_SECONDS", 0)
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.state_path = os.path.join(tempfile.mkdtemp(), "state.npz")
+        self.user = User.objects.create_user("shopper")
+        self.a, self.b, self.c = (make_product(name) for name in "ABC")
+
+    def pay(self, *products, paid_at=None):
+        order = Order.objects.create(user=self.user, is_paid=True,
+                                     paid_at=paid_at or timezone.now() - timedelta(hours=1))
+        for product in products:
+            order.items.create(product=product, quantity=1)
+        return order
+
+    def neighbours(self, product):
+        return ProductRecommendation.objects.get(product=product).neighbours
+
+    def test_lift_scores_against_the_number_of_baskets(self):
+        for basket in [(self.a, self.b), (self.a, self.b), (self.a, self.c), (self.b, self.c)]:
+            self.pay(*basket)
+        cooccurrence.build(scoring="lift", min_support=1, state_path=self.state_path)
+        # 4 baskets: A and B together in 2, A in 3, B in 3, C in 2.
+        self.assertEqual(self.neighbours(self.a), [[self.b.pk, round(2 * 4 / (3 * 3), 4)],
+                                                   [self.c.pk, round(1 * 4 / (3 * 2), 4)]])
+        self.assertEqual(self.neighbours(self.c), [[self.a.pk, 0.6667], [self.b.pk, 0.6667]])
+
+    def test_payment_queues_an_incremental_update(self):
+        self.pay(self.a, self.b)
+        self.pay(self.a, self.b)
+        cooccurrence.build(scoring="lift", min_support=1, state_path=self.state_path)
+        self.assertFalse(ProductRecommendation.objects.filter(product=self.c).exists())
+
+        order = Order.objects.create(user=self.user)
+        order.items.create(product=self.a, quantity=1)
+        order.items.create(product=self.c, quantity=1)
+        self.client.force_login(User.objects.create_superuser("admin"))
+        self.client.post("/admin/store/order/", {"action": "mark_paid", "_selected_action": [order.pk]})
+        job = StripeEvent.objects.get(type=event_queue.RECOMMENDATIONS_TYPE)
+        self.assertGreater(job.available_at, timezone.now())
+        StripeEvent.objects.update(available_at=timezone.now())
+        with mock.patch.object(cooccurrence, "update", partial(cooccurrence.update, state_path=self.state_path)):
+            event_queue.drain()
+        job.refresh_from_db()
+        self.assertEqual(job.status, StripeEvent.DONE)
+        # Scored with lift, as the last build was, over 3 baskets.
+        self.assertEqual(self.neighbours(self.c), [[self.a.pk, 1.0]])
+        self.assertEqual(event_queue.queue_depth()[StripeEvent.PENDING], 0)
@@ -1,5 +1,6 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 from django.contrib import messages
 from django.shortcuts import resolve_url
 from django.contrib.auth.views import LoginView
@@ -15,19 +16,22 @@ class CustomLoginView(LoginView):
         return response
 
 
+# The ASGI deployment serves these endpoints from async views.
+io_views = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
-    path('', views.product_list, name='product_list'),
-    path('product/<int:pk>/', views.product_detail, name='product_detail'),
+    path('', io_views.product_list, name='product_list'),
+    path('product/<int:pk>/', io_views.product_detail, name='product_detail'),
 
-    path('cart/', views.cart_view, name='cart'),
+    path('cart/', io_views.cart_view, name='cart'),
     path('add-to-cart/<int:pk>/', views.add_to_cart, name='add_to_cart'),
     path('decrement/<int:pk>/', views.decrement_from_cart, name='decrement_from_cart'),
     path('remove-from-cart/<int:pk>/', views.remove_from_cart, name='remove_from_cart'),
     path('checkout/', views.checkout, name='checkout'),
-    path('create-checkout-session/', views.create_checkout_session, name='create_checkout_session'),
+    path('create-checkout-session/', io_views.create_checkout_session, name='create_checkout_session'),
     path('success/', views.payment_success, name='payment_success'),
     path('cancel/', views.payment_cancel, name='payment_cancel'),
-    path('stripe/webhook/', views.stripe_webhook, name='stripe_webhook'),
+    path('stripe/webhook/', io_views.stripe_webhook, name='stripe_webhook'),
 
     path('wishlist/', views.wishlist_view, name='wishlist'),
     path('wishlist/add/<int:pk>/', views.add_to_wishlist, name='add_to_wishlist'),
@@ -37,6 +41,8 @@ urlpatterns = [
     path('orders/', views.order_history, name='order_history'),
     path("orders/reorder/<int:order_id>/", views.reorder, name="reorder"),
 
+    path('metrics/', views.metrics_view, name='metrics'),
+
 
     path('signup/', views.signup, name='signup'),
     path('login/', CustomLoginView.as_view(), name='login'),
@@ -3,44 +3,84 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import HttpResponse
-from django.core.paginator import Paginator
-from django.db.models import Q, Avg
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login as auth_login
 from .forms import SignUpForm
 from django.contrib.auth import logout
 from django.shortcuts import redirect
 from .models import Product, Order, OrderItem, Wishlist, Review
+from . import cart, catalog_cache, event_queue, facets, images, instrumentation, payments, recommendations, search, stock
+from .pagination import CursorPaginator, RankedCursorPaginator
 from django.conf import settings
 from django.urls import reverse
+from django.core.cache import cache
 from django.views.decorators.csrf import csrf_exempt
-from vouchers.models import Voucher
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import condition
+from django.views.static import serve
+from vouchers import resolver
 from vouchers.forms import VoucherApplyForm
 from decimal import Decimal
 from .forms import ShippingForm
+import os
 import stripe
 
-import stripe
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
 
 def home(request):
     return redirect('product_list')
 
+# Catalogue sort options; each ends in pk so keyset pagination is stable.
+PRODUCT_SORTS = {
+    '': ('pk',),
+    'name': ('name', 'pk'),
+    'price': ('price', 'pk'),
+    '-price': ('-price', '-pk'),
+    'rating': ('-rating_avg', '-pk'),
+}
+
+@condition(etag_func=catalog_cache.list_etag, last_modified_func=catalog_cache.list_last_modified)
 def product_list(request):
+    # Anonymous listing and search pages are cached whole, keyed by the catalogue version.
+    page_key = catalog_cache.list_page_key(request) if catalog_cache.cacheable(request) else None
+    if page_key:
+        content = cache.get(page_key)
+        if content is not None:
+            return HttpResponse(content)
+
     q = request.GET.get('q', '')
-    products = Product.objects.all().select_related('category')
+    sort = request.GET.get('sort', '')
+    if sort not in PRODUCT_SORTS:
+        sort = ''
+    cursor = request.GET.get('cursor')
+    selection = facets.Selection(request.GET)
+    index = facets.current()
     if q:
-        products = products.filter(Q(name__icontains=q) | Q(description__icontains=q) | Q(category__name__icontains=q))
-    paginator = Paginator(products, 8)
-    page = request.GET.get('page')
-    products_page = paginator.get_page(page)
-    return render(request, "store/product_list.html", {"products": products_page, "q": q})
+        # Page through the ranked ids and only load the products on this page.
+        ranked, hits = index.filter_ranked(selection, search.search(q))
+        products_page = RankedCursorPaginator(ranked, per_page=8).get_page(cursor)
+        page_ids = [pk for pk, _ in products_page]
+        found = Product.objects.select_related('category').in_bulk(page_ids)
+        products_page.object_list = [found[pk] for pk in page_ids if pk in found]
+    else:
+        hits = None
+        products = selection.filter(Product.objects.all().select_related('category'))
+        total = index.matching(selection).bit_count()
+        products_page = CursorPaginator(products, PRODUCT_SORTS[sort], per_page=8, count=total).get_page(cursor)
+    catalog_cache.annotate_card_versions(products_page.object_list)
+    response = render(request, "store/product_list.html", {
+        "products": products_page, "q": q, "sort": sort,
+        "facets": index.groups(selection, within=hits), "selection": selection,
+    })
+    if page_key and not response.cookies:
+        cache.set(page_key, response.content, catalog_cache.PAGE_TIMEOUT)
+    return response
 
+@condition(etag_func=catalog_cache.detail_etag, last_modified_func=catalog_cache.detail_last_modified)
 def product_detail(request, pk):
     product = get_object_or_404(Product, pk=pk)
     reviews = product.reviews.select_related('user').order_by('-created_at')
-    avg_rating = reviews.aggregate(a=Avg('rating'))['a'] or 0
+    avg_rating = product.rating_avg
 
     can_review = False
     if request.user.is_authenticated:
@@ -76,6 +116,7 @@ def product_detail(request, pk):
         "reviews": reviews,
         "avg_rating": avg_rating,
         "can_review": can_review,
+        "recommended": recommendations.similar_products(product.pk),
     })
 
 
@@ -97,24 +138,23 @@ def signup(request):
 
 @login_required
 def cart_view(request):
-    order, _ = Order.objects.get_or_create(user=request.user, is_paid=False)
+    order = cart.get_open_order(request)
+    lines = cart.cart_lines(order) if order else []
+    summary = cart.get_summary(order) if order else cart.EMPTY_SUMMARY
 
-    total = Decimal(order.total_amount())
+    total = summary["total"]
     discount = Decimal("0")
     new_total = total
-    voucher = None
 
-    vid = request.session.get("voucher_id")
-    if vid:
-        try:
-            voucher = Voucher.objects.get(id=vid, active=True)
-            discount = (total * Decimal(voucher.discount) / Decimal("100"))
-            new_total = total - discount
-        except Voucher.DoesNotExist:
-            pass
+    voucher = resolver.get_voucher(request.session.get("voucher_id"))
+    if voucher:
+        discount = (total * Decimal(voucher.discount) / Decimal("100"))
+        new_total = total - discount
 
     return render(request, "store/cart.html", {
         "order": order,
+        "lines": lines,
+        "summary": summary,
         "total": total,
         "voucher": voucher,
         "discount": discount,
@@ -126,56 +166,48 @@ def cart_view(request):
 @login_required
 def add_to_cart(request, pk):
     product = get_object_or_404(Product, pk=pk)
-    order, _ = Order.objects.get_or_create(user=request.user, is_paid=False)
-    item, created = OrderItem.objects.get_or_create(order=order, product=product)
-    if not created:
-        item.quantity += 1
-    item.save()
+    order = cart.get_open_order(request, create=True)
+    cart.add_items(order, {product.pk: 1})
     messages.success(request, f"Added {product.name} to cart.")
     return redirect("cart")
 
 @login_required
 def decrement_from_cart(request, pk):
-    order = get_object_or_404(Order, user=request.user, is_paid=False)
-    item = get_object_or_404(OrderItem, order=order, product_id=pk)
-    if item.quantity > 1:
-        item.quantity -= 1
-        item.save()
-    else:
-        item.delete()
+    order = cart.open_order_or_404(request)
+    get_object_or_404(OrderItem, order=order, product_id=pk)
+    cart.add_items(order, {pk: -1})
     return redirect("cart")
 
 @login_required
 def remove_from_cart(request, pk):
-    order = get_object_or_404(Order, user=request.user, is_paid=False)
-    item = get_object_or_404(OrderItem, order=order, product_id=pk)
-    item.delete()
+    order = cart.open_order_or_404(request)
+    get_object_or_404(OrderItem, order=order, product_id=pk)
+    cart.remove_items(order, [pk])
     messages.info(request, "Item removed from cart.")
     return redirect("cart")
 
 
 @login_required
 def checkout(request):
-    order = get_object_or_404(Order, user=request.user, is_paid=False)
-    total = Decimal(order.total_amount())
-    voucher = None
+    order = cart.open_order_or_404(request)
+    lines = cart.cart_lines(order)
+    summary = cart.get_summary(order)
+    total = summary["total"]
     discount = Decimal("0.00")
     new_total = total
 
 
-    vid = request.session.get("voucher_id")
-    if vid:
-        try:
-            voucher = Voucher.objects.get(id=vid, active=True)
-            discount = (total * Decimal(voucher.discount) / Decimal("100"))
-            new_total = total - discount
-        except Voucher.DoesNotExist:
-            pass
+    voucher = resolver.get_voucher(request.session.get("voucher_id"))
+    if voucher:
+        discount = (total * Decimal(voucher.discount) / Decimal("100"))
+        new_total = total - discount
 
     form = ShippingForm(instance=order) 
 
     return render(request, "store/checkout.html", {
         "order": order,
+        "lines": lines,
+        "summary": summary,
         "total": total,
         "voucher": voucher,
         "discount": discount,
@@ -183,15 +215,13 @@ def checkout(request):
         "shipping_form": form,
     })
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
 @login_required
 def create_checkout_session(request):
     if request.method != "POST":
         messages.error(request, "Invalid method.")
         return redirect("checkout")
 
-    order = get_object_or_404(Order, user=request.user, is_paid=False)
+    order = cart.open_order_or_404(request)
     if not order.items.exists():
         messages.error(request, "Your cart is empty.")
         return redirect("cart")
@@ -202,56 +232,30 @@ def create_checkout_session(request):
         return redirect("checkout")
     form.save()
 
-    line_items = []
-    for item in order.items.select_related('product'):
-        line_items.append({
-            "price_data": {
-                "currency": "eur",
-                "product_data": {"name": item.product.name},
-                "unit_amount": int(item.product.price * 100),
-            },
-            "quantity": item.quantity,
-        })
-
-    discounts_param = None
-    vid = request.session.get("voucher_id")
-    if vid:
-        try:
-            from vouchers.models import Voucher
-            v = Voucher.objects.get(id=vid, active=True)
-            coupon = stripe.Coupon.create(percent_off=int(v.discount), duration="once")
-            discounts_param = [{"coupon": coupon.id}]
-            try:
-                order.voucher = v
-                order.discount = int(v.discount)
-            except Exception:
-                pass
-        except Voucher.DoesNotExist:
-            pass
+    voucher = resolver.get_voucher(request.session.get("voucher_id"))
+    if voucher:
+        order.voucher = voucher
+        order.discount = int(voucher.discount)
 
     success_url = request.build_absolute_uri(reverse("payment_success")) + "?session_id={CHECKOUT_SESSION_ID}"
     cancel_url  = request.build_absolute_uri(reverse("payment_cancel"))
 
-    session = stripe.checkout.Session.create(
-        mode="payment",
-        payment_method_types=["card"],
-        line_items=line_items,
-        success_url=success_url,
-        cancel_url=cancel_url,
-        customer_email=request.user.email or None,
-        metadata={
-            "order_id": str(order.id),
-            "full_name": order.full_name,
-            "address1": order.address1,
-            "address2": order.address2,
-            "city": order.city,
-            "county": order.county,
-            "postcode": order.postcode,
-            "country": order.country,
-            "phone": order.phone,
-        },
-        **({"discounts": discounts_param} if discounts_param else {})
-    )
+    try:
+        expires_at = stock.reserve(order)
+    except stock.OutOfStock as exc:
+        messages.error(request, str(exc))
+        return redirect("cart")
+
+    # Freeze the prices the customer is quoted; Stripe line items read the snapshot.
+    cart.snapshot_prices(order.items.all())
+    try:
+        session = payments.create_checkout_session(
+            order, list(order.items.order_by('pk')), voucher, success_url, cancel_url,
+            customer_email=request.user.email or None, expires_at=stock.checkout_expires_at(expires_at),
+        )
+    except Exception:
+        stock.release_orders([order.pk])
+        raise
 
     order.stripe_checkout_session_id = session.id
     order.save()
@@ -265,6 +269,21 @@ def payment_success(request):
 
 @login_required
 def payment_cancel(request):
+    order = cart.get_open_order(request)
+    if order:
+        # Close the Stripe session before giving its stock back, so it cannot be paid with nothing held.
+        status = "expired"
+        if order.stripe_checkout_session_id:
+            try:
+                status = payments.expire_checkout_session(order.stripe_checkout_session_id)
+            except stripe.StripeError:
+                # Stripe unreachable: the hold stays until it expires with the session.
+                status = None
+        if status == "complete":
+            messages.info(request, "Your payment went through; the order will appear in your history shortly.")
+            return redirect("order_history")
+        if status == "expired":
+            stock.release_orders([order.pk])
     messages.info(request, "Payment cancelled. You can try again.")
     return redirect("cart")
 
@@ -283,23 +302,8 @@ def stripe_webhook(request):
     except stripe.error.SignatureVerificationError:
         return HttpResponse(status=400) 
 
-    if event["type"] == "checkout.session.completed":
-        session = event["data"]["object"]
-        session_id = session.get("id")
-
-        try:
-            order = Order.objects.get(stripe_checkout_session_id=session_id)
-        except Order.DoesNotExist:
-            return HttpResponse(status=200) 
-
-        if not order.is_paid:
-            for item in order.items.select_related('product'):
-                if hasattr(item.product, "stock"):
-                    item.product.stock = max(0, item.product.stock - item.quantity)
-                    item.product.save()
-
-            order.is_paid = True
-            order.save()
+    # Verified: queue it for the process_stripe_events worker and ack at once.
+    event_queue.enqueue(event.to_dict())
 
     return HttpResponse(status=200)
 
@@ -330,15 +334,10 @@ def remove_from_wishlist(request, pk):
 @login_required
 def move_wishlist_to_cart(request):
     wishlist, _ = Wishlist.objects.get_or_create(user=request.user)
-    order, _ = Order.objects.get_or_create(user=request.user, is_paid=False)
-
-    if wishlist.products.exists():
-        for product in wishlist.products.all():
-            item, created = OrderItem.objects.get_or_create(order=order, product=product)
-            if not created:
-                item.quantity += 1
-            item.save()
 
+    product_ids = list(wishlist.products.values_list('pk', flat=True))
+    if product_ids:
+        cart.add_items(cart.get_open_order(request, create=True), {pk: 1 for pk in product_ids})
         wishlist.products.clear()
         messages.success(request, "All wishlist items were added to your cart.")
     else:
@@ -352,10 +351,11 @@ def order_history(request):
     orders = (
         Order.objects
         .filter(user=request.user, is_paid=True)
-        .prefetch_related('items__product', 'items__product__category')
-        .order_by('-created_at')
+        .select_related('voucher')
+        .prefetch_related('items')
     )
-    return render(request, "store/order_history.html", {"orders": orders})
+    orders_page = CursorPaginator(orders, ('-created_at', '-pk'), per_page=10).get_page(request.GET.get('cursor'))
+    return render(request, "store/order_history.html", {"orders": orders_page})
 
 @login_required
 def reorder(request, order_id):
@@ -364,17 +364,12 @@ def reorder(request, order_id):
         return redirect("order_history")
 
     prev = get_object_or_404(Order, pk=order_id, user=request.user, is_paid=True)
-    cart, _ = Order.objects.get_or_create(user=request.user, is_paid=False)
+    open_order = cart.get_open_order(request, create=True)
 
-    for item in prev.items.select_related('product'):
-        new_item, created = OrderItem.objects.get_or_create(order=cart, product=item.product)
-        if created:
-            new_item.quantity = item.quantity
-        else:
-            new_item.quantity += item.quantity
-        new_item.save()
+    quantities = dict(prev.items.values_list('product_id', 'quantity'))
+    cart.add_items(open_order, quantities)
 
-    messages.success(request, f"Reordered {prev.items.count()} item(s) into your cart.")
+    messages.success(request, f"Reordered {len(quantities)} item(s) into your cart.")
     return redirect("cart")
 
 
@@ -384,3 +379,19 @@ def logout_view(request):
     logout(request)
     messages.info(request, "You have been logged out. See you soon!")
     return redirect("product_list")
+
+
+def image_rendition(request, path):
+    # Rendition names embed a hash of the image content, so they never change.
+    response = serve(request, path, document_root=os.path.join(settings.MEDIA_ROOT, images.RENDITIONS_DIR))
+    patch_cache_control(response, public=True, max_age=365 * 24 * 60 * 60, immutable=True)
+    return response
+
+
+def metrics_view(request):
+    # Prometheus scrape endpoint: staff users, or the METRICS_TOKEN bearer token.
+    auth = request.headers.get("Authorization", "")
+    token = settings.METRICS_TOKEN
+    if not (request.user.is_staff or (token and constant_time_compare(auth, f"Bearer {token}"))):
+        return HttpResponse(status=403)
+    return HttpResponse(instrumentation.render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
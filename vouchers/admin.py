@@ -1,11 +1,24 @@
 from django.contrib import admin
-from .models import Voucher
+from . import resolver
+from .models import Voucher, normalize_code
 
 
 class VoucherAdmin(admin.ModelAdmin):
     list_display = ['code', 'valid_from', 'valid_to', 'discount','active']
     list_filter = ['active', 'valid_from', 'valid_to']
-    search_fields = ['code']
+    search_fields = ['=code_normalized']
+    actions = ['deactivate']
 
+    def get_search_results(self, request, queryset, search_term):
+        # Codes are matched case-insensitively through the indexed normalized copy.
+        return super().get_search_results(request, queryset, normalize_code(search_term))
 
-admin.site.register(Voucher, VoucherAdmin)
\ No newline at end of file
+    @admin.action(description="Deactivate the selected vouchers")
+    def deactivate(self, request, queryset):
+        updated = queryset.update(active=False)
+        # update() sends no signals, so drop the cached copies here.
+        resolver.invalidate()
+        self.message_user(request, f"Deactivated {updated} vouchers.")
+
+
+admin.site.register(Voucher, VoucherAdmin)
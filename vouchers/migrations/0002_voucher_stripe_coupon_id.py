@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voucher',
+            name='stripe_coupon_id',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:59
+
+from django.db import migrations, models
+
+
+def backfill_code_normalized(apps, schema_editor):
+    Voucher = apps.get_model('vouchers', 'Voucher')
+    vouchers = list(Voucher.objects.only('pk', 'code'))
+    for voucher in vouchers:
+        voucher.code_normalized = voucher.code.strip().casefold()
+    Voucher.objects.bulk_update(vouchers, ['code_normalized'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0002_voucher_stripe_coupon_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voucher',
+            name='code_normalized',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=50),
+        ),
+        migrations.RunPython(backfill_code_normalized, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:10
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def deduplicate_codes(apps, schema_editor):
+    """
+    Keep the oldest voucher of each code that differs only in case and
+    deactivate the others, suffixing their code with their id so both the
+    code and its normalized copy become unique.
+    """
+    Voucher = apps.get_model('vouchers', 'Voucher')
+    clashes = (Voucher.objects.values('code_normalized').annotate(n=Count('pk')).filter(n__gt=1)
+               .values_list('code_normalized', flat=True))
+    for normalized in list(clashes):
+        for voucher in Voucher.objects.filter(code_normalized=normalized).order_by('pk')[1:]:
+            suffix = f"-dup{voucher.pk}"
+            voucher.code = voucher.code.strip()[:50 - len(suffix)] + suffix
+            voucher.code_normalized = voucher.code.strip().casefold()
+            voucher.active = False
+            voucher.save(update_fields=['code', 'code_normalized', 'active'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0003_voucher_code_normalized'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='voucher',
+            name='code_normalized',
+            field=models.CharField(default='', editable=False, max_length=50, unique=True),
+        ),
+    ]
@@ -1,14 +1,44 @@
 from django.db import models
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
+def normalize_code(code):
+    return (code or "").strip().casefold()
+
+
 class Voucher(models.Model):
     code = models.CharField(max_length=50, unique=True)
+    # Case-folded copy of ``code`` so lookups are an exact index probe; unique, so
+    # codes differing only in case cannot both exist.
+    code_normalized = models.CharField(max_length=50, unique=True, editable=False, default="")
     valid_from = models.DateTimeField()
     valid_to = models.DateTimeField()
     discount = models.IntegerField(validators=[MinValueValidator(0),
 MaxValueValidator(100)])
     active = models.BooleanField()
+    stripe_coupon_id = models.CharField(max_length=255, blank=True, editable=False)
 
     def __str__(self):
         return self.code
+
+    def clean(self):
+        super().clean()
+        normalized = normalize_code(self.code)
+        # Case folding can lengthen a code ("ß" becomes "ss") past what code_normalized holds.
+        max_length = Voucher._meta.get_field("code_normalized").max_length
+        if len(normalized) > max_length:
+            raise ValidationError({"code": f"This code is too long once case is ignored (at most {max_length} "
+                                           "characters)."})
+        if Voucher.objects.filter(code_normalized=normalized).exclude(pk=self.pk).exists():
+            raise ValidationError({"code": "A voucher with this code (ignoring case) already exists."})
+
+    def save(self, *args, **kwargs):
+        self.code_normalized = normalize_code(self.code)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "code" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "code_normalized"}
+        super().save(*args, **kwargs)
+
+    def is_valid(self, now):
+        return self.active and self.valid_from <= now <= self.valid_to
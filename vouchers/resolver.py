@@ -0,0 +1,134 @@
+"""
+Voucher resolution with an in-process LRU cache.
+
+Vouchers are looked up by normalized code (an indexed exact match) or by id
+and kept in a bounded LRU keyed both ways. Entries expire after
+``VOUCHER_CACHE_TTL`` seconds or at the voucher's ``valid_to``, whichever is
+sooner; unknown codes are cached briefly too, so repeated guesses never reach
+the database. Admin edits invalidate entries through signals by moving on a
+version kept in Django's cache, which the LRU keys embed: with a shared
+cache every process drops its copies at once, and with the per-process
+locmem cache the short TTL bounds how long others keep them.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Voucher, normalize_code
+
+CACHE_SIZE = getattr(settings, "VOUCHER_CACHE_SIZE", 4096)
+CACHE_TTL = getattr(settings, "VOUCHER_CACHE_TTL", 30)
+MISS_TTL = getattr(settings, "VOUCHER_CACHE_MISS_TTL", 30)
+VERSION_KEY = "vouchers:version"
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_MISSING = object()
+_cache = LRUCache(CACHE_SIZE)
+
+
+def _version():
+    # A version the cache has lost starts again at now, so no older entry can match it.
+    return cache.get_or_set(VERSION_KEY, time.time, None)
+
+
+def _remember(voucher, version, *keys):
+    if voucher is None:
+        for key in keys:
+            _cache.set(key, None, MISS_TTL)
+        return
+    ttl = min(CACHE_TTL, (voucher.valid_to - timezone.now()).total_seconds())
+    if ttl <= 0:
+        ttl = MISS_TTL
+    for key in ((version, "code", voucher.code_normalized), (version, "id", voucher.pk)):
+        _cache.set(key, voucher, ttl)
+
+
+def _usable(voucher, now):
+    return voucher if voucher is not None and voucher.is_valid(now or timezone.now()) else None
+
+
+def resolve_code(code, now=None):
+    """The voucher for ``code`` (any case) if it is usable now, else None."""
+    normalized = normalize_code(code)
+    if not normalized:
+        return None
+    version = _version()
+    key = (version, "code", normalized)
+    voucher = _cache.get(key, _MISSING)
+    if voucher is _MISSING:
+        voucher = Voucher.objects.filter(code_normalized=normalized).first()
+        _remember(voucher, version, key)
+    return _usable(voucher, now)
+
+
+def get_voucher(voucher_id, now=None):
+    """The voucher with ``voucher_id`` if it is usable now, else None."""
+    if not voucher_id:
+        return None
+    version = _version()
+    key = (version, "id", voucher_id)
+    voucher = _cache.get(key, _MISSING)
+    if voucher is _MISSING:
+        voucher = Voucher.objects.filter(pk=voucher_id).first()
+        _remember(voucher, version, key)
+    return _usable(voucher, now)
+
+
+async def aget_voucher(voucher_id, now=None):
+    """Async ``get_voucher``; cache hits never leave the event loop."""
+    if not voucher_id:
+        return None
+    version = _version()
+    key = (version, "id", voucher_id)
+    voucher = _cache.get(key, _MISSING)
+    if voucher is _MISSING:
+        voucher = await Voucher.objects.filter(pk=voucher_id).afirst()
+        _remember(voucher, version, key)
+    return _usable(voucher, now)
+
+
+def invalidate():
+    """Expire every cached voucher, in every process sharing the cache; entries for the old version age out."""
+    cache.set(VERSION_KEY, time.time(), None)
+
+
+def clear():
+    _cache.clear()
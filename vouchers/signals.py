@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import resolver
+from .models import Voucher
+
+
+@receiver(post_save, sender=Voucher)
+@receiver(post_delete, sender=Voucher)
+def invalidate_voucher(sender, instance, **kwargs):
+    resolver.invalidate()
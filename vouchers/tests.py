@@ -1,3 +1,50 @@
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
 from django.test import TestCase
+from django.utils import timezone
+
+from . import resolver
+from .models import Voucher
+
+
+def make_voucher(code, **fields):
+    now = timezone.now()
+    return Voucher.objects.create(code=code, discount=10, active=True, valid_from=now - timedelta(days=1),
+                                  valid_to=now + timedelta(days=1), **fields)
+
+
+class VoucherCodeTests(TestCase):
+    def setUp(self):
+        resolver.clear()
+        self.voucher = make_voucher("SAVE10")
+
+    def test_codes_differing_only_in_case_are_rejected(self):
+        with self.assertRaises(ValidationError):
+            Voucher(code=" save10", discount=10, active=True, valid_from=self.voucher.valid_from,
+                    valid_to=self.voucher.valid_to).full_clean()
+        with self.assertRaises(IntegrityError):
+            make_voucher("save10")
+
+    def test_resolve_code_ignores_case(self):
+        self.assertEqual(resolver.resolve_code(" Save10 "), self.voucher)
+        self.assertIsNone(resolver.resolve_code("SAVE20"))
+
+    def test_code_too_long_once_case_folded(self):
+        voucher = Voucher(code="ß" * 26, discount=10, active=True, valid_from=self.voucher.valid_from,
+                          valid_to=self.voucher.valid_to)
+        with self.assertRaises(ValidationError) as raised:
+            voucher.full_clean()
+        self.assertIn("code", raised.exception.message_dict)
 
-# Create your tests here.
+    def test_change_in_another_process(self):
+        self.assertEqual(resolver.resolve_code("SAVE10"), self.voucher)
+        self.assertEqual(resolver.get_voucher(self.voucher.pk), self.voucher)
+        # Deactivated elsewhere: the row changes and the shared version moves on, but no signal fires here.
+        Voucher.objects.filter(pk=self.voucher.pk).update(active=False)
+        cache.set(resolver.VERSION_KEY, time.time(), None)
+        self.assertIsNone(resolver.resolve_code("SAVE10"))
+        self.assertIsNone(resolver.get_voucher(self.voucher.pk))